@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark suite on synthetic star fields
+
+Times the star finder, global FWHM estimate, per-star measurement, star pairing,
+transform estimation, stack registration and combine over a sweep of frame
+sizes, star densities and stack depths. Each benchmark records the median wall
+time and throughput of repeated runs and, from one further run with tracemalloc
+on (which slows the code it traces), the peak traced memory, plus accuracy
+against the generator's ground truth where there is one. Results can be saved
+as a baseline and later runs compared against it, flagging regressions beyond a
+tolerance. The exit status is 1 if any benchmark fails or regresses.
+
+Usage
+----
+python benchmarks/bench_pipeline.py                          # quick: 4 MP, 200 stars/MP, 4 frames
+python benchmarks/bench_pipeline.py --full                   # 4 - 100 MP, 100 and 400 stars/MP, 4 and 16 frames
+python benchmarks/bench_pipeline.py --sizes 4 16 --depths 8 -o results.json
+python benchmarks/bench_pipeline.py --baseline results.json  # compare, exit 1 on regression
+
+Large sweeps need memory: a 100 MP, 16 frame combine holds the 16 frames
+(6.4 GB as float32) plus strip buffers.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stellate.astroimage import AstroImage
+from stellate.astrostack import AstroStack
+from stellate.instrument import Instrument, stage
+from stellate.synthetic import SyntheticField, random_transform
+
+QUICK = dict([('sizes', [4.0]), ('densities', [200.0]), ('depths', [4])])
+FULL = dict([('sizes', [4.0, 16.0, 36.0, 64.0, 100.0]), ('densities', [100.0, 400.0]), ('depths', [4, 16])])
+
+# Field settings shared by every case
+# The star finder thresholds the tophat image globally (Otsu), so only stars within
+# about a decade of the brightest are found - keep the flux range inside that
+FWHM = 3.5
+ASPECT = 1.5
+FLUX_RANGE = (2e4, 2e5)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Stellate pipeline benchmarks')
+    parser.add_argument('--full', action='store_true', help='full size, density and depth sweep')
+    parser.add_argument('--sizes', type=float, nargs='+', help='frame sizes in megapixels')
+    parser.add_argument('--densities', type=float, nargs='+', help='stars per megapixel')
+    parser.add_argument('--depths', type=int, nargs='+', help='frames per stack for register and combine')
+    parser.add_argument('--max-pairs', type=int, default=4000, help='stars per catalog for pairing (n x m memory)')
+    parser.add_argument('--n-stuff', type=int, default=500, help='star ROIs measured by _star_stuff')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default=None, help='results JSON file')
+    parser.add_argument('--baseline', default=None, help='baseline results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional slowdown')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show pipeline output')
+    args = parser.parse_args(argv)
+
+    sweep = dict(FULL if args.full else QUICK)
+    for key in ('sizes', 'densities', 'depths'):
+        if getattr(args, key):
+            sweep[key] = getattr(args, key)
+
+    results = []
+    for mp in sweep['sizes']:
+        for density in sweep['densities']:
+            for depth in sweep['depths']:
+                print('Case : %0.0f MP, %0.0f stars/MP, %d frames' % (mp, density, depth))
+                results += run_case(mp, density, depth, args)
+
+    doc = dict([('meta', run_metadata()), ('results', results)])
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(doc, fd, indent=2)
+        print('Results written to %s' % args.output)
+
+    n_failed = sum(r['error'] is not None for r in results)
+    if n_failed:
+        print('* %d benchmark(s) failed' % n_failed)
+
+    n_worse = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as fd:
+            baseline = json.load(fd)
+        n_worse = compare(results, baseline['results'], args.tolerance)
+
+    return 1 if n_failed or n_worse else 0
+
+
+def run_case(mp, density, depth, args):
+    """
+    All benchmarks for one frame size, star density and stack depth
+    """
+
+    rng = np.random.default_rng(args.seed)
+
+    nx = int(np.sqrt(mp * 1e6 * ASPECT))
+    ny = int(mp * 1e6 / nx)
+    field = SyntheticField((ny, nx), density=density, flux_range=FLUX_RANGE, seed=args.seed)
+    case = dict([('mp', mp), ('density', density), ('depth', depth)])
+
+    ref_img, ref_truth = field.frame(fwhm=FWHM, seed=args.seed)
+    T_true = random_transform(rng, max_shift=10.0, max_rot=0.2)
+    img, truth = field.frame(T_true, fwhm=FWHM, seed=args.seed + 1)
+
+    out = []
+
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+
+        # Global FWHM estimate (k-space), on a fresh frame each run since results are cached
+        r, fwhm = timed('estimate_global_fwhm', lambda: AstroImage(image=img).estimate_global_fwhm,
+                        ny * nx / 1e6, 'MP/s', args.repeats)
+        if r['error'] is None:
+            r['fwhm_error'] = float(fwhm - FWHM)
+        out.append(r)
+
+        # Full star finder
+        aimg_ref = AstroImage(image=ref_img)
+        aimg_ref.stars()
+        r, stars = timed('stars', lambda: AstroImage(image=img).stars, ny * nx / 1e6, 'MP/s', args.repeats)
+        if r['error'] is None:
+            r['n_found'] = len(stars)
+            r['n_true'] = len(truth['stars'])
+            r['precision'] = precision(stars, truth['stars'])
+        out.append(r)
+
+        # Per-star shape measurement on ROIs around the brightest true stars
+        aimg = AstroImage(image=img)
+        rois = star_rois(img, truth['stars'], args.n_stuff)
+        r, _ = timed('_star_stuff', lambda: lambda: [aimg._star_stuff(roi) for roi in rois],
+                     len(rois), 'stars/s', args.repeats)
+        out.append(r)
+
+        # Pairing on the true catalogs, brightest first, capped for the n x m distance matrix
+        ref_cat = brightest(ref_truth['stars'], args.max_pairs)
+        ind_cat = brightest(truth['stars'], args.max_pairs)
+        ref_cat['bright'], ind_cat['bright'] = ref_cat['flux'], ind_cat['flux']
+        matcher = AstroStack()
+        r, _ = timed('_pair_points', lambda: lambda: matcher._pair_points(ref_cat[['xc', 'yc', 'bright']].values,
+                                                                          ind_cat[['xc', 'yc', 'bright']].values),
+                     len(ref_cat), 'stars/s', args.repeats)
+        out.append(r)
+
+        # Transform estimation on the detected catalogs
+        r, res = timed('calc_transform', lambda: lambda: matcher.calc_transform(aimg_ref.stars(), stars),
+                       0 if stars is None else len(stars), 'stars/s', args.repeats)
+        if r['error'] is None:
+            r['corner_error_px'] = corner_error(T_true, res[0], (ny, nx))
+        out.append(r)
+
+        # Stack registration and combine from FITS frames
+        with tempfile.TemporaryDirectory() as tmp:
+
+            fnames = field.write_stack(tmp, depth, write_catalogs=False, seed=args.seed,
+                                       max_shift=10.0, max_rot=0.2, fwhm=FWHM)
+            with open(os.path.join(tmp, 'synth_truth.json'), 'r') as fd:
+                frames_true = json.load(fd)['frames']
+
+            def fresh_stack():
+                # Star catalog sidecars from an earlier run would skip detection
+                for fname in fnames:
+                    sidecar = os.path.splitext(fname)[0] + '_stars.json'
+                    if os.path.isfile(sidecar):
+                        os.remove(sidecar)
+
+                stack = AstroStack(fnames=fnames)
+
+                def register():
+                    stack.register()
+                    return stack
+
+                return register
+
+            r, stack = timed('register', fresh_stack, depth, 'frames/s', args.repeats)
+            if r['error'] is None:
+                r['max_corner_error_px'] = max(corner_error(np.array(f['params']), stack.astroimage(ic).transform(),
+                                                            (ny, nx)) for ic, f in enumerate(frames_true))
+            out.append(r)
+
+            if stack is None:
+                r = empty_result('combine', 'MP/s')
+                r['error'] = 'no registered stack'
+            else:
+                r, _ = timed('combine', lambda: lambda: stack.combine(100.0, 0.0, method='median',
+                                                                      fname=os.path.join(tmp, 'combined.fits'),
+                                                                      return_image=False),
+                             depth * ny * nx / 1e6, 'MP/s', args.repeats)
+            out.append(r)
+
+    for r in out:
+        r.update(case)
+
+    return out
+
+
+def timed(name, make, n_items, unit, repeats=3):
+    """
+    Time repeated runs as an instrumented stage, then measure peak memory in one more run
+    tracemalloc slows the code it traces, so it is off for the timed runs
+
+    :param make: callable, returns a fresh zero-argument run function (setup is not timed)
+    :param repeats: int, number of timed runs
+    :return: dict, benchmark result (median times), and the return value of the last run (None on error)
+    """
+
+    result = empty_result(name, unit)
+
+    walls, cpus = [], []
+    try:
+
+        for _ in range(max(repeats, 1)):
+            rec, _ = _run_stage(name, make(), track_memory=False)
+            walls.append(rec['wall_s'])
+            cpus.append(rec['cpu_s'])
+
+        rec, value = _run_stage(name, make(), track_memory=True)
+
+    except Exception as err:
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+        return result, None
+
+    result['wall_s'], result['cpu_s'] = float(np.median(walls)), float(np.median(cpus))
+    result['wall_min_s'] = float(np.min(walls))
+    result['repeats'] = len(walls)
+    result['peak_mb'] = rec['peak_mb']
+    result['throughput'] = n_items / result['wall_s'] if result['wall_s'] > 0.0 else float('inf')
+
+    return result, value
+
+
+def empty_result(name, unit):
+
+    return dict([('benchmark', name), ('wall_s', None), ('cpu_s', None), ('peak_mb', None),
+                 ('throughput', None), ('unit', unit), ('error', None)])
+
+
+def _run_stage(name, fn, track_memory):
+
+    with Instrument(track_memory=track_memory) as instr:
+        with stage(name):
+            value = fn()
+
+    rec = [r for r in instr.records() if r['stage'] == name][-1]
+
+    return rec, value
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare wall times against a baseline run
+
+    :return: int, number of regressions
+    """
+
+    def key(r):
+        return r['benchmark'], r['mp'], r['density'], r['depth']
+
+    base = dict([(key(r), r) for r in baseline])
+
+    print('')
+    print('Comparison with baseline (tolerance %0.0f%%)' % (100.0 * tolerance))
+    print('  %-22s %6s %8s %6s %10s %10s %8s' % ('benchmark', 'MP', 'stars/MP', 'depth', 'base (s)', 'now (s)', 'ratio'))
+
+    n_worse = 0
+    for r in results:
+
+        b = base.get(key(r))
+        if b is None or b['wall_s'] is None:
+            continue
+
+        if r['wall_s'] is None:
+            n_worse += 1
+            print('  %-22s %6.0f %8.0f %6d * failed : %s' % (r['benchmark'], r['mp'], r['density'], r['depth'],
+                                                          r['error']))
+            continue
+
+        ratio = r['wall_s'] / b['wall_s'] if b['wall_s'] > 0.0 else float('inf')
+        worse = ratio > 1.0 + tolerance
+        n_worse += worse
+
+        print('  %-22s %6.0f %8.0f %6d %10.3f %10.3f %8.2f %s' % (r['benchmark'], r['mp'], r['density'], r['depth'],
+                                                               b['wall_s'], r['wall_s'], ratio,
+                                                               '* regression' if worse else ''))
+
+    print('  %d regression(s)' % n_worse)
+
+    return n_worse
+
+
+def print_results(results):
+
+    print('')
+    print('  %-22s %6s %8s %6s %10s %12s %10s' % ('benchmark', 'MP', 'stars/MP', 'depth', 'wall (s)', 'throughput', 'peak (MB)'))
+
+    for r in results:
+        if r['error']:
+            print('  %-22s %6.0f %8.0f %6d * %s' % (r['benchmark'], r['mp'], r['density'], r['depth'], r['error']))
+        else:
+            print('  %-22s %6.0f %8.0f %6d %10.3f %12.1f %10.1f  %s' % (r['benchmark'], r['mp'], r['density'],
+                                                                       r['depth'], r['wall_s'], r['throughput'],
+                                                                       r['peak_mb'], r['unit']))
+
+
+def run_metadata():
+
+    return dict([
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('machine', platform.machine()),
+        ('processor', platform.processor()),
+        ('cpu_count', os.cpu_count()),
+    ])
+
+
+# Ground truth helpers
+
+def brightest(cat, n):
+    return cat.sort_values('flux', ascending=False).head(n).reset_index(drop=True)
+
+
+def star_rois(img, cat, n):
+    """
+    Square ROIs around the n brightest true stars, clear of the frame edge
+    """
+
+    hw = int(np.ceil(2.0 * FWHM))
+    ny, nx = img.shape
+
+    rois = []
+    for _, s in brightest(cat, 4 * n).iterrows():
+        x, y = int(round(s['xc'])), int(round(s['yc']))
+        if hw <= x < nx - hw and hw <= y < ny - hw:
+            rois.append(np.asarray(img[y - hw:y + hw + 1, x - hw:x + hw + 1], dtype=float))
+        if len(rois) >= n:
+            break
+
+    return rois
+
+
+def precision(found, true_cat, tol=1.5):
+    """
+    Fraction of detected stars within tol pixels of a true star
+    """
+
+    if len(found) < 1:
+        return 0.0
+
+    tx, ty = true_cat['xc'].values, true_cat['yc'].values
+    order = np.argsort(tx)
+    tx, ty = tx[order], ty[order]
+
+    n_match = 0
+    for x, y in zip(found['xc'].values, found['yc'].values):
+        i0, i1 = np.searchsorted(tx, [x - tol, x + tol])
+        n_match += np.any(np.hypot(tx[i0:i1] - x, ty[i0:i1] - y) < tol)
+
+    return n_match / float(len(found))
+
+
+def corner_error(T_true, T_est, shape):
+    """
+    Largest displacement error at the frame corners (pixels)
+    """
+
+    ny, nx = shape
+    corners = np.array([[0.0, 0.0, 1.0], [nx, 0.0, 1.0], [0.0, ny, 1.0], [nx, ny, 1.0]])
+
+    P_true = np.asarray(getattr(T_true, 'params', T_true))
+    P_est = np.asarray(getattr(T_est, 'params', T_est))
+
+    return float(np.max(np.abs(corners @ P_true.T - corners @ P_est.T)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for the Stellate processing core
+
+Each core module is imported in a fresh interpreter and the wall time is
+compared against a budget. The check also fails if importing the core pulls
+in a GUI binding (Qt, pyqtgraph) or eagerly loads one of the heavy
+scientific packages that should only load on first use.
+
+Usage: python benchmarks/import_time.py [--budget SECONDS] [--repeats N]
+Exit status is 0 if every module is within budget, 1 otherwise.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+CORE_MODULES = ('stellate.astroimage', 'stellate.astrostack', 'stellate.calibrate', 'stellate.lrgb',
+                'stellate.cli', 'stellate.jobs', 'stellate.prefetch')
+
+GUI_MODULES = ('PyQt5', 'PySide2', 'pyqtgraph')
+LAZY_MODULES = ('pandas', 'scipy', 'skimage', 'astropy')
+
+# Runs in the child interpreter; numpy is imported first so that only the cost of Stellate itself is timed
+PROBE = '''
+import sys, json, time
+import numpy
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps(dict([('seconds', dt), ('loaded', [m for m in {watch} if m in sys.modules])])))
+'''
+
+
+def probe(module, repeats=3):
+    """
+    Best-of-n import time and top-level packages loaded for one module
+    """
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([repo_dir, env.get('PYTHONPATH', '')])
+
+    code = PROBE.format(module=module, watch=repr(GUI_MODULES + LAZY_MODULES))
+
+    best, loaded = float('inf'), []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        best, loaded = min(best, res['seconds']), res['loaded']
+
+    return best, loaded
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Check Stellate core import times')
+    parser.add_argument('--budget', type=float, default=0.5, help='seconds allowed per module (default 0.5)')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print('')
+    print('Import time budget : %0.2f s' % args.budget)
+
+    n_fail = 0
+    for module in CORE_MODULES:
+
+        dt, loaded = probe(module, args.repeats)
+
+        problems = []
+        if dt > args.budget:
+            problems.append('over budget')
+        gui = [m for m in loaded if m in GUI_MODULES]
+        if gui:
+            problems.append('imports GUI bindings %s' % ', '.join(gui))
+        eager = [m for m in loaded if m in LAZY_MODULES]
+        if eager:
+            problems.append('eagerly imports %s' % ', '.join(eager))
+
+        n_fail += len(problems) > 0
+        print('  %-22s %6.3f s  %s' % (module, dt, '* ' + '; '.join(problems) if problems else 'ok'))
+
+    return 1 if n_fail else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
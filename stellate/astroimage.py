@@ -30,115 +30,180 @@ along with stellate.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import os
-import pandas as pd
 import numpy as np
-from astropy.io import fits
 from numpy.fft import fft2, fftshift
-from scipy.optimize import curve_fit
-from skimage.io import imread
-from skimage.morphology import binary_opening, remove_small_objects, white_tophat
-from skimage.morphology.selem import disk
-from skimage.restoration import estimate_sigma
-from skimage.measure import label, regionprops
-from skimage.transform import resize, AffineTransform
-from skimage.filters import threshold_otsu, gaussian
+from stellate.lazy import LazyModule
+from stellate.background import BackgroundModel
+from stellate.cosmetic import clean_image
+from stellate.demosaic import DemosaicRows, LuminanceRows, demosaic, luminance, parse_pattern
+from stellate.fitsrows import FITSRows
+from stellate.prescreen import make_thumbnail, thumbnail_metrics
+from stellate.pyramid import ImagePyramid
+from stellate.stretch import ImageHistogram
+from stellate.products import ProductGraph, ProductCache, MissingInput
+from stellate.instrument import stage
+
+# Heavy dependencies are imported on first use
+pd = LazyModule('pandas')
+fits = LazyModule('astropy.io.fits')
+optimize = LazyModule('scipy.optimize')
+skio = LazyModule('skimage.io')
+skmorph = LazyModule('skimage.morphology')
+skselem = LazyModule('skimage.morphology.selem')
+skmeasure = LazyModule('skimage.measure')
+sktransform = LazyModule('skimage.transform')
+skfilters = LazyModule('skimage.filters')
+
+# Large intermediate products of all frames share one bounded cache
+_product_cache = ProductCache(max_mb=512.0)
 
 
 class AstroImage:
 
-    def __init__(self, fname="", image=[], in_mem=True):
+    def __init__(self, fname="", image=[], in_mem=True, calib=None, thumb_bin=4, defer=False):
+        """
+        :param fname: str, FITS or PNG image filename
+        :param image: array, image data for frames without a file
+        :param in_mem: bool, keep the image data in memory after loading
+        :param calib: calibration library applied as the image loads
+        :param thumb_bin: int, binning factor of the pre-screening thumbnail
+        :param defer: bool, attach the image on first use instead of loading it now (see restore_state)
+        """
 
         # Filenames
         self._filename = fname
         self._filetype = self._guess_filetype(fname)
         self._stars_fname = self._replace_ext('_stars.json')
 
-        # Create minimal image and empty FITS header
-        self._image = np.zeros([3, 3])
-        self._fits_header = fits.PrimaryHDU().header
+        # Empty FITS header (deferred frames read theirs on attach)
+        self._fits_header = fits.Header() if defer else fits.PrimaryHDU().header
+        self._metadata = dict()
+
+        # Optional calibration library applied as the image loads
+        self._calib = calib
+        self._in_mem = in_mem
+
+        # Raw CFA data and Bayer pattern for one-shot-colour frames
+        self._cfa = []
+        self._bayer = ''
+
+        # Image and everything derived from it (thumbnail, FWHM, stars, display pyramid, ...)
+        # computed on first request and invalidated when the image changes
+        self._thumb_bin = thumb_bin
+        self._pyramid_callback = None
+        self._graph = self._build_graph()
 
-        # Derived image metrics
-        self._global_fwhm = -1.0
-        self._noise_sd = -1.0
-        self._imin = np.nan
-        self._imax = np.nan
+        # Star catalog summary restored from a session until the catalog itself is needed
+        self._star_summary = None
 
-        # Stars in image
-        self._stars = pd.DataFrame()
-        self._star_mask = []
-        self._transform = AffineTransform()
+        self._transform = sktransform.AffineTransform()
+        self._inlier_frac = np.nan
 
-        # Internal status flags
-        self._has_image = False
-        self._has_stars = False
+        # Counts changes not tracked by the product graph (transform, restored state)
+        self._revision = 0
+
+        # Frame waiting to be attached from its file (see restore_state)
+        self._deferred = defer and len(fname) > 0
 
         # Set image directly
         if len(image) > 0:
-            self._image = image
+            self._graph.set('image', image)
 
         # Load PNG or FITS image
-        if len(fname) > 0:
+        if len(fname) > 0 and not defer:
 
-            if self._filetype == 'FITS':
+            if not self.load():
+                return
 
-                try:
-                    with fits.open(fname) as hdu_list:
-                        self._fits_header = hdu_list[0].header
-                        # Load image temporarily to calculate intensity stats
-                        self._image = hdu_list[0].data
-                except IOError:
-                    print("* Problem loading %s" % fname)
-                    return
+            # Calculate intensity limits and pre-screening thumbnail while the image is loaded
+            self.intensity_stats()
+            self.thumbnail()
 
-                # Parse FITS header into astroimage metadata
-                self.parse_fits_header()
+            # Keep in memory or purge image data
+            if not in_mem:
+                self.purge()
 
-            elif self._filetype == 'PNG':
+    def load(self):
+        """
+        Read (or re-read) the image from disk, calibrating and extracting Bayer luminance as it loads
+        Lazy (not in memory) stacks use this to bring purged frames back for display
 
+        :return: bool, True if the image loaded
+        """
+
+        if self._filetype == 'FITS':
+
+            try:
+                with fits.open(self._filename) as hdu_list:
+                    self._fits_header = hdu_list[0].header
+                    # Load image temporarily to calculate intensity stats
+                    image = hdu_list[0].data
+            except IOError:
+                print("* Problem loading %s" % self._filename)
+                return False
+
+            # Parse FITS header into astroimage metadata
+            self.parse_fits_header()
+
+            # Calibrate raw frame in the same pass as loading
+            if self._calib is not None:
+                image = self._calib.apply(image, self._metadata)
+
+            # One-shot-colour frames keep the raw CFA for the final combine
+            # Detection and registration use a cheap luminance extract
+            # An unrecognised pattern leaves the frame mono rather than failing the load
+            if 'BAYERPAT' in self._fits_header:
+                xoff = self._fits_header.get('XBAYROFF', 0)
+                yoff = self._fits_header.get('YBAYROFF', 0)
                 try:
-                    self._image = imread(fname)
-                except IOError:
-                    print('* Problem loading %s' % fname)
-                    return
+                    self._bayer = parse_pattern(self._get_card('BAYERPAT'), xoff, yoff)
+                except ValueError as err:
+                    print('* %s in %s - treating as mono' % (err, self._filename))
+                    self._bayer = ''
+                else:
+                    self._cfa = image
+                    image = luminance(self._cfa)
+
+        elif self._filetype == 'PNG':
+
+            try:
+                image = skio.imread(self._filename)
+            except IOError:
+                print('* Problem loading %s' % self._filename)
+                return False
 
-            else:
-                print('* Unsupported image file type - returning')
-                return
+        else:
+            print('* Unsupported image file type - returning')
+            return False
 
-            # Calculate intensity limits
-            self.intensity_stats()
+        # Purged and deferred frames get the same data back, so what was derived from it stands
+        if self.has_image():
+            self._graph.set('image', image)
+        else:
+            self._graph.attach('image', image)
 
-            # Keep in memory or purge image data
-            if in_mem:
-                self._has_image = True
-            else:
-                self._image = []
-                self._has_image = False
+        self._deferred = False
 
-    def parse_fits_header(self):
+        return True
+
+    def purge(self):
+        """
+        Release the image data of a file-backed frame
+        Header, metadata, stars, transform and histogram are kept
+        """
+
+        if len(self._filename) < 1:
+            return
 
-        # Init the metadata dictionary
-        md = dict()
-
-        # Start filling fields
-        md['AcqDateLocal'] = self._get_card('DATE-LOC')
-        md['AcqDateUTC'] = self._get_card('DATE-OBS')
-        md['SensorGain'] = self._get_card('GAIN')
-        md['Telescope'] = self._get_card('TELESCOP')
-        md['Sensor'] = self._get_card('INSTRUME')
-        md['SensorTemperature'] = self._get_card('CCD-TEMP')
-        md['Dummy'] = self._get_card('DUMMY')
-        md['Object'] = self._get_card('TARGET')
-        md['Width'] = self._get_card('NAXIS1')
-        md['Height'] = self._get_card('NAXIS2')
-        md['Exposure'] = self._get_card('EXPOSURE')
-        md['Gain'] = self._get_card('GAIN')
-        md['Offset'] = self._get_card('OFFSET')
-
-        # Invert EGAIN from e-/ADU to ADU/e-
-        md['EGain'] = '%0.3f' % (1.0/float(self._get_card('EGAIN')))
-
-        self._metadata = md
+        self._graph.release('image')
+        self._graph.release('pyramid')
+        self._cfa = []
+
+    def in_memory(self):
+        return self._in_mem
+
+    def parse_fits_header(self):
+        self._metadata = header_metadata(self._fits_header)
 
     def stars(self, find_again=False, write_sidecar=False):
         """
@@ -148,15 +213,20 @@ class AstroImage:
         print('')
         print('Star Finder')
 
-        if not self._has_stars:
+        self._attach()
+
+        if find_again:
+            self._graph.invalidate('stars')
 
-            if not self._has_image:
+        if not self.has_stars():
+
+            if not self.has_image():
                 print('* Star Finder: No image loaded - returning')
-                return self._stars
+                return pd.DataFrame()
 
-            if self._image.size == 0:
+            if self.image().size == 0:
                 print('* Star Finder: Empty image - returning')
-                return self._stars
+                return pd.DataFrame()
 
             # Load available stars file if not recalculating
             if not find_again:
@@ -165,95 +235,156 @@ class AstroImage:
                     self.load_stars()
                     if self.num_stars() > 0:
                         print('  Loaded %d stars from sidecar' % self.num_stars())
-                        return self._stars
+                        return self._graph.get('stars')
                     else:
                         print('  Empty sidecar - refinding stars')
+                        self._graph.invalidate('stars')
 
-            ny, nx = self._image.shape
+            with stage('stars', frame=self._filename):
+                self._graph.get('stars')
 
-            # Estimate typical star global_fwhm in k-space
-            self.estimate_global_fwhm()
-            print('  Global global_fwhm estimate : %0.1f pixels' % self._global_fwhm)
+        # self.prune_stars()
 
-            # Matched Gaussian filter (sigma = global_fwhm/2)
-            # Low pass filter prior to downsampling
-            sigma_g = self._global_fwhm * 0.5
-            print('  Gaussian matched filter (sigma = %0.1f pixels' % sigma_g)
-            img_gauss = gaussian(self._image, sigma_g)
+        if write_sidecar:
+            self.write_stars()
 
-            # Matched resampling scale factor (global_fwhm = 4 pixels)
-            sf = 4.0 / self._global_fwhm
+        return self._graph.get('stars')
 
-            # Downsample image (bicubic, no antialiasing)
-            nxd = int(nx * sf)
-            nyd = int(ny * sf)
-            print('  Matched resampling to %d x %d' % (nxd, nyd))
-            img_dwn = resize(img_gauss, [nyd, nxd], order=3, anti_aliasing=False, mode='reflect')
+    def star_mask(self):
+        """
+        Full resolution star mask (bool) from the star finder's tophat threshold
 
-            # Structuring element on scale of typical star
-            # Radius = 5 works well after matched downsampling (empirical)
-            star_selem = disk(radius=5)
+        :return: 2D bool array or None if no image is loaded
+        """
 
-            # White tophat filter
-            # - suppress smooth background
-            # - highlight bright objects smaller than selem
-            print('  White tophat filtering to highlight stars')
-            imgd_wth = white_tophat(img_dwn, star_selem)
+        self._attach()
 
-            # Global Otsu threshold and remove small objects
-            star_maskd = imgd_wth > threshold_otsu(imgd_wth)
-            star_maskd = remove_small_objects(star_maskd, min_size=5)
+        try:
+            return np.asarray(self._graph.get('star_mask'), dtype=bool)
+        except MissingInput:
+            return None
 
-            # Upsample mask to original image dimensions
-            # order = 0 -> nearest neighbor
-            self._star_mask = np.uint8(resize(star_maskd, [ny, nx], order=0, anti_aliasing=False, mode='reflect'))
-            self._has_starmask = True
+    def clean(self, bad_map=None, cosmic=True, kappa=5.0):
+        """
+        Replace hot pixels and cosmic ray hits prior to star detection
 
-            # Label connected regions
-            print('  Labeling connected regions')
-            star_rois = label(self._star_mask)
+        :param bad_map: BadPixelMap, session bad pixel map
+        :param cosmic: bool, also detect and replace cosmic ray hits
+        :param kappa: float, cosmic ray threshold in robust sigma
+        """
 
-            # Note future proofing use of row-col coords
-            roi_props = regionprops(star_rois, self._image, coordinates='rc')
+        if not self.has_image():
+            print('* Clean: No image loaded - returning')
+            return
 
-            # Run through ROIs compiling relevant properties
-            star_list = []
+        image, n_bad, n_cr = clean_image(self.image(), bad_map, cosmic, kappa)
+        print('  Replaced %d bad pixels and %d cosmic ray pixels' % (n_bad, n_cr))
 
-            for rp in roi_props:
+        # Anything derived from the uncleaned image is invalidated with it
+        self._set_image(image)
 
-                # Star centroid in image space (row, col)
-                yc, xc = rp.weighted_centroid
+    def subtract_background(self, model=None):
+        """
+        Fit and subtract a smooth sky gradient, avoiding detected stars if available
 
-                # Estimate star global_fwhm and circularity from intensity ROI
-                diam, ecc, circ, bright = self._star_stuff(rp.intensity_image)
+        :param model: BackgroundModel, fitting options (defaults if None)
+        :return: 2D float32 array, background model or None on failure
+        """
 
-                star_list.append([xc, yc, diam, ecc, circ, bright])
+        if not self.has_image():
+            print('* Background: No image loaded - returning')
+            return None
 
-            # Convert list of star parameters to a Pandas dataframe
-            self._stars = pd.DataFrame(star_list, columns=['xc','yc','diam','ecc', 'circ', 'bright'])
+        if model is None:
+            model = BackgroundModel()
 
-            # Set stars found status
-            self._has_stars = True
+        # Avoid stars if a mask of the current image is at hand
+        star_mask = self._graph.peek('star_mask')
+        if star_mask is not None:
+            star_mask = np.asarray(star_mask, dtype=bool)
 
-        # self.prune_stars()
+        try:
+            image, bkg = model.subtract(self.image(), star_mask)
+        except ValueError as err:
+            print('* Background: %s - returning' % err)
+            return None
 
-        if write_sidecar:
-            self.write_stars()
+        print('  Background gradient range : %0.1f' % (np.max(bkg) - np.min(bkg)))
+
+        # Star detection thresholds and intensity limits depend on the background
+        self._set_image(image)
 
-        return self._stars
+        return bkg
+
+    def pyramid(self, tile_size=512, callback=None):
+        """
+        Display tile pyramid, built in the background on first request and cached
+
+        :param tile_size: int, tile size in pixels
+        :param callback: callable, notified from the build thread as each level completes
+                         (None keeps the current one, eg for a prefetch that must not detach the viewer)
+        :return: ImagePyramid or None if no image is loaded
+        """
+
+        if not self.has_image():
+            return None
+
+        if callback is not None:
+            self._pyramid_callback = callback
+
+        # A new tile size invalidates the pyramid
+        self._graph.set_params('pyramid', tile_size=tile_size)
+
+        pyr = self._graph.peek('pyramid')
+        if pyr is not None:
+            if callback is not None:
+                pyr.set_callback(callback)
+            return pyr
+
+        return self._graph.get('pyramid')
+
+    def histogram(self):
+        """
+        Intensity histogram for display stretches, computed once and cached
+
+        :return: ImageHistogram or None if no image is loaded
+        """
+
+        if not self.has_image():
+            return None
+
+        return self._graph.get('histogram')
+
+    def thumbnail(self):
+        try:
+            return self._graph.get('thumbnail')
+        except MissingInput:
+            return np.zeros([0, 0])
+
+    def thumbnail_metrics(self):
+        """
+        Background, noise, star count, FWHM and elongation estimated from the thumbnail
+        """
+
+        try:
+            return self._graph.get('thumb_metrics')
+        except MissingInput:
+            return thumbnail_metrics(self.thumbnail(), self._thumb_bin)
 
     def prune_stars(self):
         """
         Remove outliers and unlikely stars
         """
 
+        stars = self._graph.get('stars')
+
         # Extract numeric data from dataframe
-        bright = self._stars['bright']
-        diam = self._stars['diam']
-        circ = self._stars['circ']
+        bright = stars['bright']
+        diam = stars['diam']
+        circ = stars['circ']
 
         # Discard objects larger then 2 * global FWHM
-        too_big = diam > self._global_fwhm * 2.0
+        too_big = diam > self.estimate_global_fwhm() * 2.0
 
         # Keep top 25% brightest stars
         too_dim = bright < np.percentile(bright, 75)
@@ -264,27 +395,28 @@ class AstroImage:
         to_drop = np.where(too_big | too_dim | not_round)[0]
 
         # Prune rows
-        self._stars = self._stars.drop(to_drop, axis=0)
+        self._graph.set('stars', stars.drop(to_drop, axis=0))
 
     def write_stars(self):
         try:
             print('  Saving stars to %s' % self._stars_fname)
-            self._stars.to_json(self._stars_fname)
+            # Rename into place so an interrupted write never leaves a truncated catalog
+            tmp = self._stars_fname + '.tmp'
+            self._graph.peek('stars', pd.DataFrame()).to_json(tmp)
+            os.replace(tmp, self._stars_fname)
         except:
             print('* Problem writing stars to %s' % self._stars_fname)
 
     def load_stars(self):
         try:
             # Read stars to a JSON dataframe
-            self._stars = pd.read_json(self._stars_fname)
+            self._graph.set('stars', pd.read_json(self._stars_fname))
         except:
             print('* Problem loading stars from %s' % self._stars_fname)
-            self._stars = []
+            self._graph.set('stars', pd.DataFrame())
 
     def estimate_noise_sd(self):
-        if self._noise_sd < 0.0:
-            self._noise_sd = estimate_sigma(self._image)
-        return self._noise_sd
+        return self._graph.get('noise_sd')
 
     def estimate_global_fwhm(self):
         """
@@ -300,9 +432,301 @@ class AstroImage:
         Available: http://iopscience.iop.org/article/10.1088/1742-6596/849/1/012042/meta. [Accessed: 24-Oct-2018]
         """
 
-        if self._global_fwhm < 0.0:
+        return self._graph.get('fwhm')
+
+    def global_fwhm(self):
+        return self._graph.peek('fwhm', np.nan)
+
+    def set_transform(self, T, inlier_frac=np.nan):
+        self._transform = T
+        self._inlier_frac = inlier_frac
+        self._revision += 1
+
+    def inlier_fraction(self):
+        return self._inlier_frac
+
+    def revision(self):
+        """
+        Counter that changes whenever anything in frame_metrics() may have changed
+        (image products, star catalog, transform)
+        """
+
+        return self._revision + sum(self._graph.revision(name) for name in ('fwhm', 'noise_sd', 'stars'))
+
+    def frame_metrics(self):
+        """
+        Frame quality metrics used for integration weighting
+        FWHM and noise estimates are cached after the first call
+        """
+
+        return dict([
+            ('fwhm', self.estimate_global_fwhm()),
+            ('noise_sd', self.estimate_noise_sd()),
+            ('n_stars', self.num_stars()),
+            ('inlier_frac', self._inlier_frac),
+            ('mean_diam', self.mean_star_diameter()),
+            ('mean_circ', self.mean_star_circularity()),
+        ])
+
+    # Getters for protected attributes
+    def filename(self):
+        return self._filename
+
+    def stars_filename(self):
+        return self._stars_fname
+
+    def header(self):
+        self._attach()
+        return self._fits_header
+
+    def image(self):
+        self._attach()
+        return self._graph.peek('image', np.zeros([0, 0]))
+
+    def rows(self):
+        """
+        Image for windowed access (eg drizzle tiles) without holding it in memory
+        Purged FITS frames are read a window at a time from their file, calibrated and as luminance
+        for one-shot-colour frames just as load() would; anything else is the image itself
+
+        :return: 2D array, FITSRows or LuminanceRows
+        """
+
+        if self.has_image() or self._deferred or self._filetype != 'FITS':
+            return self.image()
+
+        return LuminanceRows(self._file_rows()) if self.is_color() else self._file_rows()
+
+    def is_color(self):
+        return len(self._bayer) > 0
+
+    def bayer_pattern(self):
+        return self._bayer
+
+    def color_image(self, method='bilinear'):
+        """
+        Demosaiced RGB image for one-shot-colour frames (luminance replicated for mono)
+
+        :param method: str, 'superpixel', 'bilinear' or 'edge'
+        :return: float32 array (ny, nx, 3), half resolution for superpixel
+        """
+
+        self._attach()
+
+        if not self.is_color():
+            return np.repeat(np.asarray(self.image(), dtype=np.float32)[:, :, np.newaxis], 3, axis=2)
+
+        return demosaic(self._cfa, self._bayer, method)
+
+    def color_channel(self, channel, method='bilinear'):
+        """
+        Single demosaiced channel (0 = R, 1 = G, 2 = B)
+        """
+
+        self._attach()
+
+        if not self.is_color():
+            return np.asarray(self.image(), dtype=np.float32)
+
+        return demosaic(self._cfa, self._bayer, method, channel=channel)
+
+    def channel_rows(self, channel, method='bilinear'):
+        """
+        Single channel demosaiced only for the rows asked for, for strip-wise combining
+        The raw CFA of purged frames is read from the file as the rows are needed
+        Mono frames return rows()
+
+        :return: DemosaicRows, 2D array or row source
+        """
 
-            ask = np.abs(fftshift(fft2(fftshift(self._image))))
+        self._attach()
+
+        if not self.is_color():
+            return self.rows()
+
+        cfa = self._cfa if len(self._cfa) > 0 else self._file_rows()
+
+        return DemosaicRows(cfa, self._bayer, method, channel)
+
+    def num_stars(self):
+        stars = self._graph.peek('stars')
+        if stars is None:
+            return self._star_summary['n_stars'] if self._star_summary else 0
+        return len(stars.index)
+
+    def transform(self):
+        return self._transform
+
+    def intensity_stats(self):
+        try:
+            return self._graph.get('intensity')
+        except MissingInput:
+            return np.nan, np.nan
+
+    def resize(self, ny, nx):
+        # Stars, FWHM and everything else measured at the old size are invalidated
+        self._set_image(sktransform.resize(self.image(), [ny, nx], order=3, mode='reflect', anti_aliasing=True))
+
+    def has_image(self):
+        return self._graph.has('image')
+
+    def has_stars(self):
+        return self._graph.has('stars')
+
+    def metadata(self):
+        return self._metadata
+
+    def mean_star_diameter(self):
+        return self._star_mean('diam', 'mean_diam')
+
+    def mean_star_eccentricity(self):
+        return self._star_mean('ecc', 'mean_ecc')
+
+    def mean_star_circularity(self):
+        return self._star_mean('circ', 'mean_circ')
+
+    def session_state(self):
+        """
+        Derived per-frame results for a session project file
+        The star catalog itself stays in its sidecar and only its summary is kept
+
+        :return: dict, JSON-serializable frame state
+        """
+
+        def _num(x):
+            return None if x is None or not np.isfinite(x) or x < 0.0 else float(x)
+
+        has_catalog = self.num_stars() > 0
+
+        return dict([
+            ('file', self._filename),
+            ('params', np.asarray(self._transform.params).tolist()),
+            ('inlier_frac', _num(self._inlier_frac)),
+            ('fwhm', _num(self._graph.peek('fwhm'))),
+            ('noise_sd', _num(self._graph.peek('noise_sd'))),
+            ('imin', _num(self.intensity_stats()[0])),
+            ('imax', _num(self.intensity_stats()[1])),
+            ('n_stars', int(self.num_stars())),
+            ('mean_diam', _num(self.mean_star_diameter()) if has_catalog else None),
+            ('mean_ecc', _num(self.mean_star_eccentricity()) if has_catalog else None),
+            ('mean_circ', _num(self.mean_star_circularity()) if has_catalog else None),
+            ('metadata', self._metadata),
+        ])
+
+    def restore_state(self, state):
+        """
+        Restore derived per-frame results from session_state() without touching the image
+        Frames created with defer=True attach their image, header and star catalog on first use
+        """
+
+        def _val(key, missing):
+            return missing if state.get(key) is None else state[key]
+
+        self._transform = sktransform.AffineTransform(matrix=np.array(state['params']))
+        self._inlier_frac = _val('inlier_frac', np.nan)
+        self._metadata = state.get('metadata') or dict()
+        self._revision += 1
+
+        # Restored as products of the image, so they stand when it attaches and go if it changes
+        for name in ('fwhm', 'noise_sd'):
+            if state.get(name) is not None:
+                self._graph.set(name, state[name])
+
+        if state.get('imin') is not None and state.get('imax') is not None:
+            self._graph.set('intensity', (state['imin'], state['imax']))
+
+        if state.get('n_stars'):
+            self._star_summary = dict([('n_stars', state['n_stars']),
+                                       ('mean_diam', _val('mean_diam', np.nan)),
+                                       ('mean_ecc', _val('mean_ecc', np.nan)),
+                                       ('mean_circ', _val('mean_circ', np.nan))])
+
+    # Internal methods
+
+    def _file_rows(self):
+        """
+        Raw frame read a window at a time from its FITS file, calibrated as load() would
+        """
+
+        if self._calib is None:
+            return FITSRows(self._filename)
+
+        return self._calib.frame_rows(self._filename, self._metadata)
+
+    def _attach(self):
+        """
+        Load a deferred frame the first time its data is needed
+        """
+
+        if self._deferred:
+            print('  Attaching %s' % self._filename)
+            self.load()
+            self._deferred = False
+
+    def _build_graph(self):
+        """
+        Derived products of the image, their inputs and parameters
+        """
+
+        graph = ProductGraph(cache=_product_cache)
+
+        graph.source('image')
+        graph.product('intensity', lambda image: (np.min(image), np.max(image)), inputs=['image'])
+        graph.product('thumbnail', make_thumbnail, inputs=['image'], params=dict([('bin_factor', self._thumb_bin)]))
+        graph.product('thumb_metrics', thumbnail_metrics, inputs=['thumbnail'],
+                      params=dict([('bin_factor', self._thumb_bin)]))
+        graph.product('histogram', ImageHistogram, inputs=['image'])
+        graph.product('pyramid', self._calc_pyramid, inputs=['image'], params=dict([('tile_size', 512)]))
+        graph.product('noise_sd', estimate_noise_sd, inputs=['image'])
+        graph.product('fwhm', self._calc_fwhm, inputs=['image'])
+
+        # Star detection chain, with the full frame intermediates in the bounded cache
+        graph.product('matched', self._calc_matched, inputs=['image', 'fwhm'], cached=True)
+        graph.product('star_mask', self._calc_star_mask, inputs=['matched', 'image'],
+                      params=dict([('radius', 5), ('min_size', 5)]), cached=True)
+        graph.product('stars', self._calc_stars, inputs=['image', 'star_mask'])
+
+        return graph
+
+    def _set_image(self, image):
+        """
+        Replace the image, invalidating everything derived from it
+        Intensity limits and thumbnail are recalculated straight away so they survive a purge
+        """
+
+        self._graph.set('image', image)
+        self._star_summary = None
+        self._revision += 1
+
+        self.intensity_stats()
+        self.thumbnail()
+
+    def _star_mean(self, column, summary_key):
+        """
+        Catalog mean of a star property (NaN for frames without stars)
+        """
+
+        stars = self._graph.peek('stars')
+
+        if stars is None and self._star_summary:
+            return self._star_summary[summary_key]
+
+        if stars is None or column not in stars.columns or len(stars.index) < 1:
+            return np.nan
+
+        return stars[column].mean()
+
+    def _calc_pyramid(self, image, tile_size):
+        return ImagePyramid(image, tile_size, self._pyramid_callback).start()
+
+    def _calc_fwhm(self, image):
+        """
+        Global FWHM product (see estimate_global_fwhm)
+        """
+
+        with stage('fwhm'):
+
+            ask = np.abs(fftshift(fft2(fftshift(image))))
 
             ny, nx = ask.shape
 
@@ -332,73 +756,94 @@ class AstroImage:
             guess = [np.max(Sr), np.mean(rv), 1.0]
 
             # Fit Gaussian to data
-            popt, pcov = curve_fit(self._gauss, xdata=rv, ydata=Sr, p0=guess)
+            popt, pcov = optimize.curve_fit(self._gauss, xdata=rv, ydata=Sr, p0=guess)
 
             # Extract star sigma_k estimate
             # Negative sigma_k solutions are possible and valid so take abs
             sigma_k = np.abs(popt[1])
 
-            self._global_fwhm = r_max / sigma_k
-            self._has_fwhm = True
+            return r_max / sigma_k
 
-        return self._global_fwhm
+    def _calc_matched(self, image, fwhm):
+        """
+        Matched Gaussian filter and resampling to a global FWHM of 4 pixels
+        """
 
-    def global_fwhm(self):
-        return self._global_fwhm
+        ny, nx = image.shape
 
-    def set_transform(self, T):
-        self._transform = T
+        print('  Global global_fwhm estimate : %0.1f pixels' % fwhm)
 
-    # Getters for protected attributes
-    def filename(self):
-        return self._filename
+        with stage('filter'):
+            # Matched Gaussian filter (sigma = global_fwhm/2)
+            # Low pass filter prior to downsampling
+            sigma_g = fwhm * 0.5
+            print('  Gaussian matched filter (sigma = %0.1f pixels' % sigma_g)
+            img_gauss = skfilters.gaussian(image, sigma_g)
 
-    def header(self):
-        return self._fits_header
+            # Matched resampling scale factor (global_fwhm = 4 pixels)
+            sf = 4.0 / fwhm
 
-    def image(self):
-        return self._image
+            # Downsample image (bicubic, no antialiasing)
+            nxd = int(nx * sf)
+            nyd = int(ny * sf)
+            print('  Matched resampling to %d x %d' % (nxd, nyd))
+            return sktransform.resize(img_gauss, [nyd, nxd], order=3, anti_aliasing=False, mode='reflect')
 
-    def num_stars(self):
-        return len(self._stars.index)
+    def _calc_star_mask(self, img_dwn, image, radius=5, min_size=5):
+        """
+        Tophat and threshold star mask at full resolution
+        """
 
-    def transform(self):
-        return self._transform
+        ny, nx = image.shape
 
-    def intensity_stats(self):
+        with stage('tophat'):
+            # Structuring element on scale of typical star
+            # Radius = 5 works well after matched downsampling (empirical)
+            star_selem = skselem.disk(radius=radius)
 
-        if self._has_image:
+            # White tophat filter
+            # - suppress smooth background
+            # - highlight bright objects smaller than selem
+            print('  White tophat filtering to highlight stars')
+            imgd_wth = skmorph.white_tophat(img_dwn, star_selem)
 
-            if np.isnan(self._imin):
-                self._imin = np.min(self._image)
+            # Global Otsu threshold and remove small objects
+            star_maskd = imgd_wth > skfilters.threshold_otsu(imgd_wth)
+            star_maskd = skmorph.remove_small_objects(star_maskd, min_size=min_size)
 
-            if np.isnan(self._imax):
-                self._imax = np.max(self._image)
+            # Upsample mask to original image dimensions
+            # order = 0 -> nearest neighbor
+            return np.uint8(sktransform.resize(star_maskd, [ny, nx], order=0, anti_aliasing=False, mode='reflect'))
 
-        return self._imin, self._imax
+    def _calc_stars(self, image, star_mask):
+        """
+        Label and measure stars in the star mask
+        """
 
-    def resize(self, ny, nx):
-        self._image = resize(self._image, [ny, nx], order=3, mode='reflect', anti_aliasing=True)
+        with stage('label'):
+            # Label connected regions
+            print('  Labeling connected regions')
+            star_rois = skmeasure.label(star_mask)
 
-    def has_image(self):
-        return self._has_image
+            # Note future proofing use of row-col coords
+            roi_props = skmeasure.regionprops(star_rois, image, coordinates='rc')
 
-    def has_stars(self):
-        return self._has_stars
+        with stage('measure'):
+            # Run through ROIs compiling relevant properties
+            star_list = []
 
-    def metadata(self):
-        return self._metadata
+            for rp in roi_props:
 
-    def mean_star_diameter(self):
-        return self._stars['diam'].mean()
+                # Star centroid in image space (row, col)
+                yc, xc = rp.weighted_centroid
 
-    def mean_star_eccentricity(self):
-        return self._stars['ecc'].mean()
+                # Estimate star global_fwhm and circularity from intensity ROI
+                diam, ecc, circ, bright = self._star_stuff(rp.intensity_image)
 
-    def mean_star_circularity(self):
-        return self._stars['circ'].mean()
+                star_list.append([xc, yc, diam, ecc, circ, bright])
 
-    # Internal methods
+            # Convert list of star parameters to a Pandas dataframe
+            return pd.DataFrame(star_list, columns=['xc','yc','diam','ecc', 'circ', 'bright'])
 
     def _gauss(self, x, a, b, c):
         return a * np.exp(-(x / b) ** 2) + c
@@ -421,11 +866,7 @@ class AstroImage:
         return root + ext_rep
 
     def _get_card(self, keyword):
-        if keyword in self._fits_header:
-            val = str(self._fits_header[keyword])
-        else:
-            val = ''
-        return val
+        return _card(self._fits_header, keyword)
 
     def _star_stuff(self, roi_img):
 
@@ -437,14 +878,14 @@ class AstroImage:
 
         # Otsu threshold ROI star image
         try:
-            roi_mask = roi_img > threshold_otsu(roi_img)
+            roi_mask = roi_img > skfilters.threshold_otsu(roi_img)
         except ValueError:
             print('* _star_stuff: Otsu threshold value error')
             print('* ROI dimensions : %d x %d' % (roi_img.shape[0], roi_img.shape[1]))
             return diam, ecc, circ, bright
 
         # Get binary mask region properties
-        roi_props = regionprops(label_image=roi_mask.astype(int), intensity_image=roi_img, coordinates='rc')
+        roi_props = skmeasure.regionprops(label_image=roi_mask.astype(int), intensity_image=roi_img, coordinates='rc')
 
 
         for rp in roi_props:
@@ -467,5 +908,61 @@ class AstroImage:
         return diam, ecc, circ, bright
 
 
+def header_metadata(hdr):
+    """
+    Stellate metadata from a FITS header, as shown in the metadata panel and used for calibration matching
+
+    :param hdr: astropy Header
+    :return: dict, metadata strings ('' for missing cards)
+    """
+
+    # Init the metadata dictionary
+    md = dict()
+
+    # Start filling fields
+    md['AcqDateLocal'] = _card(hdr, 'DATE-LOC')
+    md['AcqDateUTC'] = _card(hdr, 'DATE-OBS')
+    md['SensorGain'] = _card(hdr, 'GAIN')
+    md['Telescope'] = _card(hdr, 'TELESCOP')
+    md['Sensor'] = _card(hdr, 'INSTRUME')
+    md['SensorTemperature'] = _card(hdr, 'CCD-TEMP')
+    md['Dummy'] = _card(hdr, 'DUMMY')
+    md['Object'] = _card(hdr, 'TARGET')
+    md['Width'] = _card(hdr, 'NAXIS1')
+    md['Height'] = _card(hdr, 'NAXIS2')
+    md['Exposure'] = _card(hdr, 'EXPOSURE')
+    md['Gain'] = _card(hdr, 'GAIN')
+    md['Offset'] = _card(hdr, 'OFFSET')
+    md['BayerPattern'] = _card(hdr, 'BAYERPAT')
+
+    # Invert EGAIN from e-/ADU to ADU/e-
+    try:
+        md['EGain'] = '%0.3f' % (1.0/float(_card(hdr, 'EGAIN')))
+    except (ValueError, ZeroDivisionError):
+        md['EGain'] = ''
+
+    return md
+
+
+def estimate_noise_sd(image):
+    """
+    Gaussian noise SD from the median absolute second difference (Laplacian) of the image
+    Smooth background and gradients cancel in the second difference and the median ignores stars
+    For white noise the [1 -2 1] x [1 -2 1] kernel has unit-noise SD 6
+
+    :param image: 2D array
+    :return: float, noise standard deviation
+    """
+
+    img = np.asarray(image, dtype=np.float32)
+    if img.shape[0] < 3 or img.shape[1] < 3:
+        return 0.0
+
+    d = img[:-2] - 2.0 * img[1:-1] + img[2:]
+    d = d[:, :-2] - 2.0 * d[:, 1:-1] + d[:, 2:]
+
+    return float(1.4826 * np.median(np.abs(d)) / 6.0)
 
 
+def _card(hdr, keyword):
+    return str(hdr[keyword]) if keyword in hdr else ''
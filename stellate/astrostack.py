@@ -30,33 +30,61 @@ along with stellate.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import os
+import gzip
+import contextlib
+import json
 import numpy as np
 from stellate.astroimage import AstroImage
-from skimage.io import imread, imsave
-from skimage.exposure import rescale_intensity
-from skimage.measure import ransac
-from skimage.transform import AffineTransform, PolynomialTransform, warp
-from PyQt5.QtWidgets import QProgressBar, QApplication
+from stellate.background import BackgroundModel
+from stellate.calibrate import CalibrationLibrary
+from stellate.drizzle import Drizzle
+from stellate.combiner import StackCombiner, quality_weights
+from stellate.fitswriter import FITSStripWriter
+from stellate.cosmetic import BadPixelMap, MIN_DITHER_FWHM, measure_dither, sample_indices
+from stellate.demosaic import superpixel_transform
+from stellate.prescreen import PreScreen
+from stellate.jobs import JobCancelled
+from stellate.instrument import stage
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+pd = LazyModule('pandas')
+skmeasure = LazyModule('skimage.measure')
+sktransform = LazyModule('skimage.transform')
+
+# Session project file format version
+SESSION_VERSION = 1
+
+# Maximum residual in pixels for a star pair to count as matched by a registration transform
+MATCH_RESIDUAL = 2.0
+
 
 class AstroStack():
 
-    def __init__(self, nimgs=0, fnames=[], in_mem=True):
+    def __init__(self, nimgs=0, fnames=[], in_mem=True, calib=None):
 
         # Public attributes (get and set)
         self.ref_index = 0
 
         # Protected attributes
         self._fnames = fnames
+        self._metrics = pd.DataFrame()
+        self._metrics_key = None
+        self._bad_pixels = None
+        self._keep = None
+
+        # Calibration library applied as frames load, recorded with sessions
+        self._calib = calib
 
         if nimgs > 0:
             self._stack = [AstroImage()] * nimgs
         else:
             self._stack = []
 
-        # Load images into a list of AstroImages
+        # Load images into a list of AstroImages, calibrating each as it loads
         for fname in fnames:
             print('  Loading FITS image from %s' % fname)
-            self._stack.append(AstroImage(fname, in_mem))
+            self._stack.append(AstroImage(fname, in_mem=in_mem, calib=calib))
 
     def __len__(self):
         return len(self._stack)
@@ -65,7 +93,115 @@ class AstroStack():
 
         self._stack[idx] = AstroImage(fname)
 
-    def register(self, progbar=None):
+    def clean(self, cosmic=True, kappa_hot=5.0, kappa_cr=5.0, n_sample=16, darks=None, progress=None):
+        """
+        Replace hot pixels and cosmic ray hits in all images before star detection
+        The bad pixel map is built once and reused for every frame, from dark frames if given,
+        otherwise from the frames themselves if they are dithered by several FWHM
+
+        :param cosmic: bool, also detect and replace cosmic ray hits per frame
+        :param kappa_hot: float, bad pixel threshold in robust sigma
+        :param kappa_cr: float, cosmic ray threshold in robust sigma
+        :param n_sample: int, number of frames sampled for the bad pixel map
+        :param darks: list of 2D arrays, dark frames (or a master dark) for the bad pixel map
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        """
+
+        print('')
+        print('Cleaning hot pixels and cosmic rays')
+
+        if self._bad_pixels is None:
+            if darks is not None and len(darks) > 0:
+                self._bad_pixels = BadPixelMap.from_darks(darks, kappa=kappa_hot, n_sample=n_sample)
+            else:
+                self._bad_pixels = self._frames_bad_pixels(kappa_hot, n_sample)
+
+        for ic, aimg in enumerate(self._stack):
+
+            if progress:
+                progress(ic / float(len(self._stack)))
+
+            aimg.clean(self._bad_pixels, cosmic, kappa_cr)
+
+        if progress:
+            progress(1.0)
+
+    def subtract_background(self, model=None, progress=None):
+        """
+        Remove light pollution gradients from every frame before star detection and combining
+
+        :param model: BackgroundModel, fitting options shared by all frames
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        """
+
+        print('')
+        print('Subtracting background gradients')
+
+        if model is None:
+            model = BackgroundModel()
+
+        for ic, aimg in enumerate(self._stack):
+
+            if progress:
+                progress(ic / float(len(self._stack)))
+
+            aimg.subtract_background(model)
+
+        if progress:
+            progress(1.0)
+
+    def bad_pixels(self):
+        return self._bad_pixels
+
+    def set_bad_pixels(self, bad_map):
+        self._bad_pixels = bad_map
+
+    def prescreen(self, criteria=None):
+        """
+        Reject frames from thumbnail metrics before any full resolution processing
+
+        :param criteria: PreScreen, rejection thresholds (default PreScreen())
+        :return: bool array, True for frames kept
+        """
+
+        print('')
+        print('Pre-screening frames from thumbnails')
+
+        criteria = PreScreen() if criteria is None else criteria
+
+        metrics = [aimg.thumbnail_metrics() for aimg in self._stack]
+        self._keep, reasons = criteria.screen(metrics)
+
+        # Never reject the reference frame
+        if self.idx_in_range(self.ref_index):
+            self._keep[self.ref_index] = True
+
+        for ic, reason in enumerate(reasons):
+            if not self._keep[ic]:
+                print('  Rejecting %s : %s' % (os.path.basename(self._stack[ic].filename()), reason))
+
+        print('  Kept %d of %d frames' % (np.sum(self._keep), len(self)))
+
+        return self._keep
+
+    def screened(self):
+        """
+        Pre-screening status for each frame (all True before prescreen() is run)
+        """
+
+        if self._keep is None or len(self._keep) != len(self._stack):
+            return np.ones(len(self._stack), dtype=bool)
+
+        return self._keep
+
+    def register(self, progress=None, checkpoint=None, on_frame=None):
+        """
+        Register all frames to the reference frame
+
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        :param checkpoint: Checkpoint, record transforms as they are found and reuse those already recorded
+        :param on_frame: callable, on_frame(index) called as each frame's transform is set
+        """
 
         print('')
         print('Image stack registration')
@@ -74,23 +210,50 @@ class AstroStack():
             print('  More than one image required for stack registration - returning')
             return
 
-        # Fixed reference starfield
-        stars_ref = self._stack[self.ref_index].stars(write_sidecar=True)
+        if checkpoint:
+            n_done = checkpoint.begin_register(self._stack[self.ref_index].filename())
+            print('  Resuming from %d checkpointed transforms' % n_done)
+
+        # Fixed reference starfield, only needed once a frame has to be matched
+        stars_ref = None
+
+        keep = self.screened()
 
         for ic, aimg in enumerate(self._stack):
 
-            if progbar:
-                pp = ic / float(len(self._stack)) * 100.0
-                progbar.setValue(pp)
-                QApplication.processEvents()
+            if progress:
+                progress(ic / float(len(self._stack)))
+
+            # Frames rejected by pre-screening skip star finding entirely
+            if not keep[ic]:
+                continue
 
+            # Catalogs come back from their sidecars and are still needed for the frame metrics
             stars_ind = aimg.stars(write_sidecar=True)
 
+            done = checkpoint.transform(aimg.filename()) if checkpoint else None
+            if done is not None and done['params'] is not None:
+                inlier_frac = np.nan if done['inlier_frac'] is None else done['inlier_frac']
+                aimg.set_transform(sktransform.AffineTransform(matrix=np.array(done['params'])), inlier_frac)
+                if on_frame:
+                    on_frame(ic)
+                continue
+
+            if stars_ref is None:
+                stars_ref = self._stack[self.ref_index].stars(write_sidecar=True)
+
             # Calculate transform mapping the reference to individual starfields
-            T, inliers = self.calc_transform(stars_ref, stars_ind)
+            with stage('transform', frame=aimg.filename()):
+                T, inliers = self.calc_transform(stars_ref, stars_ind)
+
+            # Set astroimage transform and registration quality
+            aimg.set_transform(T, np.sum(inliers) / len(inliers))
+
+            if checkpoint:
+                checkpoint.add_transform(aimg.filename(), T.params, np.sum(inliers) / len(inliers))
 
-            # Set astroimage transform
-            aimg.set_transform(T)
+            if on_frame:
+                on_frame(ic)
 
             # Summarize transform
             print('')
@@ -99,20 +262,23 @@ class AstroStack():
             print('  Rotation        : %0.3f degrees' % np.rad2deg(T.rotation))
             print('  Inlier Fraction : %0.3f' % (np.sum(inliers)/len(inliers)))
 
-        # Reset progress bar
-        if progbar:
-            progbar.setValue(0.0)
+        if checkpoint:
+            checkpoint.flush()
+
+        if progress:
+            progress(1.0)
 
     def calc_transform(self, stars_ref, stars_ind):
         """
         Calculate the transform mapping the reference to individual starfields using RANSAC
+        refined by a least squares fit to the RANSAC inliers
 
         Note the direction of the optimized transform (ref -> ind) to match the interpolation
         transform required by skimage.transform.warp.
 
         :param stars_ref: Pandas dataframe, reference starfield
         :param stars_ind: Pandas dataframe, individual starfield
-        :return: transform
+        :return: transform, inliers (bool array of star pairs within MATCH_RESIDUAL of the refined transform)
         """
 
         # Extract source and reference star centroids as arrays
@@ -122,70 +288,464 @@ class AstroStack():
         n_ref, n_ind = len(ref_all), len(ind_all)
 
         # Find out which set is larger for pairing stars
-        if n_ind >= n_ref:
-            src, dst = self._pair_points(ref_all, ind_all)
-        else:
-            dst, src = self._pair_points(ind_all, ref_all)
+        with stage('match'):
+            if n_ind >= n_ref:
+                src, dst = self._pair_points(ref_all, ind_all)
+            else:
+                dst, src = self._pair_points(ind_all, ref_all)
 
         # Estimate transform model with RANSAC
-        T, inliers = ransac((src, dst),
-                            AffineTransform,
-                            min_samples=6,
-                            residual_threshold=2,
-                            max_trials=1000,
-                            stop_sample_num=12,
-                            stop_probability=0.99)
+        # Seeded and run for all trials, so the same catalogs always give the same model
+        with stage('ransac'):
+            T, inliers = skmeasure.ransac((src, dst),
+                                          sktransform.AffineTransform,
+                                          min_samples=6,
+                                          residual_threshold=MATCH_RESIDUAL,
+                                          max_trials=1000,
+                                          rng=0)
+
+        # Refit on the RANSAC inliers and count the pairs matching the refined model
+        # The match fraction weights frames and gates registration, so it must not depend on the RANSAC draw
+        if T is not None and np.sum(inliers) >= 6:
+            A = np.column_stack([src[inliers], np.ones(np.sum(inliers))])
+            coeffs = np.linalg.lstsq(A, dst[inliers], rcond=None)[0]
+            T = sktransform.AffineTransform(matrix=np.vstack([coeffs.T, [0.0, 0.0, 1.0]]))
+            inliers = T.residuals(src, dst) < MATCH_RESIDUAL
 
         return T, inliers
 
-    def combine(self, max_diam=100.0, min_circ=0.0, progbar=None):
+    def combine(self, max_diam=100.0, min_circ=0.0, progress=None, method='median', weighted=True, mem_mb=1024,
+                fname=None, return_image=True, color=False, demosaic_method='bilinear', kappa=3.0, max_iters=3,
+                checkpoint=None):
+        """
+        Combine registered images strip by strip within a memory budget
+        Each strip is streamed to a float32 FITS file as it is combined
+        One-shot-colour stacks are combined channel by channel into an RGB FITS cube when color is True
+
+        :param max_diam: float, maximum mean star diameter for inclusion
+        :param min_circ: float, minimum mean star circularity for inclusion
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        :param method: str, 'median', 'mean' or 'sigma' (sigma-clipped mean)
+        :param weighted: bool, weight frames by quality metrics
+        :param mem_mb: float, memory budget for the strip cube in MB
+        :param fname: str, output FITS filename (default <method>_combined.fits in the source directory)
+        :param return_image: bool, also assemble and return the combined image
+        :param color: bool, demosaic and combine R, G and B of one-shot-colour frames
+        :param demosaic_method: str, 'superpixel', 'bilinear' or 'edge'
+        :param kappa: float, rejection threshold in standard deviations for 'sigma'
+        :param max_iters: int, maximum rejection iterations for 'sigma'
+        :param checkpoint: Checkpoint, save each combined strip and reuse strips saved by an interrupted run
+        :return: img_comb, (ny, nx) or (ny, nx, 3) for color (None if return_image is False)
+        """
 
         print('')
-        print('Combining images (median)')
+        print('Combining images (%s%s)' % ('weighted ' if weighted else '', method))
+
+        # Per-frame weights (zero for excluded frames)
+        weights = self.frame_weights(max_diam, min_circ, weighted)
+        print('  Including %d of %d images' % (np.sum(weights > 0.0), len(self)))
+
+        # Frames held in memory are used as they are, purged frames are read from disk a strip at a time
+        ny, nx = self._stack[self.ref_index].rows().shape
+        transforms = [aimg.transform() for aimg in self._stack]
+
+        # Detection and registration ran on luminance - only the combine uses full colour
+        color = color and self._stack[self.ref_index].is_color()
+        channels = [0, 1, 2] if color else [None]
+
+        if color and demosaic_method == 'superpixel':
+            ny, nx = ny // 2, nx // 2
+            transforms = [superpixel_transform(T) for T in transforms]
+
+        # Save combined image to source directory by default
+        if fname is None:
+            dname = os.path.dirname(self._stack[0].filename())
+            fname = os.path.join(dname, '%s_combined.fits' % method)
+
+        out_shape = (len(channels), ny, nx) if color else (ny, nx)
+
+        provenance = dict([
+            ('fnames', [aimg.filename() for aimg in self._stack]),
+            ('weights', weights),
+            ('ref_index', self.ref_index),
+            ('method', method),
+            ('kappa', kappa if method == 'sigma' else None),
+            ('max_iters', max_iters if method == 'sigma' else None),
+            ('max_diam', max_diam),
+            ('min_circ', min_circ),
+        ])
+
+        if checkpoint:
+            n_done = checkpoint.begin_combine(provenance['fnames'], [T.params for T in transforms], weights,
+                                              method=method, kappa=kappa, max_iters=max_iters, shape=out_shape,
+                                              color=color, demosaic_method=demosaic_method)
+            print('  Resuming from %d checkpointed strips' % n_done)
+
+        print('  Streaming combined image to %s' % fname)
+
+        img_comb = np.zeros([ny, nx, len(channels)], dtype=np.float32) if return_image else None
+
+        template = self._stack[self.ref_index].header()
+        try:
+            with FITSStripWriter(fname, out_shape, provenance, template) as writer:
+
+                # Colour planes are written one after another
+                for ip, ch in enumerate(channels):
+
+                    if ch is None:
+                        images = [aimg.rows() if w > 0.0 else None for aimg, w in zip(self._stack, weights)]
+                    else:
+                        print('  Combining %s channel' % 'RGB'[ch])
+                        # Channels are demosaiced only for the rows each strip needs
+                        images = [aimg.channel_rows(ch, demosaic_method) if w > 0.0 else None
+                                  for aimg, w in zip(self._stack, weights)]
+
+                    combiner = StackCombiner(images, transforms, weights, (ny, nx), method=method,
+                                             kappa=kappa, max_iters=max_iters, mem_mb=mem_mb,
+                                             labels=provenance['fnames'])
+                    print('  Combining in strips of %d rows' % combiner.strip_rows)
+
+                    # Overall progress across colour planes
+                    def plane_progress(frac, ip=ip):
+                        if progress:
+                            progress((ip + frac) / len(channels))
+
+                    cached = None
+                    if checkpoint:
+                        def cached(r0, r1, ip=ip):
+                            return checkpoint.strip(ip, r0, r1)
+
+                    for r0, r1, strip in combiner.strips(plane_progress, cached):
+                        if checkpoint:
+                            checkpoint.save_strip(ip, r0, r1, strip)
+                        with stage('write'):
+                            writer.write(strip)
+                        if return_image:
+                            img_comb[r0:r1, :, ip] = strip
+
+        except JobCancelled:
+            # Do not leave a truncated FITS file behind
+            print('* Combine cancelled - removing %s' % fname)
+            if os.path.isfile(fname):
+                os.remove(fname)
+            raise
+
+        if checkpoint:
+            checkpoint.finish_combine()
+
+        if return_image and not color:
+            img_comb = img_comb[:, :, 0]
+
+        if progress:
+            progress(1.0)
+
+        return img_comb
+
+    def save_transforms(self, fname):
+        """
+        Write the registration transforms of all frames to a JSON file
+
+        :param fname: str, output JSON filename
+        """
+
+        frames = []
+        for aimg in self._stack:
+            frames.append(dict([
+                ('file', aimg.filename()),
+                ('params', np.asarray(aimg.transform().params).tolist()),
+                ('inlier_frac', None if np.isnan(aimg.inlier_fraction()) else float(aimg.inlier_fraction())),
+            ]))
+
+        doc = dict([('ref_index', int(self.ref_index)), ('frames', frames)])
+
+        with open(fname, 'w') as fd:
+            json.dump(doc, fd, indent=2)
+
+    def load_transforms(self, fname):
+        """
+        Set frame transforms from a JSON file written by save_transforms()
+        Frames are matched by filename. Frames missing from the file and frames with a null
+        transform (failed registration) are excluded, since they have no registration to combine with
+
+        :param fname: str, transforms JSON filename
+        :return: int, number of frames matched with a transform
+        """
+
+        with open(fname, 'r') as fd:
+            doc = json.load(fd)
+
+        by_file = dict([(os.path.abspath(f['file']), f) for f in doc['frames']])
 
-        # Construct image inclusion list
-        img_ok = np.zeros(len(self._stack))
+        keep = self.screened().copy()
+
+        n_matched = 0
         for ic, aimg in enumerate(self._stack):
-            img_ok[ic] = aimg.mean_star_diameter() < max_diam and aimg.mean_star_circularity() > min_circ
-        img_inc = np.where(img_ok)[0]
-        n_ok = len(img_inc)
 
-        # Preallocate memory for registered image array (2D x n_imgs)
-        ny, nx = self._stack[0].image().shape
+            f = by_file.get(os.path.abspath(aimg.filename()))
+            if f is None:
+                print('* No transform for %s - excluding it' % aimg.filename())
+                keep[ic] = False
+                continue
+
+            if f['params'] is None:
+                keep[ic] = False
+                continue
+
+            inlier_frac = np.nan if f['inlier_frac'] is None else f['inlier_frac']
+            aimg.set_transform(sktransform.AffineTransform(matrix=np.array(f['params'])), inlier_frac)
+
+            if os.path.abspath(doc['frames'][doc['ref_index']]['file']) == os.path.abspath(aimg.filename()):
+                self.ref_index = ic
+
+            n_matched += 1
+
+        self._keep = keep
+
+        return n_matched
+
+    def save_session(self, fname, settings=None):
+        """
+        Write the processed state of the stack to a compact session project file (gzipped JSON)
+        Frame files are stored relative to the project file so a session can move with its data,
+        together with their size and modification time so that results for modified frames are not reused,
+        and the calibration library with the masters each frame was calibrated with
+
+        :param fname: str, project filename
+        :param settings: dict, JSON-serializable application settings (eg inclusion thresholds)
+        """
+
+        pdir = os.path.dirname(os.path.abspath(fname))
+
+        frames = []
+        for aimg in self._stack:
+            state = aimg.session_state()
+            state['file'] = os.path.relpath(os.path.abspath(state['file']), pdir)
+            state['stamp'] = _frame_stamp(aimg.filename()) if os.path.isfile(aimg.filename()) else None
+            state['masters'] = None if self._calib is None else self._calib.masters_for(aimg.metadata())
+            frames.append(state)
+
+        keep = None if self._keep is None else [bool(k) for k in self._keep]
+
+        doc = dict([
+            ('version', SESSION_VERSION),
+            ('ref_index', int(self.ref_index)),
+            ('in_mem', all(aimg.in_memory() for aimg in self._stack)),
+            ('keep', keep),
+            ('calibration', None if self._calib is None else self._calib.settings()),
+            ('settings', settings or dict()),
+            ('frames', frames),
+        ])
+
+        tmp = fname + '.tmp'
+        with gzip.open(tmp, 'wt') as fd:
+            json.dump(doc, fd, separators=(',', ':'), default=str)
+        os.replace(tmp, fname)
+
+        print('  Saved session for %d frames to %s' % (len(frames), fname))
+
+    def load_session(self, fname, calib=None):
+        """
+        Replace the stack with a session saved by save_session()
+        Transforms, metrics and star summaries are restored immediately and each image
+        is attached from its file the first time it is needed
+        Missing frames are dropped, and frames modified since the session was saved or now
+        calibrated with different masters are loaded without their saved results
+
+        :param fname: str, project filename
+        :param calib: calibration library applied as images attach (default the library saved with the session)
+        :return: dict, application settings stored with the session
+        """
+
+        with gzip.open(fname, 'rt') as fd:
+            doc = json.load(fd)
+
+        if doc.get('version', 0) > SESSION_VERSION:
+            raise ValueError('Session %s was written by a newer version of Stellate' % fname)
 
-        img_array = np.zeros([ny, nx, n_ok])
+        pdir = os.path.dirname(os.path.abspath(fname))
 
-        for ic, aic in enumerate(img_inc):
+        saved_calib = doc.get('calibration')
+        if calib is None and saved_calib is not None:
+            if os.path.isdir(saved_calib['cache_dir']):
+                calib = CalibrationLibrary(**saved_calib)
+            else:
+                print('* Calibration masters in %s are missing - frames load uncalibrated'
+                      % saved_calib['cache_dir'])
 
-            if progbar:
-                pp = ic / float(n_ok) * 100.0
-                progbar.setValue(pp)
-                QApplication.processEvents()
+        self._calib = calib
+        self._stack = []
+        self.ref_index = 0
+        keep = []
+
+        for ic, state in enumerate(doc['frames']):
+
+            fname_img = os.path.normpath(os.path.join(pdir, state['file']))
+
+            if not os.path.isfile(fname_img):
+                print('* Frame %s is missing - dropping it from the session' % fname_img)
+                continue
+
+            if ic == doc['ref_index']:
+                self.ref_index = len(self._stack)
+
+            aimg = AstroImage(fname_img, in_mem=doc['in_mem'], calib=calib, defer=True)
+
+            # Results stand only for the same frame calibrated with the same masters
+            # Sessions written before stamps and masters were stored are trusted
+            masters = None if calib is None else calib.masters_for(state.get('metadata') or dict())
+            if state.get('stamp') is not None and state['stamp'] != _frame_stamp(fname_img):
+                print('  %s changed since the session was saved - results not restored' % fname_img)
+            elif 'masters' in state and state['masters'] != masters:
+                print('  %s is calibrated differently from the saved session - results not restored' % fname_img)
+            else:
+                aimg.restore_state(state)
+
+            self._stack.append(aimg)
+            keep.append(True if doc['keep'] is None else doc['keep'][ic])
+
+        self._fnames = [aimg.filename() for aimg in self._stack]
+        self._keep = None if doc['keep'] is None else np.array(keep, dtype=bool)
 
-            aimg = self._stack[aic]
+        print('  Restored session for %d frames from %s' % (len(self._stack), fname))
 
-            T = aimg.transform()
-            img = aimg.image()
+        return doc['settings']
 
-            # Apply transform, resize and store
-            img_array[:, :, ic] = warp(img, T, order=3)
+    def frame_metrics(self):
+        """
+        Table of per-frame quality metrics, cached until a frame, its star catalog or
+        transform, the pre-screening or the reference frame changes
+        """
+
+        if self._metrics_key != self._frames_key():
+
+            # Frames rejected by pre-screening are not measured
+            keep = self.screened()
+            rows = [aimg.frame_metrics() if keep[ic] else dict() for ic, aimg in enumerate(self._stack)]
+            self._metrics = pd.DataFrame(rows, columns=['fwhm', 'noise_sd', 'n_stars', 'inlier_frac',
+                                                        'mean_diam', 'mean_circ'])
+
+            # Reference frame is registered to itself
+            self._metrics.loc[self.ref_index, 'inlier_frac'] = 1.0
 
-        # Combine images
-        print('  Median combining registered image stack')
-        img_comb = np.median(img_array, axis=2, overwrite_input=True)
+            # Measuring computes products on demand, so key the table after it is built
+            self._metrics_key = self._frames_key()
 
-        # Condition image for export
-        img_png = rescale_intensity(img_comb, out_range='float64')
+        return self._metrics
+
+    def frame_weights(self, max_diam=100.0, min_circ=0.0, weighted=True):
+        """
+        Per-frame integration weights
+        Frames failing the diameter or circularity criteria get zero weight
+
+        :return: array, weights in [0, 1]
+        """
 
-        # Save combined image to source directory
-        dname = os.path.dirname(self._stack[0].filename())
-        fname = os.path.join(dname, 'median_combined.png')
-        print('Saving combined image to %s' % fname)
-        imsave(fname, img_comb)
+        weights = np.zeros(len(self._stack))
+        weights[self.included(max_diam, min_circ)] = 1.0
 
-        # Reset progress bar
-        if progbar:
-            progbar.setValue(0.0)
+        if weighted:
+            m = self.frame_metrics()
+            inlier_frac = m['inlier_frac'].fillna(1.0).values
+            weights *= quality_weights(m['fwhm'].values, m['noise_sd'].values, m['n_stars'].values, inlier_frac)
+
+        return weights
+
+    def drizzle(self, pixfrac=0.7, scale=2.0, max_diam=100.0, min_circ=0.0,
+                tile_size=1024, n_workers=4, progress=None, weighted=True, fname=None, return_image=True):
+        """
+        Drizzle registered images onto a reference grid scale times finer
+        Purged frames are read from disk only over each output tile's footprint
+
+        :param pixfrac: float, linear drop size as a fraction of the input pixel
+        :param scale: float, output pixels per reference pixel along each axis
+        :param max_diam: float, maximum mean star diameter for inclusion
+        :param min_circ: float, minimum mean star circularity for inclusion
+        :param tile_size: int, output tile edge in pixels
+        :param n_workers: int, number of frames drizzled in parallel
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        :param weighted: bool, weight frames by quality metrics
+        :param fname: str, stream the drizzled image to this FITS file and its weight map to <fname>_wht.fits
+        :param return_image: bool, also assemble and return the drizzled image and weight map
+        :return: img_driz, wht_driz (None, None if return_image is False)
+        """
+
+        print('')
+        print('Drizzling images (pixfrac %0.2f, scale %0.2f)' % (pixfrac, scale))
+
+        weights = self.frame_weights(max_diam, min_circ, weighted)
+        img_inc = np.where(weights > 0.0)[0]
+        print('  Including %d of %d images' % (len(img_inc), len(self)))
+
+        images = [self._stack[ic].rows() for ic in img_inc]
+        transforms = [self._stack[ic].transform() for ic in img_inc]
+        ref_shape = self._stack[self.ref_index].rows().shape
+
+        driz = Drizzle(pixfrac=pixfrac, scale=scale, tile_size=tile_size, n_workers=n_workers)
+        ny_out, nx_out = driz.output_shape(ref_shape)
+        print('  Output dimensions : %d x %d' % (nx_out, ny_out))
+
+        img_driz, wht_driz = None, None
+        if return_image:
+            img_driz = np.zeros([ny_out, nx_out], dtype=np.float32)
+            wht_driz = np.zeros([ny_out, nx_out], dtype=np.float32)
+
+        fname_wht = os.path.splitext(fname)[0] + '_wht.fits' if fname else None
+
+        provenance = dict([
+            ('fnames', [aimg.filename() for aimg in self._stack]),
+            ('weights', weights),
+            ('ref_index', self.ref_index),
+            ('method', 'drizzle'),
+            ('max_diam', max_diam),
+            ('min_circ', min_circ),
+        ])
+        template = self._stack[self.ref_index].header()
+
+        try:
+            with contextlib.ExitStack() as writers:
+
+                if fname:
+                    print('  Streaming drizzled image to %s' % fname)
+                    img_writer = writers.enter_context(FITSStripWriter(fname, (ny_out, nx_out), provenance, template))
+                    wht_writer = writers.enter_context(FITSStripWriter(fname_wht, (ny_out, nx_out), provenance,
+                                                                       template))
+
+                for r0, r1, img_band, wht_band in driz.strips(images, transforms, ref_shape,
+                                                              weights=weights[img_inc], progress=progress):
+                    if fname:
+                        with stage('write'):
+                            img_writer.write(img_band)
+                            wht_writer.write(wht_band)
+                    if return_image:
+                        img_driz[r0:r1] = img_band
+                        wht_driz[r0:r1] = wht_band
+
+        except JobCancelled:
+            # Do not leave truncated FITS files behind
+            for f in (fname, fname_wht):
+                if f and os.path.isfile(f):
+                    print('* Drizzle cancelled - removing %s' % f)
+                    os.remove(f)
+            raise
+
+        if progress:
+            progress(1.0)
+
+        return img_driz, wht_driz
+
+    def included(self, max_diam=100.0, min_circ=0.0):
+        """
+        Indices of images passing pre-screening and the mean star diameter and circularity criteria
+        """
+
+        keep = self.screened()
+
+        img_ok = np.zeros(len(self._stack), dtype=bool)
+        for ic, aimg in enumerate(self._stack):
+            if keep[ic]:
+                img_ok[ic] = aimg.mean_star_diameter() < max_diam and aimg.mean_star_circularity() > min_circ
+
+        return np.where(img_ok)[0]
 
     def enforce_size(self):
 
@@ -237,6 +797,38 @@ class AstroStack():
 
     # Internal methods
 
+    def _frames_bad_pixels(self, kappa, n_sample):
+        """
+        Bad pixel map from a sample of the light frames with their stars masked out
+        Star masks are only made once the frames are known to be dithered enough
+        """
+
+        frames = [aimg for aimg in self._stack if aimg.has_image()]
+        if len(frames) < 2:
+            return BadPixelMap()
+
+        sample = [frames[ic] for ic in sample_indices(len(frames), n_sample)]
+        images = [aimg.image() for aimg in sample]
+
+        fwhm = float(np.median([aimg.estimate_global_fwhm() for aimg in sample]))
+        dither = measure_dither(images)
+
+        star_masks = None
+        if dither >= MIN_DITHER_FWHM * fwhm:
+            star_masks = [aimg.star_mask() for aimg in sample]
+
+        return BadPixelMap.from_images(images, kappa=kappa, n_sample=len(images), star_masks=star_masks,
+                                       fwhm=fwhm, dither=dither)
+
+    def _frames_key(self):
+        """
+        State of the stack that the frame metrics depend on
+        """
+
+        frames = tuple((id(aimg), aimg.revision()) for aimg in self._stack)
+
+        return frames, tuple(self.screened()), self.ref_index
+
     def _pair_points(self, smaller, larger):
 
         """
@@ -284,13 +876,41 @@ class AstroStack():
         return src, dst
 
 
-class BicubicTransform(PolynomialTransform):
+def __getattr__(name):
+    """
+    Module attributes built on first use (skimage classes are imported lazily)
+    """
+
+    if name == 'BicubicTransform':
+        global BicubicTransform
+        BicubicTransform = _bicubic_transform_class()
+        return BicubicTransform
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def _frame_stamp(fname):
+    """
+    Size and modification time of a frame file, to detect frames changed since a session was saved
+    """
+
+    st = os.stat(fname)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _bicubic_transform_class():
+
+    class BicubicTransform(sktransform.PolynomialTransform):
+
+        def __init__(self):
+            super().__init__()
+
+        def estimate(self, src, dst, order=3):
+            super().estimate(src, dst, order)
 
-    def __init__(self):
-        super().__init__()
+        def residuals(self, src, dst):
+            super().residuals(src, dst)
 
-    def estimate(self, src, dst, order=3):
-        super().estimate(src, dst, order)
+    BicubicTransform.__qualname__ = 'BicubicTransform'
 
-    def residuals(self, src, dst):
-        super().residuals(src, dst)
+    return BicubicTransform
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Background gradient modelling and subtraction
+
+The sky is sampled on a coarse grid of boxes. Each box level is a sigma-clipped
+median of the pixels outside the star mask, computed for all boxes at once on
+a (boxes, pixels) array. A low order polynomial surface is fitted to the box
+levels with iterative rejection of outlying boxes. The 'rbf' method adds a
+smoothed thin plate spline through the polynomial residuals on a capped number
+of nodes, for gradients too complex for a low order polynomial. The model is
+evaluated on a low resolution grid and linearly upsampled to full resolution.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+interpolate = LazyModule('scipy.interpolate')
+
+
+class BackgroundModel:
+
+    def __init__(self, box=64, kappa=2.5, max_iters=3, method='poly', order=2, smooth=0.1,
+                 max_nodes=400, lowres=16, min_good=0.5, keep_level=True):
+        """
+        :param box: int, sample box size in pixels
+        :param kappa: float, clipping threshold in robust sigma, within boxes and between boxes
+        :param max_iters: int, clipping iterations
+        :param method: str, 'poly' or 'rbf' (polynomial plus smoothed thin plate spline residual)
+        :param order: int, polynomial order
+        :param smooth: float, thin plate spline smoothing (residuals are scaled to unit noise)
+        :param max_nodes: int, maximum number of RBF nodes
+        :param lowres: int, downsampling factor of the grid on which the model is evaluated
+        :param min_good: float, minimum fraction of unmasked, unclipped pixels for a box to be used
+        :param keep_level: bool, add the mean model level back so the sky pedestal is preserved
+        """
+
+        if method not in ('poly', 'rbf'):
+            raise ValueError('Unknown background method %s' % method)
+
+        self.box = box
+        self.kappa = kappa
+        self.max_iters = max_iters
+        self.method = method
+        self.order = order
+        self.smooth = smooth
+        self.max_nodes = max_nodes
+        self.lowres = lowres
+        self.min_good = min_good
+        self.keep_level = keep_level
+
+        self._shape = (0, 0)
+        self._samples = None
+        self._coeffs = None
+        self._rbf = None
+        self._rbf_scale = 1.0
+
+    def fit(self, image, star_mask=None):
+        """
+        Sample the background grid and fit the surface model
+
+        :param image: 2D array
+        :param star_mask: 2D bool array, True at star pixels to avoid (optional)
+        :return: self
+        """
+
+        self._shape = image.shape
+
+        yc, xc, level, good = sample_boxes(image, self.box, self.kappa, self.max_iters, star_mask, self.min_good)
+        yc, xc, level = yc[good], xc[good], level[good]
+
+        n_terms = (self.order + 1) * (self.order + 2) // 2
+        if len(level) < max(n_terms, 3):
+            raise ValueError('Only %d usable background boxes' % len(level))
+
+        u, v = self._normalize(yc, xc)
+
+        # Iterative rejection of boxes containing nebulosity, galaxies or residual stars
+        use = np.ones(len(level), dtype=bool)
+        for _ in range(self.max_iters):
+
+            self._fit_surface(u[use], v[use], level[use])
+            resid = level - self._eval_points(u, v)
+
+            sd = 1.4826 * np.median(np.abs(resid[use] - np.median(resid[use])))
+            new_use = np.abs(resid) <= self.kappa * max(sd, np.finfo(np.float32).tiny)
+
+            if np.array_equal(new_use, use) or np.sum(new_use) < n_terms:
+                break
+            use = new_use
+
+        # Final fit to the surviving boxes
+        self._fit_surface(u[use], v[use], level[use])
+        resid = level - self._eval_points(u, v)
+
+        self._samples = (yc[use], xc[use], level[use])
+
+        # Boxes rejected from the polynomial may hold real structure the RBF can follow
+        if self.method == 'rbf':
+            self._fit_rbf(u, v, resid)
+
+        return self
+
+    def evaluate(self, shape=None):
+        """
+        Background model at full resolution, evaluated on the low resolution grid and upsampled
+
+        :param shape: tuple, output (ny, nx), defaults to the fitted image shape
+        :return: 2D float32 array
+        """
+
+        ny, nx = self._shape if shape is None else shape
+        f = self.lowres
+
+        # Low resolution grid at the centers of f x f pixel blocks
+        yl = np.arange(0, ny, f) + 0.5 * (f - 1)
+        xl = np.arange(0, nx, f) + 0.5 * (f - 1)
+        yy, xx = np.meshgrid(yl, xl, indexing='ij')
+
+        u, v = self._normalize(yy.ravel(), xx.ravel())
+        low = self._eval_points(u, v).reshape(yy.shape).astype(np.float32)
+
+        return _upsample_linear(low, (ny, nx), f)
+
+    def subtract(self, image, star_mask=None):
+        """
+        Fit and remove the background gradient
+
+        :return: float32 background-subtracted image, float32 background model
+        """
+
+        self.fit(image, star_mask)
+        bkg = self.evaluate(image.shape)
+
+        img = np.asarray(image, dtype=np.float32) - bkg
+
+        if self.keep_level:
+            img += np.float32(np.mean(bkg))
+
+        return img, bkg
+
+    def samples(self):
+        """
+        Box centers and levels used in the final fit : (yc, xc, level)
+        """
+        return self._samples
+
+    # Internal methods
+
+    def _normalize(self, yc, xc):
+        ny, nx = self._shape
+        return (np.asarray(xc) - 0.5 * nx) / (0.5 * nx), (np.asarray(yc) - 0.5 * ny) / (0.5 * ny)
+
+    def _design(self, u, v):
+        return np.stack([u ** i * v ** j
+                         for i in range(self.order + 1)
+                         for j in range(self.order + 1 - i)], axis=-1)
+
+    def _fit_surface(self, u, v, level):
+        self._coeffs, _, _, _ = np.linalg.lstsq(self._design(u, v), level, rcond=None)
+        self._rbf = None
+
+    def _fit_rbf(self, u, v, resid):
+        """
+        Thin plate spline through the polynomial residuals on evenly spread nodes
+        """
+
+        if len(resid) > self.max_nodes:
+            keep = np.linspace(0, len(resid) - 1, self.max_nodes).astype(int)
+            u, v, resid = u[keep], v[keep], resid[keep]
+
+        # Residuals in noise units make the smoothing independent of the image scale
+        self._rbf_scale = max(1.4826 * np.median(np.abs(resid)), np.finfo(np.float32).tiny)
+        self._rbf = interpolate.RBFInterpolator(np.column_stack([u, v]), resid / self._rbf_scale,
+                                                kernel='thin_plate_spline', smoothing=self.smooth, degree=1)
+
+    def _eval_points(self, u, v):
+
+        z = self._design(u, v) @ self._coeffs
+
+        if self._rbf is not None:
+            z += self._rbf_scale * self._rbf(np.column_stack([u, v]))
+
+        return z
+
+
+def sample_boxes(image, box=64, kappa=2.5, max_iters=3, star_mask=None, min_good=0.5, max_samples=1024):
+    """
+    Sigma-clipped median level of every box in a grid, vectorized over all boxes
+    The grid is centered on the image; partial boxes at the edges are dropped.
+
+    :param image: 2D array
+    :param box: int, box size in pixels
+    :param kappa: float, clipping threshold in robust sigma
+    :param max_iters: int, clipping iterations
+    :param star_mask: 2D bool array, True at pixels to exclude (optional)
+    :param min_good: float, minimum fraction of surviving pixels for a good box
+    :param max_samples: int, pixels per box are subsampled on a regular lattice above this
+    :return: box center rows, box center cols, box levels, good box flags (1D arrays)
+    """
+
+    ny, nx = image.shape
+    nby, nbx = ny // box, nx // box
+
+    if nby < 1 or nbx < 1:
+        empty = np.zeros(0)
+        return empty, empty, empty, np.zeros(0, dtype=bool)
+
+    r0, c0 = (ny - nby * box) // 2, (nx - nbx * box) // 2
+
+    # Regular subsampling within each box keeps the cost independent of box size
+    s = max(1, int(np.ceil(box / np.sqrt(max_samples))))
+
+    def blocks(arr, dtype):
+        a = np.asarray(arr[r0:r0 + nby * box, c0:c0 + nbx * box], dtype=dtype)
+        a = a.reshape(nby, box, nbx, box)[:, ::s, :, ::s]
+        return a.transpose(0, 2, 1, 3).reshape(nby * nbx, -1)
+
+    x = blocks(image, np.float32)
+    n_pix = x.shape[1]
+
+    if star_mask is not None and np.shape(star_mask) == image.shape:
+        x[blocks(star_mask, bool)] = np.nan
+
+    for _ in range(max_iters):
+
+        med = _nanmedian_rows(x)[:, None]
+        sd = 1.4826 * _nanmedian_rows(np.abs(x - med))[:, None]
+
+        with np.errstate(invalid='ignore'):
+            clip = np.abs(x - med) > kappa * np.maximum(sd, np.finfo(np.float32).tiny)
+
+        if not np.any(clip):
+            break
+        x[clip] = np.nan
+
+    n_good = np.sum(np.isfinite(x), axis=1)
+    good = n_good >= min_good * n_pix
+
+    level = _nanmedian_rows(x)
+
+    yc, xc = np.meshgrid(r0 + box * np.arange(nby) + 0.5 * (box - 1),
+                         c0 + box * np.arange(nbx) + 0.5 * (box - 1), indexing='ij')
+
+    return yc.ravel(), xc.ravel(), level, good
+
+
+def _nanmedian_rows(x):
+    """
+    Median of each row ignoring NaNs, vectorized over rows (NaNs sort to the end)
+    """
+
+    xs = np.sort(x, axis=1)
+    n = np.sum(np.isfinite(xs), axis=1)
+
+    rows = np.arange(xs.shape[0])
+    lo = xs[rows, np.maximum((n - 1) // 2, 0)]
+    hi = xs[rows, n // 2 - (n == 0)]
+
+    return np.where(n > 0, 0.5 * (lo + hi), np.nan)
+
+
+def _upsample_linear(low, shape, f):
+    """
+    Separable linear upsampling of a grid sampled at the centers of f x f pixel blocks
+    """
+
+    ny, nx = shape
+
+    def axis_weights(n, n_low):
+        t = np.clip((np.arange(n) - 0.5 * (f - 1)) / f, 0.0, n_low - 1)
+        i0 = np.minimum(np.floor(t).astype(int), max(n_low - 2, 0))
+        i1 = np.minimum(i0 + 1, n_low - 1)
+        w = (t - i0).astype(np.float32)
+        return i0, i1, w
+
+    iy0, iy1, wy = axis_weights(ny, low.shape[0])
+    ix0, ix1, wx = axis_weights(nx, low.shape[1])
+
+    tmp = low[:, ix0] * (1.0 - wx) + low[:, ix1] * wx
+
+    return tmp[iy0] * (1.0 - wy)[:, None] + tmp[iy1] * wy[:, None]
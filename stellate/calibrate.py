@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Master bias, dark and flat creation and light frame calibration
+
+Masters are combined with the same strip-wise, memory-bounded combiner used
+for light frames, reading only the rows of each raw frame that a strip needs,
+written to a cache directory as float32 FITS and matched to light frames by
+exposure, gain, offset and sensor temperature from the parsed FITS header.
+Cached masters are keyed on those settings and a hash of the frame list and
+file stamps, so a changed or different set of frames builds a fresh master.
+
+    calibrated = (light - dark) / flat
+
+where dark is the master dark matched on exposure (bias included), or the
+master bias when no matching dark exists, and flat is the bias-subtracted
+master flat normalized to unit median.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import hashlib
+import numpy as np
+from stellate.astroimage import header_metadata
+from stellate.combiner import StackCombiner
+from stellate.fitsrows import FITSRows
+from stellate.fitswriter import FITSStripWriter
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+fits = LazyModule('astropy.io.fits')
+
+
+class CalibrationLibrary:
+
+    def __init__(self, cache_dir, temp_tol=2.0, method='sigma', mem_mb=1024):
+        """
+        :param cache_dir: str, directory holding master FITS files
+        :param temp_tol: float, maximum CCD-TEMP difference for a master to match (deg C)
+        :param method: str, combine method for masters ('median', 'mean' or 'sigma')
+        :param mem_mb: float, memory budget for combining masters in MB
+        """
+
+        self._cache_dir = cache_dir
+        self._temp_tol = temp_tol
+        self._method = method
+        self._mem_mb = mem_mb
+
+        # Master index and loaded master images keyed by filename
+        self._masters = []
+        self._images = dict()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """
+        Index masters already cached on disk
+        """
+
+        self._masters = []
+
+        for fname in sorted(glob.glob(os.path.join(self._cache_dir, 'master_*.fits'))):
+            try:
+                hdr = fits.getheader(fname)
+            except (IOError, OSError):
+                print('* Problem reading master header from %s' % fname)
+                continue
+            self._masters.append(self._master_entry(fname, hdr))
+
+        print('  Found %d cached calibration masters' % len(self._masters))
+
+    def build_master(self, kind, fnames, rebuild=False):
+        """
+        Combine bias, dark or flat frames into a cached master
+
+        :param kind: str, 'bias', 'dark' or 'flat'
+        :param fnames: list of str, calibration frame filenames
+        :param rebuild: bool, recombine even if a master for these settings is cached
+        :return: str, master filename
+        """
+
+        if kind not in ('bias', 'dark', 'flat'):
+            raise ValueError('Unknown calibration frame type %s' % kind)
+
+        print('')
+        print('Building master %s from %d frames' % (kind, len(fnames)))
+
+        if len(fnames) < 1:
+            print('* No calibration frames - returning')
+            return ''
+
+        # Settings from the first header and a hash of every frame's stamp key the cache,
+        # so a cached master is found without reading any pixels
+        try:
+            md = header_metadata(fits.getheader(fnames[0]))
+        except (IOError, OSError):
+            print('* Problem reading header from %s - returning' % fnames[0])
+            return ''
+
+        fname = os.path.join(self._cache_dir, self._master_fname(kind, md, self._frames_hash(fnames)))
+
+        if os.path.isfile(fname) and not rebuild:
+            print('  Using cached master %s' % fname)
+            return fname
+
+        # Frames are read a strip at a time as the combiner needs them
+        frames = []
+        for f in fnames:
+            try:
+                frames.append(self._frame_rows(kind, f))
+            except (IOError, OSError, ValueError):
+                print('* Problem loading %s' % f)
+
+        if len(frames) < 1:
+            print('* No calibration frames loaded - returning')
+            return ''
+
+        ny, nx = frames[0].shape
+        frames = [rows for rows in frames if rows.shape == (ny, nx)]
+        loaded = [rows.fname() for rows in frames]
+
+        combiner = StackCombiner(frames, [None] * len(frames), np.ones(len(frames)), (ny, nx),
+                                 method=self._method, mem_mb=self._mem_mb, order=1)
+
+        provenance = dict([
+            ('fnames', loaded),
+            ('weights', np.ones(len(loaded))),
+            ('method', self._method),
+            ('kappa', combiner.kappa if self._method == 'sigma' else None),
+            ('max_iters', combiner.max_iters if self._method == 'sigma' else None),
+        ])
+
+        print('  Streaming master %s to %s' % (kind, fname))
+
+        template = frames[0].header()
+
+        with FITSStripWriter(fname, (ny, nx), provenance, template) as writer:
+            for r0, r1, strip in combiner.strips():
+                writer.write(strip)
+
+        # Record frame type and matching keys in the master header
+        with fits.open(fname, mode='update') as hdu_list:
+            hdr = hdu_list[0].header
+            hdr['IMAGETYP'] = ('Master %s' % kind.capitalize(), 'Calibration master type')
+            for key in ('EXPOSURE', 'GAIN', 'OFFSET', 'CCD-TEMP'):
+                val = template.get(key)
+                if val is not None:
+                    hdr[key] = val
+
+        self._drop_superseded(fname)
+
+        self._images.pop(fname, None)
+        self.scan()
+
+        return fname
+
+    def match(self, kind, metadata):
+        """
+        Find the best cached master for a frame
+
+        Gain and offset must match exactly, exposure must also match for darks,
+        and the master with the closest sensor temperature within tolerance wins.
+
+        :param kind: str, 'bias', 'dark' or 'flat'
+        :param metadata: dict, AstroImage metadata from parse_fits_header
+        :return: str, master filename or '' if none matches
+        """
+
+        gain = self._to_float(metadata.get('Gain', ''))
+        offset = self._to_float(metadata.get('Offset', ''))
+        exposure = self._to_float(metadata.get('Exposure', ''))
+        temp = self._to_float(metadata.get('SensorTemperature', ''))
+
+        best, best_dt = '', np.inf
+
+        for m in self._masters:
+
+            if m['kind'] != kind:
+                continue
+            if not self._same(m['gain'], gain) or not self._same(m['offset'], offset):
+                continue
+            if kind == 'dark' and not self._same(m['exposure'], exposure):
+                continue
+
+            dt = 0.0 if np.isnan(temp) or np.isnan(m['temp']) else abs(m['temp'] - temp)
+            if dt <= self._temp_tol and dt < best_dt:
+                best, best_dt = m['fname'], dt
+
+        return best
+
+    def masters_for(self, metadata):
+        """
+        Names of the masters apply() uses for a frame, as recorded with a session
+
+        :param metadata: dict, AstroImage metadata from parse_fits_header
+        :return: dict, dark (or bias) and flat master filenames without directory ('' if none)
+        """
+
+        dark = self.match('dark', metadata) or self.match('bias', metadata)
+        flat = self.match('flat', metadata)
+
+        return dict([('dark', os.path.basename(dark)), ('flat', os.path.basename(flat))])
+
+    def settings(self):
+        """
+        Arguments that recreate this library, as recorded with a session
+        """
+
+        return dict([('cache_dir', os.path.abspath(self._cache_dir)), ('temp_tol', self._temp_tol),
+                     ('method', self._method), ('mem_mb', self._mem_mb)])
+
+    def apply(self, image, metadata):
+        """
+        Calibrate a raw light frame
+
+        :param image: 2D array, raw frame
+        :param metadata: dict, AstroImage metadata from parse_fits_header
+        :return: 2D float32 array, calibrated frame
+        """
+
+        img = np.asarray(image, dtype=np.float32)
+
+        dark = self.master('dark', metadata)
+        if dark is None:
+            dark = self.master('bias', metadata)
+
+        flat = self.master('flat', metadata)
+
+        if dark is not None and dark.shape == img.shape:
+            img = img - dark
+
+        if flat is not None and flat.shape == img.shape:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                img = np.where(flat > 0.0, img / flat, 0.0).astype(np.float32)
+
+        return img
+
+    def frame_rows(self, fname, metadata):
+        """
+        Raw light frame read a window at a time, calibrated as apply() would
+
+        :param fname: str, FITS filename
+        :param metadata: dict, AstroImage metadata from parse_fits_header
+        :return: FITSRows
+        """
+
+        rows = FITSRows(fname)
+
+        dark = self.master('dark', metadata)
+        if dark is None:
+            dark = self.master('bias', metadata)
+
+        flat = self.master('flat', metadata)
+
+        return FITSRows(fname,
+                        dark=dark if dark is not None and dark.shape == rows.shape else None,
+                        flat=flat if flat is not None and flat.shape == rows.shape else None)
+
+    def master(self, kind, metadata):
+        """
+        Matched master image, loaded from the cache directory once and kept in memory
+
+        :return: 2D float32 array or None
+        """
+
+        fname = self.match(kind, metadata)
+        if not fname:
+            return None
+
+        if fname not in self._images:
+            img = fits.getdata(fname).astype(np.float32)
+            if kind == 'flat':
+                img = img / np.median(img)
+            self._images[fname] = img
+
+        return self._images[fname]
+
+    # Internal methods
+
+    def _frame_rows(self, kind, fname):
+        """
+        Calibration frame read on demand, flats bias (or flat-dark) subtracted and normalized to unit median
+        """
+
+        rows = FITSRows(fname)
+        if kind != 'flat':
+            return rows
+
+        metadata = header_metadata(rows.header())
+
+        dark = self.master('dark', metadata)
+        if dark is None:
+            dark = self.master('bias', metadata)
+        if dark is not None and dark.shape != rows.shape:
+            dark = None
+
+        # The median needs the whole flat, read once here and released
+        med = np.median(np.asarray(FITSRows(fname, dark)))
+
+        return FITSRows(fname, dark, med if med > 0.0 else 1.0)
+
+    def _frames_hash(self, fnames):
+        """
+        Short hash of the frame list with each frame's size and modification time and the combine method
+        """
+
+        h = hashlib.sha1(self._method.encode())
+
+        for f in fnames:
+            try:
+                st = os.stat(f)
+                stamp = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                stamp = None
+            h.update(repr((os.path.abspath(f), stamp)).encode())
+
+        return h.hexdigest()[:10]
+
+    def _master_fname(self, kind, md, frames_hash):
+        parts = ['master', kind]
+        for key, tag in (('Exposure', 'exp'), ('Gain', 'gain'), ('Offset', 'off'), ('SensorTemperature', 't')):
+            val = md.get(key, '')
+            if val != '' and not (kind in ('bias', 'flat') and key == 'Exposure'):
+                parts.append('%s%s' % (tag, val))
+        parts.append(frames_hash)
+        return '_'.join(parts) + '.fits'
+
+    def _drop_superseded(self, fname):
+        """
+        Remove masters for the same settings built from a different set of frames
+        They would otherwise compete with the new master in match()
+        """
+
+        prefix = fname[:-len('.fits')].rsplit('_', 1)[0]
+
+        for old in glob.glob(prefix + '_*.fits'):
+            if old != fname and len(old) == len(fname):
+                print('  Removing superseded master %s' % old)
+                os.remove(old)
+                self._images.pop(old, None)
+
+    def _master_entry(self, fname, hdr):
+        kind = str(hdr.get('IMAGETYP', '')).lower().replace('master', '').strip()
+        return dict([
+            ('fname', fname),
+            ('kind', kind),
+            ('exposure', self._to_float(hdr.get('EXPOSURE', ''))),
+            ('gain', self._to_float(hdr.get('GAIN', ''))),
+            ('offset', self._to_float(hdr.get('OFFSET', ''))),
+            ('temp', self._to_float(hdr.get('CCD-TEMP', ''))),
+        ])
+
+    def _same(self, a, b):
+        # Missing values on either side are treated as matching
+        return np.isnan(a) or np.isnan(b) or np.isclose(a, b)
+
+    def _to_float(self, val):
+        try:
+            return float(val)
+        except (TypeError, ValueError):
+            return np.nan
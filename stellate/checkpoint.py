@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Checkpoints for resumable registration and combine runs
+
+A checkpoint directory holds the state of a long run that is expensive to
+recompute. Star catalogs already persist as per-frame sidecars next to each
+frame. The checkpoint adds:
+
+    register.json      transforms of the frames registered so far
+    strips/<key>/      completed combine strips, one .npy file per strip
+
+Every file is written to a temporary name and renamed into place, so a run
+killed at any point leaves only complete entries behind. A rerun with the same
+checkpoint directory skips frames and strips already done.
+
+Entries are only reused while they are still consistent with the run:
+- transforms are tied to the reference frame and each frame's file size and
+  modification time
+- combine strips are grouped under a key hashed from everything that determines
+  the pixel values (frames, transforms, weights, method and parameters)
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+
+class Checkpoint:
+
+    def __init__(self, dname, interval_s=30.0, context=None):
+        """
+        :param dname: str, checkpoint directory (created if necessary)
+        :param interval_s: float, minimum seconds between transform checkpoint writes
+        :param context: dict, extra run settings that change the pixel values (eg preprocessing flags)
+        """
+
+        self._dname = dname
+        self._interval_s = interval_s
+        self._context = context or dict()
+
+        self._register = dict([('ref', None), ('frames', dict())])
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        self._strips_dname = None
+
+        os.makedirs(dname, exist_ok=True)
+
+        fname = self._register_fname()
+        if os.path.isfile(fname):
+            with open(fname, 'r') as fd:
+                self._register = json.load(fd)
+
+    def dname(self):
+        return self._dname
+
+    # Registration
+
+    def begin_register(self, ref_fname):
+        """
+        Start or resume registration against a reference frame
+        Transforms recorded against a different or modified reference are discarded
+
+        :param ref_fname: str, reference frame filename
+        :return: int, number of frames with a reusable transform
+        """
+
+        ref = _file_stamp(ref_fname)
+
+        if self._register['ref'] != ref:
+            self._register = dict([('ref', ref), ('frames', dict())])
+            self._dirty = True
+            self.flush()
+
+        return len(self._register['frames'])
+
+    def transform(self, fname):
+        """
+        Recorded registration of a frame, if still valid
+
+        :param fname: str, frame filename
+        :return: dict with params (None for a failed frame) and inlier_frac, or None if not recorded
+        """
+
+        entry = self._register['frames'].get(os.path.abspath(fname))
+
+        if entry is None or entry['stamp'] != _file_stamp(fname):
+            return None
+
+        return entry
+
+    def add_transform(self, fname, params, inlier_frac, **extra):
+        """
+        Record the registration of one frame, writing the checkpoint if the interval has passed
+
+        :param fname: str, frame filename
+        :param params: array, 3 x 3 transform matrix (None for a failed frame)
+        :param inlier_frac: float, registration inlier fraction
+        :param extra: other JSON-serializable per-frame results (eg n_stars)
+        """
+
+        entry = dict([('stamp', _file_stamp(fname)),
+                      ('params', None if params is None else np.asarray(params).tolist()),
+                      ('inlier_frac', None if inlier_frac is None or np.isnan(inlier_frac) else float(inlier_frac))])
+        entry.update(extra)
+
+        self._register['frames'][os.path.abspath(fname)] = entry
+        self._dirty = True
+
+        if time.monotonic() - self._last_flush >= self._interval_s:
+            self.flush()
+
+    def flush(self):
+        """
+        Write recorded transforms to disk
+        """
+
+        if self._dirty:
+            _write_json(self._register_fname(), self._register)
+            self._dirty = False
+
+        self._last_flush = time.monotonic()
+
+    # Combine
+
+    def begin_combine(self, fnames, transforms, weights, **settings):
+        """
+        Start or resume a combine, discarding strips saved for any other combine
+
+        :param fnames: list of str, input frame filenames
+        :param transforms: list of 3 x 3 transform matrices
+        :param weights: array, per-frame weights
+        :param settings: other combine settings that change the result (method, kappa, shape, ...)
+        :return: int, number of completed strips found
+        """
+
+        doc = dict([
+            ('frames', [[os.path.abspath(f), _file_stamp(f)] for f in fnames]),
+            ('transforms', [np.asarray(T).tolist() for T in transforms]),
+            ('weights', [float(w) for w in weights]),
+            ('settings', settings),
+            ('context', self._context),
+        ])
+        key = hashlib.sha1(json.dumps(doc, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+        strips_root = os.path.join(self._dname, 'strips')
+        self._strips_dname = os.path.join(strips_root, key)
+
+        if os.path.isdir(strips_root):
+            for other in os.listdir(strips_root):
+                if other != key:
+                    shutil.rmtree(os.path.join(strips_root, other), ignore_errors=True)
+
+        os.makedirs(self._strips_dname, exist_ok=True)
+
+        return len([f for f in os.listdir(self._strips_dname) if f.endswith('.npy')])
+
+    def strip(self, plane, r0, r1):
+        """
+        Completed combine strip, or None if not yet saved
+        """
+
+        fname = self._strip_fname(plane, r0, r1)
+        if not os.path.isfile(fname):
+            return None
+
+        return np.load(fname)
+
+    def save_strip(self, plane, r0, r1, strip):
+
+        fname = self._strip_fname(plane, r0, r1)
+        if os.path.isfile(fname):
+            return
+
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as fd:
+            np.save(fd, np.asarray(strip, dtype=np.float32))
+        os.replace(tmp, fname)
+
+    def finish_combine(self):
+        """
+        Remove the saved strips once the combined image is safely written
+        """
+
+        if self._strips_dname and os.path.isdir(self._strips_dname):
+            shutil.rmtree(self._strips_dname, ignore_errors=True)
+
+        self._strips_dname = None
+
+    # Internal methods
+
+    def _register_fname(self):
+        return os.path.join(self._dname, 'register.json')
+
+    def _strip_fname(self, plane, r0, r1):
+
+        if self._strips_dname is None:
+            raise RuntimeError('begin_combine() must be called before accessing strips')
+
+        return os.path.join(self._strips_dname, 'p%d_r%06d_%06d.npy' % (plane, r0, r1))
+
+
+def _file_stamp(fname):
+    """
+    Identity of a file's contents for checkpoint validation (path, size, modification time)
+    """
+
+    st = os.stat(fname)
+    return [os.path.abspath(fname), st.st_size, st.st_mtime_ns]
+
+
+def _write_json(fname, doc):
+
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as fd:
+        json.dump(doc, fd)
+    os.replace(tmp, fname)
@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+"""
+Headless command line interface for batch processing
+
+Subcommands
+----
+detect   : find stars and write a _stars.json catalog beside each frame
+register : detect in parallel, then write the reference -> frame transforms to JSON
+combine  : combine frames using a transforms file (or registering in-process),
+           or drizzle them onto a finer grid with --drizzle
+pipeline : optional cleaning and background subtraction, detection, registration and combine
+distribute : coordinate a multi-node register and combine through a shared job directory
+work     : node worker for a distribute job (stellate work JOBDIR)
+
+Star detection runs over a pool of worker processes for detect and register.
+Nothing here imports Qt, so the CLI runs on render nodes without a display.
+
+Exit status
+----
+0 : success
+1 : failure, no output produced
+2 : command line usage error
+3 : partial success, some frames failed
+A JSON summary is also written with --status FILE (or '-' for stdout, in which
+case progress messages are sent to stderr).
+
+Per-stage wall time and CPU time are recorded with --timings FILE (JSON) or
+--trace FILE (Chrome trace events), including the stages run in the detection
+worker processes. --memory adds per-stage peak memory from tracemalloc, which
+slows the run, so take timings and memory from separate runs. CPU time is for
+the whole process, so it is not per-stage when detection runs in threads
+(pipeline command). --cprofile FILE also profiles the main process.
+
+Frames that are cloudy, trailed or out of focus are rejected from binned
+thumbnails before any star finding with --prescreen (register, combine and
+pipeline, thresholds relative to the stack median, see stellate.prescreen).
+
+Light frames are calibrated as they load in combine and pipeline with
+--bias, --dark and --flat (frames combined into cached masters, see
+stellate.calibrate) and/or --calib-dir (a directory of masters).
+
+Long register, combine and pipeline runs can be resumed with --checkpoint DIR.
+Rerunning the same command after a crash or pre-emption reuses the transforms
+and combined strips already recorded there (see stellate.checkpoint).
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from stellate.instrument import Instrument, active, stage
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_PARTIAL = 3
+
+COMMANDS = ('detect', 'register', 'combine', 'pipeline', 'distribute')
+
+
+def main(argv=None):
+    """
+    Parse arguments, run a subcommand and return the exit status
+    """
+
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+
+    # Node workers take their frames from the job directory
+    if args.command == 'work':
+        return cmd_work(args)
+
+    fnames = expand_globs(args.files)
+    if len(fnames) < 1:
+        print('* No input files match %s' % ' '.join(args.files), file=sys.stderr)
+        return EXIT_USAGE
+
+    if hasattr(args, 'ref') and not 0 <= args.ref < len(fnames):
+        print('* --ref %d is out of range for %d frames' % (args.ref, len(fnames)), file=sys.stderr)
+        return EXIT_USAGE
+
+    if getattr(args, 'drizzle', False) and not (0.0 < args.pixfrac <= 1.0 and args.scale > 0.0):
+        print('* --pixfrac must be in (0, 1] and --scale positive', file=sys.stderr)
+        return EXIT_USAGE
+
+    # Keep stdout clean for a JSON status report
+    chatter = sys.stderr if args.status == '-' else sys.stdout
+
+    # Stage instrumentation only when one of its outputs is requested
+    instr = None
+    if args.timings or args.trace or args.cprofile or args.memory:
+        instr = Instrument(track_memory=args.memory, profile=args.cprofile is not None)
+
+    with contextlib.redirect_stdout(chatter):
+
+        if instr:
+            instr.start()
+
+        try:
+            status = _COMMAND_FNS[args.command](fnames, args)
+        except Exception as err:
+            status = dict([('status', 'failed'), ('error', '%s: %s' % (type(err).__name__, err))])
+        finally:
+            if instr:
+                instr.stop()
+
+        if instr:
+            _write_timings(instr, args)
+
+    status['command'] = args.command
+    status['exit_code'] = dict([('ok', EXIT_OK), ('partial', EXIT_PARTIAL)]).get(status['status'], EXIT_FAILED)
+
+    if args.status:
+        write_status(status, args.status)
+
+    return status['exit_code']
+
+
+def expand_globs(patterns):
+    """
+    Expand shell-style patterns in order, dropping duplicates
+
+    :param patterns: list of str, filenames or glob patterns
+    :return: list of str, matching filenames
+    """
+
+    fnames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for fname in matches:
+            if os.path.isfile(fname) and fname not in fnames:
+                fnames.append(fname)
+
+    return fnames
+
+
+def write_status(status, dest):
+
+    text = json.dumps(status, indent=2, default=str)
+
+    if dest == '-':
+        print(text)
+    else:
+        with open(dest, 'w') as fd:
+            fd.write(text + '\n')
+
+
+def detect_frame(fname, find_again=False, instrument=False, memory=False):
+    """
+    Find stars in one frame and write its catalog sidecar (runs in a worker process)
+
+    :param instrument: bool, return the stage timings from this process with the result
+    :param memory: bool, also record peak memory in those timings
+    :return: dict, per-frame result
+    """
+
+    if instrument:
+        with Instrument(track_memory=memory) as instr:
+            result = detect_frame(fname, find_again)
+        result['timings'] = instr.records()
+        return result
+
+    from stellate.astroimage import AstroImage
+
+    result = dict([('file', fname), ('status', 'failed'), ('n_stars', 0)])
+
+    try:
+        aimg = AstroImage(fname)
+        if not aimg.has_image():
+            result['error'] = 'could not load image'
+            return result
+
+        stars = aimg.stars(find_again=find_again, write_sidecar=True)
+        result['n_stars'] = len(stars)
+        result['catalog'] = aimg.stars_filename()
+        result['stars'] = stars
+        result['status'] = 'ok' if len(stars) > 0 else 'failed'
+
+    except Exception as err:
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+
+    return result
+
+
+# Subcommands
+
+def cmd_detect(fnames, args):
+
+    results = _detect_all(fnames, args.workers, args.force)
+    for r in results:
+        r.pop('stars', None)
+
+    return _summary(results)
+
+
+def cmd_register(fnames, args):
+
+    from skimage.transform import AffineTransform
+    from stellate.astrostack import AstroStack
+
+    ref = args.ref
+
+    # Screening only needs the thumbnails, so frames are released as soon as they are binned
+    keep = [True] * len(fnames)
+    if args.prescreen:
+        screen = AstroStack(fnames=fnames, in_mem=False)
+        screen.ref_index = ref
+        keep = _prescreen(screen, args)
+
+    # Rejected frames skip star finding and keep a null transform
+    detected = iter(_detect_all([f for f, k in zip(fnames, keep) if k], args.workers, args.force))
+    results = [next(detected) if k else dict([('file', f), ('status', 'excluded'), ('n_stars', 0)])
+               for f, k in zip(fnames, keep)]
+
+    if results[ref]['status'] != 'ok':
+        return dict([('status', 'failed'), ('error', 'no stars in reference frame %s' % fnames[ref]),
+                     ('frames', _strip_stars(results))])
+
+    # Transforms only need the catalogs, so the stack is built without image data
+    matcher = AstroStack()
+    stars_ref = results[ref]['stars']
+
+    ckpt = _checkpoint(args)
+    if ckpt:
+        print('  Resuming from %d checkpointed transforms' % ckpt.begin_register(fnames[ref]))
+
+    frames = []
+    for ic, r in enumerate(results):
+
+        frame = dict([('file', r['file']), ('params', None), ('inlier_frac', None)])
+        done = ckpt.transform(r['file']) if ckpt else None
+
+        if ic == ref:
+            frame['params'] = AffineTransform().params.tolist()
+            frame['inlier_frac'] = 1.0
+        elif done is not None and done['params'] is not None:
+            frame['params'], frame['inlier_frac'] = done['params'], done['inlier_frac']
+        elif r['status'] == 'ok':
+            try:
+                with stage('transform', frame=r['file']):
+                    T, inliers = matcher.calc_transform(stars_ref, r['stars'])
+                frame['params'] = T.params.tolist()
+                frame['inlier_frac'] = float(sum(inliers)) / len(inliers)
+            except Exception as err:
+                r['status'], r['error'] = 'failed', 'registration: %s: %s' % (type(err).__name__, err)
+            if ckpt and frame['params'] is not None:
+                ckpt.add_transform(r['file'], frame['params'], frame['inlier_frac'])
+        frames.append(frame)
+
+    if ckpt:
+        ckpt.flush()
+
+    # Frames that failed keep a null transform and are excluded when combining
+    out = args.output or os.path.join(os.path.dirname(os.path.abspath(fnames[0])), 'transforms.json')
+    with open(out, 'w') as fd:
+        json.dump(dict([('ref_index', ref), ('frames', frames)]), fd, indent=2)
+
+    print('  Transforms written to %s' % out)
+
+    summary = _summary(_strip_stars(results))
+    summary['transforms'] = out
+
+    return summary
+
+
+def cmd_combine(fnames, args):
+
+    from stellate.astrostack import AstroStack
+
+    stack = AstroStack(fnames=fnames, calib=_calibration(fnames, args))
+    stack.ref_index = args.ref
+    _prescreen(stack, args)
+
+    if args.transforms:
+        n = stack.load_transforms(args.transforms)
+        print('  Loaded transforms for %d of %d frames' % (n, len(fnames)))
+        keep = stack.screened()
+        for ic in range(len(stack)):
+            if keep[ic]:
+                stack.stars(ic)
+    else:
+        _detect_stack(stack, args.workers)
+        stack.register(checkpoint=_checkpoint(args))
+
+    return _combine_stack(stack, args)
+
+
+def cmd_pipeline(fnames, args):
+
+    from stellate.astrostack import AstroStack
+
+    stack = AstroStack(fnames=fnames, calib=_calibration(fnames, args))
+    stack.ref_index = args.ref
+    _prescreen(stack, args)
+
+    if args.clean:
+        darks = None
+        if args.darks:
+            from astropy.io import fits
+            darks = [fits.getdata(f) for f in expand_globs(args.darks)]
+        stack.clean(darks=darks)
+
+    if args.background:
+        stack.subtract_background()
+
+    # Preprocessed images only exist in this process, so detection uses threads
+    _detect_stack(stack, args.workers)
+    stack.register(checkpoint=_checkpoint(args))
+
+    out_dir = os.path.dirname(os.path.abspath(args.output)) if args.output else \
+        os.path.dirname(os.path.abspath(fnames[0]))
+    transforms = os.path.join(out_dir, 'transforms.json')
+    stack.save_transforms(transforms)
+
+    summary = _combine_stack(stack, args)
+    summary['transforms'] = transforms
+
+    return summary
+
+
+def cmd_distribute(fnames, args):
+
+    from stellate.distributed import DistributedStack
+
+    job = DistributedStack(args.job_dir, fnames, ref_index=args.ref, method=args.method,
+                           kappa=args.kappa, max_iters=args.max_iters, weighted=not args.unweighted,
+                           max_diam=args.max_diam, min_circ=args.min_circ, frames_per_task=args.frames_per_task,
+                           n_strips=args.strips, mem_mb=args.mem_mb)
+
+    if args.workers > 1:
+        out = job.run_local(args.workers - 1, fname=args.output, poll_s=args.poll)
+    else:
+        out = job.run(fname=args.output, poll_s=args.poll)
+
+    with open(os.path.join(args.job_dir, 'transforms.json'), 'r') as fd:
+        frames = json.load(fd)['frames']
+
+    frames = [dict([('file', f['file']), ('status', 'ok' if f['weight'] > 0.0 else 'excluded'),
+                    ('n_stars', f['n_stars']), ('weight', f['weight'])]) for f in frames]
+    n_used = sum(f['weight'] > 0.0 for f in frames)
+
+    return dict([('status', 'ok' if n_used == len(frames) else 'partial'), ('n_frames', len(frames)),
+                 ('n_combined', n_used), ('output', out), ('frames', frames)])
+
+
+def cmd_work(args):
+    """
+    Node worker, returns the exit status directly
+    """
+
+    from stellate.distributed import work
+
+    n = work(args.job_dir, poll_s=args.poll, max_idle_s=args.max_idle)
+    print('  Worker completed %d tasks' % n)
+
+    return EXIT_OK
+
+
+_COMMAND_FNS = dict([('detect', cmd_detect), ('register', cmd_register),
+                     ('combine', cmd_combine), ('pipeline', cmd_pipeline),
+                     ('distribute', cmd_distribute)])
+
+
+# Internal methods
+
+def _build_parser():
+
+    parser = argparse.ArgumentParser(prog='stellate', description='Stellate headless batch processing')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    for cmd in COMMANDS:
+
+        p = sub.add_parser(cmd)
+        p.add_argument('files', nargs='+', help='FITS frames or glob patterns')
+        p.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='parallel workers')
+        p.add_argument('--status', default=None, help="JSON status report file ('-' for stdout)")
+        p.add_argument('--timings', default=None, help='per-stage timings JSON file')
+        p.add_argument('--trace', default=None, help='per-stage Chrome trace event file')
+        p.add_argument('--cprofile', default=None, help='cProfile statistics file for the main process')
+        p.add_argument('--memory', action='store_true',
+                       help='also record per-stage peak memory in the timings (slows the run)')
+
+        if cmd in ('detect', 'register'):
+            p.add_argument('--force', action='store_true', help='ignore existing star catalogs')
+
+        if cmd in ('register', 'combine', 'pipeline', 'distribute'):
+            p.add_argument('--ref', type=int, default=0, help='reference frame index (0-based)')
+
+        if cmd == 'register':
+            p.add_argument('-o', '--output', default=None, help='transforms JSON file')
+
+        if cmd in ('register', 'combine', 'pipeline'):
+            p.add_argument('--checkpoint', default=None, help='checkpoint directory for resuming interrupted runs')
+            p.add_argument('--checkpoint-interval', type=float, default=30.0,
+                           help='minimum seconds between transform checkpoints')
+            p.add_argument('--prescreen', action='store_true',
+                           help='reject cloudy, trailed or defocused frames from thumbnails before star finding')
+            p.add_argument('--min-star-frac', type=float, default=0.5,
+                           help='prescreen minimum star count as a fraction of the stack median')
+            p.add_argument('--max-fwhm-ratio', type=float, default=1.5,
+                           help='prescreen maximum FWHM relative to the stack median')
+            p.add_argument('--max-bkg-ratio', type=float, default=2.0,
+                           help='prescreen maximum sky level relative to the stack median')
+            p.add_argument('--max-elongation', type=float, default=1.6,
+                           help='prescreen maximum star elongation (major / minor axis)')
+
+        if cmd in ('combine', 'pipeline', 'distribute'):
+            p.add_argument('-o', '--output', default=None, help='combined FITS file')
+            p.add_argument('--method', default='median', choices=['median', 'mean', 'sigma'])
+            p.add_argument('--kappa', type=float, default=3.0)
+            p.add_argument('--max-iters', type=int, default=3)
+            p.add_argument('--max-diam', type=float, default=100.0)
+            p.add_argument('--min-circ', type=float, default=0.0)
+            p.add_argument('--unweighted', action='store_true')
+            p.add_argument('--mem-mb', type=float, default=1024.0)
+
+        if cmd in ('combine', 'pipeline'):
+            p.add_argument('--color', action='store_true', help='combine one-shot-colour frames in RGB')
+            p.add_argument('--demosaic', default='bilinear', choices=['superpixel', 'bilinear', 'edge'])
+            p.add_argument('--drizzle', action='store_true',
+                           help='drizzle onto a finer grid instead of combining (weight map in <output>_wht.fits)')
+            p.add_argument('--pixfrac', type=float, default=0.7, help='drizzle drop size as a fraction of a pixel')
+            p.add_argument('--scale', type=float, default=2.0, help='drizzle output pixels per input pixel')
+            p.add_argument('--calib-dir', default=None,
+                           help='calibration master directory (default <frame dir>/calibration)')
+            p.add_argument('--bias', nargs='+', default=None, help='bias frames for a master bias')
+            p.add_argument('--dark', nargs='+', default=None, help='dark frames for a master dark')
+            p.add_argument('--flat', nargs='+', default=None, help='flat frames for a master flat')
+
+        if cmd == 'distribute':
+            p.add_argument('--job-dir', required=True, help='shared job directory')
+            p.add_argument('--frames-per-task', type=int, default=16)
+            p.add_argument('--strips', type=int, default=8, help='row strip tasks for median')
+            p.add_argument('--poll', type=float, default=1.0, help='seconds between job directory polls')
+
+        if cmd == 'combine':
+            p.add_argument('-t', '--transforms', default=None, help='transforms JSON from register')
+
+        if cmd == 'pipeline':
+            p.add_argument('--clean', action='store_true', help='remove hot pixels and cosmic rays')
+            p.add_argument('--darks', nargs='+', default=None,
+                           help='dark frames or master dark for the --clean bad pixel map (needed for undithered frames)')
+            p.add_argument('--background', action='store_true', help='subtract background gradients')
+
+    # Node worker for distribute jobs
+    p = sub.add_parser('work')
+    p.add_argument('job_dir', help='shared job directory')
+    p.add_argument('--poll', type=float, default=1.0, help='seconds between job directory polls')
+    p.add_argument('--max-idle', type=float, default=None, help='exit after this many seconds without a task')
+
+    return parser
+
+
+def _calibration(fnames, args):
+    """
+    Calibration library for the light frames, building any masters from frames given on the command line
+    Masters already cached for the same frames are reused
+
+    :return: CalibrationLibrary or None if no calibration was requested
+    """
+
+    kinds = [(kind, getattr(args, kind)) for kind in ('bias', 'dark', 'flat') if getattr(args, kind)]
+
+    if not args.calib_dir and not kinds:
+        return None
+
+    from stellate.calibrate import CalibrationLibrary
+
+    calib_dir = args.calib_dir or os.path.join(os.path.dirname(os.path.abspath(fnames[0])), 'calibration')
+    calib = CalibrationLibrary(calib_dir, mem_mb=args.mem_mb)
+
+    # Flats are bias or dark subtracted, so their masters are built last
+    for kind, patterns in kinds:
+        calib_fnames = expand_globs(patterns)
+        if len(calib_fnames) < 1:
+            raise ValueError('no %s frames match %s' % (kind, ' '.join(patterns)))
+        calib.build_master(kind, calib_fnames)
+
+    return calib
+
+
+def _checkpoint(args):
+    """
+    Checkpoint for this run, or None if not requested
+    Preprocessing options change the combined pixels, so they are part of the checkpoint context
+    """
+
+    if not args.checkpoint:
+        return None
+
+    from stellate.checkpoint import Checkpoint
+
+    context = dict([('clean', getattr(args, 'clean', False)), ('darks', getattr(args, 'darks', None)),
+                    ('background', getattr(args, 'background', False)),
+                    ('calibration', [getattr(args, key, None) for key in ('calib_dir', 'bias', 'dark', 'flat')])])
+
+    return Checkpoint(args.checkpoint, interval_s=args.checkpoint_interval, context=context)
+
+
+def _detect_all(fnames, workers, find_again=False):
+    """
+    Star detection over a process pool, results in input order
+    """
+
+    if workers <= 1:
+        return [detect_frame(fname, find_again) for fname in fnames]
+
+    # Worker processes instrument themselves and send their stage records back
+    instr = active()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(detect_frame, fnames, [find_again] * len(fnames),
+                                [instr is not None] * len(fnames),
+                                [instr is not None and instr.track_memory] * len(fnames)))
+
+    for r in results:
+        timings = r.pop('timings', [])
+        if instr:
+            instr.add_records(timings)
+
+    return results
+
+
+def _detect_stack(stack, workers):
+    """
+    Star detection for an in-memory stack over a thread pool, skipping frames rejected by pre-screening
+    """
+
+    def detect(ic):
+        return stack.astroimage(ic).stars(write_sidecar=True)
+
+    keep = stack.screened()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        list(pool.map(detect, [ic for ic in range(len(stack)) if keep[ic]]))
+
+
+def _prescreen(stack, args):
+    """
+    Reject frames from their thumbnail metrics when --prescreen is given
+
+    :return: bool array, True for frames kept
+    """
+
+    if args.prescreen:
+        from stellate.prescreen import PreScreen
+        stack.prescreen(PreScreen(args.min_star_frac, args.max_fwhm_ratio, args.max_bkg_ratio, args.max_elongation))
+
+    return stack.screened()
+
+
+def _combine_stack(stack, args):
+
+    if args.output:
+        out = args.output
+    else:
+        out = os.path.join(os.path.dirname(stack.filename(0)),
+                           '%s_combined.fits' % ('drizzle' if args.drizzle else args.method))
+
+    if args.drizzle:
+        if args.color:
+            print('* Drizzle combines luminance only - ignoring --color')
+        stack.drizzle(args.pixfrac, args.scale, args.max_diam, args.min_circ, n_workers=args.workers,
+                      weighted=not args.unweighted, fname=out, return_image=False)
+    else:
+        stack.combine(args.max_diam, args.min_circ, method=args.method, weighted=not args.unweighted,
+                      mem_mb=args.mem_mb, fname=out, return_image=False, color=args.color,
+                      demosaic_method=args.demosaic, kappa=args.kappa, max_iters=args.max_iters,
+                      checkpoint=_checkpoint(args))
+
+    weights = stack.frame_weights(args.max_diam, args.min_circ, not args.unweighted)
+
+    frames = []
+    for ic in range(len(stack)):
+        aimg = stack.astroimage(ic)
+        frames.append(dict([('file', aimg.filename()),
+                            ('status', 'ok' if weights[ic] > 0.0 else 'excluded'),
+                            ('n_stars', aimg.num_stars()),
+                            ('weight', float(weights[ic]))]))
+
+    n_used = int(sum(weights > 0.0))
+
+    status = 'failed' if n_used < 1 else ('ok' if n_used == len(stack) else 'partial')
+
+    return dict([('status', status), ('n_frames', len(stack)), ('n_combined', n_used),
+                 ('output', out), ('frames', frames)])
+
+
+def _write_timings(instr, args):
+
+    instr.report()
+
+    if args.timings:
+        instr.to_json(args.timings)
+        print('  Stage timings written to %s' % args.timings)
+
+    if args.trace:
+        instr.to_trace(args.trace)
+        print('  Stage trace written to %s' % args.trace)
+
+    if args.cprofile:
+        instr.dump_profile(args.cprofile)
+        print('  Profile written to %s' % args.cprofile)
+
+
+def _strip_stars(results):
+    for r in results:
+        r.pop('stars', None)
+    return results
+
+
+def _summary(results):
+
+    n_ok = sum(r['status'] == 'ok' for r in results)
+    status = 'ok' if n_ok == len(results) else ('failed' if n_ok == 0 else 'partial')
+
+    return dict([('status', status), ('n_frames', len(results)), ('n_ok', n_ok), ('frames', results)])
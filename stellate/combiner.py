@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Memory-bounded, quality-weighted combination of registered frames
+
+Frames are resampled onto the reference grid one strip of rows at a time and
+each strip cube (rows x cols x frames) is reduced by a vectorized weighted
+median, weighted mean or sigma-clipped weighted mean. Pixels falling outside a
+frame after registration are NaN and carry no weight.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from stellate.resample import Resampler
+from stellate.instrument import stage
+
+
+class StackCombiner:
+
+    def __init__(self, images, transforms, weights, output_shape,
+                 method='median', kappa=3.0, max_iters=3, mem_mb=1024, order=3, labels=None):
+        """
+        :param images: list of 2D arrays
+        :param transforms: list of skimage transforms mapping reference -> frame (None = identity)
+        :param weights: array, per-frame weights (frames with zero weight are skipped)
+        :param output_shape: tuple, (ny, nx) reference grid
+        :param method: str, 'median', 'mean' or 'sigma' (sigma-clipped mean)
+        :param kappa: float, rejection threshold in standard deviations for 'sigma'
+        :param max_iters: int, maximum rejection iterations for 'sigma'
+        :param mem_mb: float, memory budget for the strip cube in MB
+        :param order: int, spline order for general transforms
+        :param labels: list, per-frame labels for instrumentation (default frame indices)
+        """
+
+        if method not in ('median', 'mean', 'sigma'):
+            raise ValueError('Unknown combine method %s' % method)
+
+        weights = np.asarray(weights, dtype=np.float32)
+        keep = np.where(weights > 0.0)[0]
+
+        self.method = method
+        self.kappa = kappa
+        self.max_iters = max_iters
+        self.output_shape = tuple(output_shape)
+
+        self._weights = weights[keep]
+        self._labels = [labels[ic] if labels is not None else int(ic) for ic in keep]
+        self._resamplers = [Resampler(images[ic], transforms[ic], order=order, cval=np.nan, cache=False)
+                            for ic in keep]
+
+        # Rows per strip from the memory budget (cube plus sort/work copies)
+        ny, nx = self.output_shape
+        n = max(len(self._resamplers), 1)
+        bytes_per_row = nx * n * 4 * 3
+        self.strip_rows = int(np.clip(mem_mb * 1e6 // bytes_per_row, 1, ny))
+
+    def __len__(self):
+        return len(self._resamplers)
+
+    def strips(self, progress=None, cached=None):
+        """
+        Generator over combined strips
+
+        :param progress: callable, progress(fraction) called after each strip
+        :param cached: callable, cached(r0, r1) returning a previously combined strip or None
+        :return: yields (r0, r1, strip) with strip a float32 array of shape (r1 - r0, nx)
+        """
+
+        ny, nx = self.output_shape
+
+        for r0 in range(0, ny, self.strip_rows):
+
+            r1 = min(r0 + self.strip_rows, ny)
+
+            strip = cached(r0, r1) if cached else None
+            if strip is None:
+                strip = self.combine_strip(r0, r1)
+
+            yield r0, r1, strip
+
+            if progress:
+                progress(r1 / float(ny))
+
+    def combine_strip(self, r0, r1):
+
+        ny, nx = self.output_shape
+
+        cube = np.empty([r1 - r0, nx, len(self)], dtype=np.float32)
+        for ic, rs in enumerate(self._resamplers):
+            with stage('warp', frame=self._labels[ic]):
+                cube[:, :, ic] = rs.warp(self.output_shape, rows=(r0, r1))
+
+        with stage('reduce'):
+            return combine_cube(cube, self._weights, self.method, self.kappa, self.max_iters)
+
+
+def combine_cube(cube, weights, method='median', kappa=3.0, max_iters=3):
+    """
+    Reduce a (rows x cols x frames) cube along the frame axis with per-frame weights
+    NaN samples carry no weight. Pixels with no valid samples are returned as 0.
+
+    :param cube: 3D float array
+    :param weights: 1D array, per-frame weights
+    :param method: str, 'median', 'mean' or 'sigma'
+    :return: 2D float32 array
+    """
+
+    w = np.broadcast_to(np.asarray(weights, dtype=np.float32), cube.shape)
+    w = np.where(np.isnan(cube), np.float32(0.0), w)
+
+    if method == 'median':
+        comb = weighted_median(cube, w)
+
+    elif method == 'mean':
+        comb = _weighted_mean(cube, w)
+
+    else:
+        comb = _weighted_mean(cube, w)
+        for it in range(max_iters):
+            sd = np.sqrt(_weighted_mean((cube - comb[..., None]) ** 2, w))
+            reject = np.abs(cube - comb[..., None]) > kappa * sd[..., None]
+            reject &= w > 0.0
+            if not np.any(reject):
+                break
+            w = np.where(reject, np.float32(0.0), w)
+            comb = _weighted_mean(cube, w)
+
+    return np.nan_to_num(comb, nan=0.0).astype(np.float32)
+
+
+def weighted_median(cube, w):
+    """
+    Vectorized weighted median along the last axis
+
+    :param cube: 3D array
+    :param w: 3D array of non-negative weights, same shape as cube
+    :return: 2D array
+    """
+
+    # NaNs sort to the end and have zero weight
+    order = np.argsort(cube, axis=-1)
+    vs = np.take_along_axis(cube, order, axis=-1)
+    ws = np.take_along_axis(w, order, axis=-1)
+
+    cw = np.cumsum(ws, axis=-1)
+    half = 0.5 * cw[..., -1:]
+
+    # First sample where the cumulative weight reaches half the total
+    idx = np.argmax(cw >= half, axis=-1)[..., None]
+    med = np.take_along_axis(vs, idx, axis=-1)[..., 0]
+
+    # Average with the next sample when the half weight falls exactly between two (np.median for equal weights)
+    at_half = np.isclose(np.take_along_axis(cw, idx, axis=-1), half)[..., 0]
+    nxt = np.minimum(idx + 1, cube.shape[-1] - 1)
+    med_nxt = np.take_along_axis(vs, nxt, axis=-1)[..., 0]
+    use_nxt = at_half & np.isfinite(med_nxt)
+    med[use_nxt] = 0.5 * (med[use_nxt] + med_nxt[use_nxt])
+
+    med[half[..., 0] <= 0.0] = np.nan
+
+    return med
+
+
+def quality_weights(fwhm, noise_sd, n_stars, inlier_frac):
+    """
+    Per-frame integration weights from frame quality metrics
+    w ~ (n_stars * inlier_frac) / (fwhm^2 * noise_sd^2), normalized to a maximum of 1
+
+    Inverse variance weighting by noise, inverse PSF area by FWHM, scaled by the
+    fraction of the best frame's matched stars (penalizes cloud and poor registration).
+
+    :param fwhm: array, star FWHM in pixels
+    :param noise_sd: array, background noise standard deviation
+    :param n_stars: array, detected star count
+    :param inlier_frac: array, fraction of star pairs matched by the refined registration (see calc_transform)
+    :return: array, weights in [0, 1]
+    """
+
+    fwhm = np.asarray(fwhm, dtype=float)
+    noise_sd = np.asarray(noise_sd, dtype=float)
+    matched = np.asarray(n_stars, dtype=float) * np.asarray(inlier_frac, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = matched / (fwhm ** 2 * noise_sd ** 2)
+
+    w[~np.isfinite(w) | (w < 0.0)] = 0.0
+
+    if np.max(w, initial=0.0) > 0.0:
+        w /= np.max(w)
+
+    return w
+
+
+def _weighted_mean(cube, w):
+    sw = np.sum(w, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(np.where(w > 0.0, cube * w, np.float32(0.0)), axis=-1) / sw
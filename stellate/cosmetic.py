@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Hot pixel and cosmic ray rejection prior to star detection
+
+Hot, warm and dead pixels are fixed in sensor coordinates, so they are found
+once per session and reused for every frame. Dark frames are the preferred
+source. Without darks the per-pixel median of a sample of light frames is used,
+which only rejects the stars if the frames are dithered by several FWHM, so
+the map is refused for undithered data. Cosmic rays differ from frame to frame and are found with a
+vectorized median-deviation test: a pixel is rejected if it stands well above
+its 3 x 3 median in noise units and is much sharper than the local fine
+structure, which protects the cores of real (PSF-sampled) stars [1].
+
+Refs
+----
+[1] P. G. van Dokkum, "Cosmic-Ray Rejection by Laplacian Edge Detection,"
+PASP, vol. 113, no. 789, pp. 1420-1427, Nov. 2001.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+ndi = LazyModule('scipy.ndimage')
+skregistration = LazyModule('skimage.registration')
+
+# Minimum median frame-to-frame offset, in FWHM, for a bad pixel map from light frames
+MIN_DITHER_FWHM = 3.0
+
+
+class BadPixelMap:
+
+    def __init__(self, mask=None):
+        """
+        :param mask: 2D bool array, True for bad pixels
+        """
+        self._mask = np.zeros([0, 0], dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+    @classmethod
+    def from_darks(cls, darks, kappa=5.0, n_sample=16, strip_rows=256):
+        """
+        Build a bad pixel map from dark frames (or a single master dark)
+        Darks have no stars, so this is the preferred source of the map
+
+        :param darks: list of 2D arrays, dark frames of the same size as the light frames
+        :param kappa: float, detection threshold in robust sigma
+        :param n_sample: int, maximum number of frames sampled evenly from the list
+        :param strip_rows: int, rows per strip for the temporal median
+        :return: BadPixelMap
+        """
+
+        if len(darks) < 1:
+            return cls()
+
+        sample = [darks[ic] for ic in sample_indices(len(darks), n_sample)]
+        med_t, _ = _temporal_median(sample, None, strip_rows)
+
+        mask = _deviant(med_t, kappa)
+
+        print('  Bad pixel map from %d darks : %d pixels flagged (%0.4f%%)'
+              % (len(sample), np.sum(mask), 100.0 * np.mean(mask)))
+
+        return cls(mask)
+
+    @classmethod
+    def from_images(cls, images, kappa=5.0, n_sample=16, strip_rows=256, star_masks=None, fwhm=None,
+                    min_dither=MIN_DITHER_FWHM, dither=None):
+        """
+        Build a bad pixel map from the per-pixel median of a sample of light frames
+        Pixels deviating from their 3 x 3 neighbourhood in the temporal median by
+        more than kappa robust sigma (either sign) are flagged.
+
+        Star cores only drop out of the median if the frames are dithered, so no map
+        (an empty one) is built if the median frame-to-frame offset is below min_dither
+        FWHM - use from_darks() instead. Star mask pixels are left out of the median.
+        Pixels masked in most frames are sensor features if the dither was checked,
+        and are otherwise never flagged.
+
+        :param images: list of 2D arrays, unregistered frames of the same size
+        :param kappa: float, detection threshold in robust sigma
+        :param n_sample: int, maximum number of frames sampled evenly from the list
+        :param strip_rows: int, rows per strip for the temporal median
+        :param star_masks: list of 2D bool arrays, star mask of each frame (None for unmasked frames)
+        :param fwhm: float, typical star FWHM in pixels for the dither check (None skips the check)
+        :param min_dither: float, minimum median frame-to-frame offset in FWHM
+        :param dither: float, median frame-to-frame offset in pixels if already measured (see measure_dither)
+        :return: BadPixelMap
+        """
+
+        if len(images) < 1:
+            return cls()
+
+        idx = sample_indices(len(images), n_sample)
+        sample = [images[ic] for ic in idx]
+        masks = None if star_masks is None else [star_masks[ic] for ic in idx]
+
+        dithered = False
+        if fwhm is not None and len(sample) > 1:
+
+            if dither is None:
+                dither = measure_dither(sample)
+
+            print('  Bad pixel map : median frame offset %0.1f pixels (FWHM %0.1f pixels)' % (dither, fwhm))
+
+            if dither < min_dither * fwhm:
+                print('* Bad pixel map : frames dithered by less than %0.1f FWHM would flag star cores' % min_dither)
+                print('* Bad pixel map : not built - use dark frames for undithered data')
+                return cls()
+
+            dithered = True
+
+        med_t, starry = _temporal_median(sample, masks, strip_rows)
+
+        mask = _deviant(med_t, kappa)
+
+        # Without a dither check, pixels inside stars in most frames may be star cores
+        if not dithered:
+            mask &= ~ndi.binary_dilation(starry, structure=np.ones([3, 3], dtype=bool))
+
+        print('  Bad pixel map : %d pixels flagged (%0.4f%%)' % (np.sum(mask), 100.0 * np.mean(mask)))
+
+        return cls(mask)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(data['mask'])
+
+    def save(self, fname):
+        np.savez_compressed(fname, mask=self._mask)
+
+    def mask(self):
+        return self._mask
+
+    def n_bad(self):
+        return int(np.sum(self._mask))
+
+    def shape(self):
+        return self._mask.shape
+
+
+def clean_image(image, bad_map=None, cosmic=True, kappa=5.0, objlim=4.0):
+    """
+    Replace bad pixels and cosmic ray hits with their 3 x 3 median
+
+    :param image: 2D array
+    :param bad_map: BadPixelMap, session bad pixel map (optional)
+    :param cosmic: bool, also detect and replace cosmic ray hits
+    :param kappa: float, cosmic ray threshold in robust sigma above the 3 x 3 median
+    :param objlim: float, minimum contrast of the hit over the local fine structure
+    :return: cleaned float32 image, number of bad pixels replaced, number of cosmic ray pixels replaced
+    """
+
+    img = np.array(image, dtype=np.float32)
+    med3 = ndi.median_filter(img, size=3, mode='mirror')
+
+    n_bad, n_cr = 0, 0
+
+    if bad_map is not None and bad_map.shape() == img.shape:
+        bad = bad_map.mask()
+        img[bad] = med3[bad]
+        n_bad = int(np.sum(bad))
+
+    if cosmic:
+
+        dev = img - med3
+        sigma = _robust_sd(dev)
+
+        # Fine structure : small scale structure remaining after removing the local mean,
+        # spread over a 5 x 5 neighbourhood so that star wings inherit their core's structure
+        fine = med3 - ndi.uniform_filter(med3, size=7, mode='mirror')
+        fine = np.maximum(ndi.maximum_filter(fine, size=5, mode='mirror'), sigma)
+
+        hits = (dev > kappa * sigma) & (dev > objlim * fine)
+
+        # Grow hits by one pixel to catch the wings of multi-pixel tracks
+        hits = ndi.binary_dilation(hits, structure=np.ones([3, 3], dtype=bool)) & (dev > 0.5 * kappa * sigma)
+
+        img[hits] = med3[hits]
+        n_cr = int(np.sum(hits))
+
+    return img, n_bad, n_cr
+
+
+def sample_indices(n_frames, n_sample):
+    """
+    Indices of up to n_sample frames spread evenly over a stack
+    """
+
+    return np.unique(np.linspace(0, n_frames - 1, min(n_sample, n_frames)).astype(int))
+
+
+def measure_dither(images, max_size=1024):
+    """
+    Median frame-to-frame offset of unregistered frames in pixels
+    Offsets are found by phase correlation of binned copies against the first frame
+    Binning takes the minimum of each 2 x 2 block first, so that single hot pixels
+    (which do not move between frames) cannot pull the offsets to zero
+
+    :param images: list of 2D arrays, frames of the same size
+    :param max_size: int, maximum edge of the binned copies
+    :return: float, median offset over all pairs of frames
+    """
+
+    ny, nx = images[0].shape
+    bf = 2 * max(1, int(np.ceil(max(ny, nx) / (2.0 * max_size))))
+
+    small = [_despiked_bin(img, bf) for img in images]
+
+    offsets = [np.zeros(2)]
+    for img in small[1:]:
+        # Half pixel precision at full resolution
+        shift = skregistration.phase_cross_correlation(small[0], img, upsample_factor=2 * bf)[0]
+        offsets.append(np.asarray(shift) * bf)
+
+    offsets = np.array(offsets)
+    dists = [np.hypot(*(offsets[i] - offsets[j])) for i in range(len(offsets)) for j in range(i + 1, len(offsets))]
+
+    return float(np.median(dists)) if dists else 0.0
+
+
+def _temporal_median(sample, masks, strip_rows):
+    """
+    Per-pixel median of a sample of frames, strip by strip to bound memory
+    Masked pixels are left out where most frames are unmasked
+
+    :return: float32 median, bool array of pixels masked in most frames
+    """
+
+    ny, nx = sample[0].shape
+    med_t = np.empty([ny, nx], dtype=np.float32)
+    starry = np.zeros([ny, nx], dtype=bool)
+
+    for r0 in range(0, ny, strip_rows):
+
+        r1 = min(r0 + strip_rows, ny)
+        cube = np.stack([np.asarray(img[r0:r1], dtype=np.float32) for img in sample], axis=-1)
+        med_t[r0:r1] = np.median(cube, axis=-1)
+
+        if masks is None:
+            continue
+
+        inside = np.stack([np.zeros([r1 - r0, nx], dtype=bool) if m is None else np.asarray(m[r0:r1], dtype=bool)
+                           for m in masks], axis=-1)
+        n_free = np.sum(~inside, axis=-1)
+        starry[r0:r1] = 2 * n_free < len(sample)
+
+        # Median of the star-free samples, only where some frames had a star
+        redo = np.any(inside, axis=-1) & ~starry[r0:r1]
+        if np.any(redo):
+            sub = np.where(inside[redo], np.nan, cube[redo])
+            med_t[r0:r1][redo] = np.nanmedian(sub, axis=-1)
+
+    return med_t, starry
+
+
+def _deviant(med_t, kappa):
+    """
+    Pixels deviating from their 3 x 3 neighbourhood by more than kappa robust sigma
+    """
+
+    dev = med_t - ndi.median_filter(med_t, size=3, mode='mirror')
+    sigma = _robust_sd(dev)
+
+    return np.abs(dev) > kappa * sigma
+
+
+def _despiked_bin(img, bf):
+    """
+    Bin by an even factor, taking the minimum of each 2 x 2 block then the mean of those
+    """
+
+    ny, nx = (img.shape[0] // bf) * bf, (img.shape[1] // bf) * bf
+
+    img = np.asarray(img[:ny, :nx], dtype=np.float32)
+    img = img.reshape(ny // 2, 2, nx // 2, 2).min(axis=(1, 3))
+
+    hb = bf // 2
+    return img.reshape(ny // bf, hb, nx // bf, hb).mean(axis=(1, 3))
+
+
+def _robust_sd(x):
+    """
+    Standard deviation estimate from the median absolute deviation
+    Strided subsample keeps this cheap on large frames
+    """
+    xs = np.ravel(x)[::max(1, x.size // 1000000)]
+    mad = np.median(np.abs(xs - np.median(xs)))
+    return max(1.4826 * mad, np.finfo(np.float32).tiny)
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+"""
+Multi-node stacking coordinated through a shared job directory
+
+Registration and combining are split into tasks over subsets of frames (or of
+output rows) that any number of nodes claim from a shared directory. Each task
+writes a partial product and a coordinator merges them:
+
+register   : frame chunks -> per-frame transforms and quality metrics
+accumulate : frame chunks -> weighted sums and counts on the reference grid
+             ('mean' in one pass; 'sigma' repeats the pass once per rejection
+             iteration, each node rejecting against the merged mean and SD of
+             the previous passes, which reproduces combine_cube up to
+             rounding at the rejection threshold)
+strips     : output row ranges -> combined rows ('median', which has no
+             mergeable partial sums)
+
+Job directory layout
+----
+job.json            frames and combine settings
+phase.json          current phase (name, sequence number, number of tasks)
+ref_stars.json      reference star catalog
+transforms.json     merged transforms (AstroStack.save_transforms layout)
+stats_<n>.npz       merged mean and SD after accumulate pass n
+tasks/<seq>_<k>.claim / .done   task claims (atomic exclusive create) and completion
+tasks/<seq>_<k>.failed          error and traceback of a task that raised
+parts/<seq>_<k>.*   partial products
+
+Claims older than stale_s without a .done marker are taken over, so a node
+that dies only delays its task. A task that raises leaves a .failed marker
+with the error instead, the worker moves on, and the coordinator stops the
+job and raises it. The coordinator also works on tasks while it waits, so a
+single process completes a job on its own; extra nodes run work() on the same
+directory, or run_local() starts them as local processes.
+
+Frames are loaded through AstroImage (luminance for one-shot-colour frames)
+without calibration. Median strip tasks read only the rows of each frame
+under their output rows, as the Resampler asks for them.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import socket
+import traceback
+import multiprocessing
+import numpy as np
+from stellate.astroimage import AstroImage
+from stellate.astrostack import AstroStack
+from stellate.combiner import StackCombiner, quality_weights
+from stellate.demosaic import LuminanceRows, parse_pattern
+from stellate.fitsrows import FITSRows
+from stellate.fitswriter import FITSStripWriter
+from stellate.resample import Resampler
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+pd = LazyModule('pandas')
+
+METHODS = ('mean', 'sigma', 'median')
+
+
+class DistributedStack:
+
+    def __init__(self, job_dir, fnames=None, ref_index=0, method='mean', kappa=3.0, max_iters=3,
+                 weighted=True, max_diam=100.0, min_circ=0.0, frames_per_task=16, n_strips=8,
+                 mem_mb=1024.0, stale_s=3600.0):
+        """
+        Create a job in job_dir, or reopen the existing job there if fnames is None
+
+        :param job_dir: str, shared job directory
+        :param fnames: list of str, frames to stack (paths visible from every node)
+        :param ref_index: int, reference frame index
+        :param method: str, 'mean', 'sigma' (sigma-clipped mean) or 'median'
+        :param kappa: float, rejection threshold in standard deviations for 'sigma'
+        :param max_iters: int, maximum rejection iterations for 'sigma'
+        :param weighted: bool, weight frames by quality metrics
+        :param max_diam: float, maximum mean star diameter for inclusion
+        :param min_circ: float, minimum mean star circularity for inclusion
+        :param frames_per_task: int, frames per register or accumulate task
+        :param n_strips: int, row strip tasks for 'median'
+        :param mem_mb: float, memory budget for a median strip cube in MB
+        :param stale_s: float, seconds after which an unfinished claim is taken over
+        """
+
+        self._dir = job_dir
+
+        if fnames is None:
+            with open(self._path('job.json'), 'r') as fd:
+                self._job = json.load(fd)
+            return
+
+        if method not in METHODS:
+            raise ValueError('Unknown distributed combine method %s' % method)
+
+        self._job = dict([
+            ('fnames', [os.path.abspath(f) for f in fnames]),
+            ('ref_index', int(ref_index)),
+            ('method', method),
+            ('kappa', float(kappa)),
+            ('max_iters', int(max_iters)),
+            ('weighted', bool(weighted)),
+            ('max_diam', float(max_diam)),
+            ('min_circ', float(min_circ)),
+            ('frames_per_task', int(frames_per_task)),
+            ('n_strips', int(n_strips)),
+            ('mem_mb', float(mem_mb)),
+            ('stale_s', float(stale_s)),
+        ])
+
+        # A new job starts from an empty task list
+        for sub in ('tasks', 'parts'):
+            os.makedirs(os.path.join(job_dir, sub), exist_ok=True)
+            for f in os.listdir(os.path.join(job_dir, sub)):
+                os.remove(os.path.join(job_dir, sub, f))
+
+        if os.path.isfile(self._path('phase.json')):
+            os.remove(self._path('phase.json'))
+
+        _write_json(self._path('job.json'), self._job)
+
+    def run(self, fname=None, poll_s=1.0, progress=None):
+        """
+        Coordinate the job to completion, working on tasks while waiting for other nodes
+
+        :param fname: str, output FITS filename (default <method>_combined.fits in the job directory)
+        :param poll_s: float, seconds between checks for finished tasks
+        :param progress: callable, progress(fraction) reporting and cancellation point (eg JobControl)
+        :return: str, output filename
+        """
+
+        job = self._job
+        fnames = job['fnames']
+        n = len(fnames)
+
+        if fname is None:
+            fname = self._path('%s_combined.fits' % job['method'])
+
+        print('')
+        print('Distributed stacking of %d frames (%s) in %s' % (n, job['method'], self._dir))
+
+        # Reference catalog and grid, shared with every node
+        aimg_ref = AstroImage(fnames[job['ref_index']])
+        aimg_ref.stars(write_sidecar=True).to_json(self._path('ref_stars.json'))
+        job['shape'] = list(aimg_ref.image().shape)
+        _write_json(self._path('job.json'), job)
+
+        # Registration by frame chunks
+        seq = 0
+        parts = self._run_phase(seq, 'register', len(self._frame_chunks()), poll_s, progress, (0.0, 0.3))
+        weights = self._merge_register(parts)
+        print('  Including %d of %d frames' % (np.sum(weights > 0.0), n))
+
+        if np.sum(weights > 0.0) < 1:
+            raise RuntimeError('No frames left to combine')
+
+        template = aimg_ref.header()
+        provenance = dict([('fnames', fnames), ('weights', weights), ('ref_index', job['ref_index']),
+                           ('method', job['method']),
+                           ('kappa', job['kappa'] if job['method'] == 'sigma' else None),
+                           ('max_iters', job['max_iters'] if job['method'] == 'sigma' else None),
+                           ('max_diam', job['max_diam']), ('min_circ', job['min_circ'])])
+
+        ny, nx = job['shape']
+
+        with FITSStripWriter(fname, (ny, nx), provenance, template) as writer:
+
+            if job['method'] == 'median':
+
+                seq += 1
+                parts = self._run_phase(seq, 'strips', len(self._row_strips()), poll_s, progress, (0.3, 1.0))
+                for part in parts:
+                    writer.write(np.load(part))
+
+            else:
+
+                n_pass = 1 + (job['max_iters'] if job['method'] == 'sigma' else 0)
+                for ip in range(n_pass):
+
+                    seq += 1
+                    span = (0.3 + 0.7 * ip / n_pass, 0.3 + 0.7 * (ip + 1) / n_pass)
+                    parts = self._run_phase(seq, 'accumulate', len(self._frame_chunks()), poll_s, progress, span,
+                                            dict([('pass', ip)]))
+                    comb, n_rejected = self._merge_sums(parts, ip)
+
+                    if ip > 0 and n_rejected == 0:
+                        break
+
+                rows = 1024
+                for r0 in range(0, ny, rows):
+                    writer.write(comb[r0:r0 + rows])
+
+        self._publish(dict([('name', 'done'), ('seq', seq + 1), ('n_tasks', 0)]))
+
+        print('  Combined image written to %s' % fname)
+
+        if progress:
+            progress(1.0)
+
+        return fname
+
+    def run_local(self, n_workers=2, fname=None, poll_s=0.5, progress=None):
+        """
+        Run the job with n_workers local worker processes standing in for cluster nodes
+
+        :return: str, output filename
+        """
+
+        workers = [multiprocessing.Process(target=work, args=(self._dir, poll_s), daemon=True)
+                   for _ in range(n_workers)]
+        for w in workers:
+            w.start()
+
+        try:
+            return self.run(fname, poll_s, progress)
+        finally:
+            for w in workers:
+                w.join(timeout=10.0 * poll_s)
+                if w.is_alive():
+                    w.terminate()
+
+    def job(self):
+        return dict(self._job)
+
+    # Internal methods
+
+    def _path(self, *parts):
+        return os.path.join(self._dir, *parts)
+
+    def _frame_chunks(self):
+        return _chunks(len(self._job['fnames']), self._job['frames_per_task'])
+
+    def _row_strips(self):
+        ny = self._job['shape'][0]
+        return _chunks(ny, int(np.ceil(ny / float(max(self._job['n_strips'], 1)))))
+
+    def _publish(self, phase):
+        _write_json(self._path('phase.json'), phase)
+
+    def _run_phase(self, seq, name, n_tasks, poll_s, progress, span, extra=None):
+        """
+        Publish a phase, help with its tasks and wait for all of them to finish
+
+        :return: list of str, partial product filenames in task order
+        """
+
+        phase = dict([('name', name), ('seq', seq), ('n_tasks', n_tasks)])
+        phase.update(extra or dict())
+        self._publish(phase)
+
+        print('  Phase %d : %s (%d tasks)' % (seq, name, n_tasks))
+
+        while True:
+
+            n_done = sum(os.path.isfile(_task_path(self._dir, seq, k, '.done')) for k in range(n_tasks))
+
+            if progress:
+                progress(span[0] + (span[1] - span[0]) * n_done / float(max(n_tasks, 1)))
+
+            if n_done == n_tasks:
+                break
+
+            # A failed task stops the job, and the workers with it
+            for k in range(n_tasks):
+                failed = _read_json(_task_path(self._dir, seq, k, '.failed'))
+                if failed is not None:
+                    self._publish(dict([('name', 'failed'), ('seq', seq), ('n_tasks', 0)]))
+                    raise RuntimeError('%s task %d failed on %s : %s'
+                                       % (name, k + 1, failed['host'], failed['error']))
+
+            if not _work_one(self._dir, self._job, phase):
+                time.sleep(poll_s)
+
+        return [_part_path(self._dir, seq, k, _PART_EXT[name]) for k in range(n_tasks)]
+
+    def _merge_register(self, parts):
+        """
+        Merge per-frame registrations into transforms.json and compute the frame weights
+        """
+
+        job = self._job
+        frames = []
+        for part in parts:
+            with open(part, 'r') as fd:
+                frames += json.load(fd)
+
+        frames.sort(key=lambda f: f['index'])
+
+        ok = np.array([f['params'] is not None for f in frames])
+        diam = np.array([f['mean_diam'] for f in frames], dtype=float)
+        circ = np.array([f['mean_circ'] for f in frames], dtype=float)
+
+        weights = np.where(ok & (diam < job['max_diam']) & (circ > job['min_circ']), 1.0, 0.0)
+
+        if job['weighted']:
+            inlier_frac = np.array([f['inlier_frac'] if f['inlier_frac'] is not None else 1.0 for f in frames])
+            weights *= quality_weights([f['fwhm'] for f in frames], [f['noise_sd'] for f in frames],
+                                       [f['n_stars'] for f in frames], inlier_frac)
+
+        for f, w in zip(frames, weights):
+            f['weight'] = float(w)
+
+        _write_json(self._path('transforms.json'), dict([('ref_index', job['ref_index']), ('frames', frames)]))
+
+        return weights
+
+    def _merge_sums(self, parts, ip):
+        """
+        Merge accumulate partial sums, publish the pass statistics and return the current combined image
+        """
+
+        s0 = s1 = s2 = None
+        n_rejected = 0
+
+        for part in parts:
+            with np.load(part) as p:
+                if s0 is None:
+                    s0, s1, s2 = p['s0'].copy(), p['s1'].copy(), p['s2'].copy()
+                else:
+                    s0 += p['s0']
+                    s1 += p['s1']
+                    s2 += p['s2']
+                n_rejected += int(p['n_rejected'])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s1 / s0
+            sd = np.sqrt(np.maximum(s2 / s0 - mean ** 2, 0.0))
+
+        np.savez(self._path('stats_%d.npz' % ip), mean=mean.astype(np.float32), sd=sd.astype(np.float32))
+
+        if ip > 0:
+            print('  Pass %d rejected %d samples' % (ip, n_rejected))
+
+        return np.nan_to_num(mean, nan=0.0).astype(np.float32), n_rejected
+
+
+def work(job_dir, poll_s=1.0, max_idle_s=None):
+    """
+    Node worker : claim and run tasks from a shared job directory until the job is done
+
+    :param job_dir: str, shared job directory
+    :param poll_s: float, seconds between polls when no task is available
+    :param max_idle_s: float, give up after this long without a task (None = wait for the job to finish)
+    :return: int, number of tasks completed by this worker
+    """
+
+    n_done = 0
+    t_idle = time.time()
+
+    while True:
+
+        phase = _read_json(os.path.join(job_dir, 'phase.json'))
+
+        if phase is not None and phase['name'] in ('done', 'failed'):
+            return n_done
+
+        job = _read_json(os.path.join(job_dir, 'job.json'))
+
+        if phase is not None and job is not None and _work_one(job_dir, job, phase):
+            n_done += 1
+            t_idle = time.time()
+            continue
+
+        if max_idle_s is not None and time.time() - t_idle > max_idle_s:
+            return n_done
+
+        time.sleep(poll_s)
+
+
+# Task execution
+
+_PART_EXT = dict([('register', '.json'), ('accumulate', '.npz'), ('strips', '.npy')])
+
+
+def _work_one(job_dir, job, phase):
+    """
+    Claim and run one task of the current phase
+
+    :return: bool, True if a task was run
+    """
+
+    for k in range(phase['n_tasks']):
+
+        if not _claim(job_dir, phase['seq'], k, job['stale_s']):
+            continue
+
+        print('  Running %s task %d of %d' % (phase['name'], k + 1, phase['n_tasks']))
+
+        part = _part_path(job_dir, phase['seq'], k, _PART_EXT[phase['name']])
+
+        # Leave the error for the coordinator rather than taking the worker down
+        try:
+            _TASK_FNS[phase['name']](job_dir, job, phase, k, part)
+        except Exception as err:
+            print('* %s task %d failed : %s' % (phase['name'], k + 1, err))
+            _write_json(_task_path(job_dir, phase['seq'], k, '.failed'),
+                        dict([('host', socket.gethostname()), ('pid', os.getpid()),
+                              ('error', '%s: %s' % (type(err).__name__, err)),
+                              ('traceback', traceback.format_exc())]))
+            return True
+
+        _touch(_task_path(job_dir, phase['seq'], k, '.done'))
+
+        return True
+
+    return False
+
+
+def _task_register(job_dir, job, phase, k, part):
+
+    ref_stars = pd.read_json(os.path.join(job_dir, 'ref_stars.json'))
+    matcher = AstroStack()
+
+    i0, i1 = _chunks(len(job['fnames']), job['frames_per_task'])[k]
+
+    frames = []
+    for ic in range(i0, i1):
+
+        fname = job['fnames'][ic]
+        f = dict([('index', ic), ('file', fname), ('params', None), ('inlier_frac', None),
+                  ('n_stars', 0), ('mean_diam', np.nan), ('mean_circ', np.nan), ('fwhm', np.nan), ('noise_sd', np.nan)])
+
+        aimg = AstroImage(fname)
+
+        try:
+            stars = aimg.stars(write_sidecar=True)
+
+            if ic == job['ref_index']:
+                f['params'], f['inlier_frac'] = np.eye(3).tolist(), 1.0
+            else:
+                T, inliers = matcher.calc_transform(ref_stars, stars)
+                f['params'], f['inlier_frac'] = T.params.tolist(), float(np.sum(inliers)) / len(inliers)
+
+            f['n_stars'] = aimg.num_stars()
+            f['mean_diam'] = float(aimg.mean_star_diameter())
+            f['mean_circ'] = float(aimg.mean_star_circularity())
+
+            if job['weighted']:
+                f['fwhm'] = float(aimg.estimate_global_fwhm())
+                f['noise_sd'] = float(aimg.estimate_noise_sd())
+
+        except Exception as err:
+            print('* Registration failed for %s : %s' % (fname, err))
+
+        frames.append(f)
+
+    _write_json(part, frames)
+
+
+def _task_accumulate(job_dir, job, phase, k, part):
+    """
+    Weighted S0, S1 and S2 sums over the frames of one chunk, after rejection against earlier passes
+    """
+
+    frames = _read_json(os.path.join(job_dir, 'transforms.json'))['frames']
+    shape = tuple(job['shape'])
+    kappa = np.float32(job['kappa'])
+
+    stats = []
+    for ip in range(phase['pass']):
+        with np.load(os.path.join(job_dir, 'stats_%d.npz' % ip)) as st:
+            stats.append((st['mean'], st['sd']))
+
+    s0 = np.zeros(shape, dtype=np.float64)
+    s1 = np.zeros(shape, dtype=np.float64)
+    s2 = np.zeros(shape, dtype=np.float64)
+    n_rejected = 0
+
+    i0, i1 = _chunks(len(frames), job['frames_per_task'])[k]
+
+    for f in frames[i0:i1]:
+
+        if f['weight'] <= 0.0:
+            continue
+
+        img = AstroImage(f['file']).image()
+        x = Resampler(img, np.array(f['params']), order=3, cval=np.nan, cache=False).warp(shape)
+
+        keep = np.isfinite(x)
+
+        # Rejection is cumulative over the earlier passes, as in combine_cube
+        for ip, (mean, sd) in enumerate(stats):
+            reject = keep & (np.abs(x - mean) > kappa * sd)
+            if ip == len(stats) - 1:
+                n_rejected += int(np.sum(reject))
+            keep &= ~reject
+
+        w = np.where(keep, f['weight'], 0.0)
+        x = np.where(keep, x, 0.0).astype(np.float64)
+
+        s0 += w
+        s1 += w * x
+        s2 += w * x * x
+
+    with open(part + '.tmp', 'wb') as fd:
+        np.savez(fd, s0=s0, s1=s1, s2=s2, n_rejected=n_rejected)
+    os.replace(part + '.tmp', part)
+
+
+def _task_strips(job_dir, job, phase, k, part):
+    """
+    Weighted median of one range of output rows over all included frames
+    """
+
+    frames = _read_json(os.path.join(job_dir, 'transforms.json'))['frames']
+    frames = [f for f in frames if f['weight'] > 0.0]
+
+    r0, r1 = _chunks(job['shape'][0], int(np.ceil(job['shape'][0] / float(max(job['n_strips'], 1)))))[k]
+
+    # Frames are read only for the rows each output strip maps to
+    images = [_frame_rows(f['file']) for f in frames]
+    combiner = StackCombiner(images, [np.array(f['params']) for f in frames], [f['weight'] for f in frames],
+                             tuple(job['shape']), method='median', mem_mb=job['mem_mb'],
+                             labels=[f['file'] for f in frames])
+
+    rows = np.empty([r1 - r0, job['shape'][1]], dtype=np.float32)
+    for s0 in range(r0, r1, combiner.strip_rows):
+        s1 = min(s0 + combiner.strip_rows, r1)
+        rows[s0 - r0:s1 - r0] = combiner.combine_strip(s0, s1)
+
+    with open(part + '.tmp', 'wb') as fd:
+        np.save(fd, rows)
+    os.replace(part + '.tmp', part)
+
+
+def _frame_rows(fname):
+    """
+    Frame read on demand, as luminance for one-shot-colour frames as AstroImage loads them
+    """
+
+    rows = FITSRows(fname)
+
+    try:
+        parse_pattern(rows.header()['BAYERPAT'])
+    except (KeyError, ValueError):
+        return rows
+
+    return LuminanceRows(rows)
+
+
+_TASK_FNS = dict([('register', _task_register), ('accumulate', _task_accumulate), ('strips', _task_strips)])
+
+
+# Shared directory protocol
+
+def _chunks(n, size):
+    return [(i0, min(i0 + size, n)) for i0 in range(0, n, max(size, 1))]
+
+
+def _task_path(job_dir, seq, k, ext):
+    return os.path.join(job_dir, 'tasks', '%03d_%05d%s' % (seq, k, ext))
+
+
+def _part_path(job_dir, seq, k, ext):
+    return os.path.join(job_dir, 'parts', '%03d_%05d%s' % (seq, k, ext))
+
+
+def _claim(job_dir, seq, k, stale_s):
+    """
+    Claim a task by exclusive creation of its claim file, taking over stale claims
+
+    :return: bool, True if this process now owns the task
+    """
+
+    claim = _task_path(job_dir, seq, k, '.claim')
+
+    if os.path.isfile(_task_path(job_dir, seq, k, '.done')) or os.path.isfile(_task_path(job_dir, seq, k, '.failed')):
+        return False
+
+    try:
+        if time.time() - os.path.getmtime(claim) > stale_s:
+            # Only one node succeeds in moving the stale claim aside
+            os.replace(claim, claim + '.stale')
+    except OSError:
+        pass
+
+    try:
+        fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(fd, 'w') as f:
+        f.write('%s %d %f\n' % (socket.gethostname(), os.getpid(), time.time()))
+
+    return True
+
+
+def _touch(fname):
+    with open(fname, 'w'):
+        pass
+
+
+def _write_json(fname, doc):
+    """
+    Atomic JSON write, readers never see a partial file
+    """
+
+    with open(fname + '.tmp', 'w') as fd:
+        json.dump(doc, fd, indent=2, default=float)
+    os.replace(fname + '.tmp', fname)
+
+
+def _read_json(fname):
+    try:
+        with open(fname, 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Read-on-demand access to the rows of a FITS image
+
+A FITSRows stands in for a 2D image array wherever only row windows are
+needed (the strip combiner and the Resampler translation and window paths).
+Only the header is read up front. Each slice reopens the file and reads just
+the requested rows, scaled by BZERO/BSCALE, so frames never have to be held
+in memory in full:
+
+    rows = FITSRows('light_001.fits')
+    strip = rows[100:164, :]
+
+An optional dark (subtracted), normalization and flat (divided) calibrate
+each window as it is read, as for flats going into a master or light frames
+calibrated like CalibrationLibrary.apply().
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+fits = LazyModule('astropy.io.fits')
+
+
+class FITSRows:
+
+    def __init__(self, fname, dark=None, norm=1.0, flat=None):
+        """
+        :param fname: str, FITS filename (image in the primary HDU)
+        :param dark: 2D array, subtracted from every window read (same shape as the image)
+        :param norm: float, every window read is divided by this after dark subtraction
+        :param flat: 2D array, unit median flat dividing every window read (0 where the flat is not positive)
+        """
+
+        self._fname = fname
+        self._dark = dark
+        self._norm = norm
+        self._flat = flat
+        self._header = fits.getheader(fname)
+
+        if int(self._header.get('NAXIS', 0)) != 2:
+            raise ValueError('%s is not a 2D FITS image' % fname)
+
+        self.shape = (int(self._header['NAXIS2']), int(self._header['NAXIS1']))
+        self.ndim = 2
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+
+        # Memory mapping is not possible with BZERO scaling, so read the section
+        with fits.open(self._fname, memmap=False) as hdu_list:
+            window = np.asarray(hdu_list[0].section[key], dtype=np.float32)
+
+        if self._dark is not None:
+            window = window - self._dark[key]
+
+        if self._norm != 1.0:
+            window = window / np.float32(self._norm)
+
+        if self._flat is not None:
+            flat = self._flat[key]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                window = np.where(flat > 0.0, window / flat, 0.0).astype(np.float32)
+
+        return window
+
+    def __array__(self, dtype=None, copy=None):
+        img = self[:, :]
+        return img if dtype is None else img.astype(dtype)
+
+    def fname(self):
+        return self._fname
+
+    def header(self):
+        return self._header
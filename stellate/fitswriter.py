@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Streaming float32 FITS output for combined images
+
+The primary HDU header is written first with the full image dimensions and
+combine provenance. Image data is then appended strip by strip as it leaves
+the combiner, so the result never has to be assembled in memory for export.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import numpy as np
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+fits = LazyModule('astropy.io.fits')
+
+
+class FITSStripWriter:
+
+    def __init__(self, fname, shape, provenance=None, template=None):
+        """
+        Open a float32 FITS file for strip-wise writing
+
+        :param fname: str, output FITS filename (overwritten if it exists)
+        :param shape: tuple, (ny, nx) or (n_planes, ny, nx) full image dimensions
+                      planes (eg RGB channels) are written one after another
+        :param provenance: dict, see provenance_header()
+        :param template: astropy Header, cards copied from the reference frame (eg OBJECT, TELESCOP)
+        """
+
+        self._fname = fname
+        self._shape = tuple(shape)
+        self._rows_written = 0
+
+        hdr = fits.Header()
+        hdr['SIMPLE'] = True
+        hdr['BITPIX'] = -32
+        hdr['NAXIS'] = len(self._shape)
+        for ax, n in enumerate(self._shape[::-1]):
+            hdr['NAXIS%d' % (ax + 1)] = n
+
+        if template is not None:
+            for key in ('OBJECT', 'TARGET', 'TELESCOP', 'INSTRUME', 'FILTER', 'DATE-OBS', 'EXPOSURE', 'GAIN', 'OFFSET'):
+                if key in template:
+                    hdr[key] = template[key]
+
+        if provenance:
+            provenance_header(hdr, **provenance)
+
+        if os.path.isfile(fname):
+            os.remove(fname)
+
+        self._hdu = fits.StreamingHDU(fname, hdr)
+
+    def write(self, strip):
+        """
+        Append the next strip of rows
+
+        :param strip: 2D array, (rows, nx)
+        :return: bool, True once the full image has been written
+        """
+
+        if strip.shape[1] != self._shape[-1]:
+            raise ValueError('Strip width %d does not match image width %d' % (strip.shape[1], self._shape[-1]))
+
+        complete = self._hdu.write(np.ascontiguousarray(strip, dtype=np.float32))
+        self._rows_written += strip.shape[0]
+
+        return complete
+
+    def rows_written(self):
+        return self._rows_written
+
+    def close(self):
+        self._hdu.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def provenance_header(hdr, fnames=(), weights=(), ref_index=0, method='', kappa=None, max_iters=None,
+                      max_diam=None, min_circ=None):
+    """
+    Add combine provenance cards to a FITS header
+
+    :param hdr: astropy Header, modified in place
+    :param fnames: list of str, input frame filenames
+    :param weights: list of float, per-frame integration weights (0 = excluded)
+    :param ref_index: int, reference frame index (0-based)
+    :param method: str, combine method
+    :param kappa: float, rejection threshold (sigma-clipped methods)
+    :param max_iters: int, rejection iterations
+    :param max_diam: float, inclusion criterion on mean star diameter
+    :param min_circ: float, inclusion criterion on mean star circularity
+    :return: hdr
+    """
+
+    weights = np.asarray(weights, dtype=float)
+
+    hdr['CREATOR'] = ('Stellate', 'Software creating this file')
+    hdr['COMBMETH'] = (method, 'Frame combination method')
+    hdr['NFRAMES'] = (len(fnames), 'Number of input frames')
+    hdr['NCOMBINE'] = (int(np.sum(weights > 0.0)), 'Number of frames combined')
+    hdr['REFINDEX'] = (int(ref_index), 'Reference frame index (0-based)')
+
+    if len(fnames) > ref_index:
+        hdr['REFFRAME'] = (os.path.basename(fnames[ref_index]), 'Reference frame')
+
+    if kappa is not None:
+        hdr['REJKAPPA'] = (float(kappa), 'Rejection threshold (sigma)')
+    if max_iters is not None:
+        hdr['REJITER'] = (int(max_iters), 'Maximum rejection iterations')
+    if max_diam is not None:
+        hdr['MAXDIAM'] = (float(max_diam), 'Max mean star diameter for inclusion')
+    if min_circ is not None:
+        hdr['MINCIRC'] = (float(min_circ), 'Min mean star circularity for inclusion')
+
+    # One filename and weight card per input frame
+    for ic, fname in enumerate(fnames):
+        hdr['FRM%05d' % ic] = os.path.basename(fname)
+        hdr['WGT%05d' % ic] = float(weights[ic]) if ic < len(weights) else 0.0
+
+    return hdr
@@ -11,6 +11,7 @@ DATES
 2018-10-08 JMT Implement using PyQt5 QGraphicsView
 2018-11-07 JMT Reimplement using PyQtGraph widget
 2019-02-20 JMT Start migration to PySide2 - official bindings for Qt5
+2026-10-18 JMT Tile pyramid display of large frames
 
 LICENSE
 ----
@@ -33,14 +34,16 @@ along with stellate.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 import pyqtgraph as pg
-from skimage.exposure import rescale_intensity
-from skimage.color import rgb2hsv, hsv2rgb
-from pyqtgraph.Qt import QtGui, QtWidgets
+from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 from stellate.astroimage import AstroImage
+from stellate.stretch import DisplayStretch
 
 class ImageViewer(pg.GraphicsView):
 
-    def __init__(self, central_widget):
+    # Emitted from the pyramid build thread, delivered in the GUI thread
+    pyramid_updated = QtCore.Signal()
+
+    def __init__(self, central_widget, tile_size=512):
 
         # Init the base class
         super().__init__()
@@ -57,15 +60,35 @@ class ImageViewer(pg.GraphicsView):
         self._image_item = pg.ImageItem()
         self._image_view.addItem(self._image_item)
 
-        # Add star tag overlay group
-        self._star_tags = QtWidgets.QGraphicsItemGroup()
+        # Star tag overlay : a single path item rebuilt from column arrays
+        # Cosmetic pen keeps tags one screen pixel wide at any zoom
+        pen = QtGui.QPen(QtGui.QColor('#00FF00'), 1)
+        pen.setCosmetic(True)
+        self._star_tags = QtWidgets.QGraphicsPathItem()
+        self._star_tags.setPen(pen)
         self._image_view.addItem(self._star_tags)
+        self._star_xyr = None
+        self._min_tag_px = 2.0
+        self._max_tags = 20000
+
+        # Pyramid tiles currently in the scene, keyed by (level, tile row, tile col)
+        self._tile_size = tile_size
+        self._pyramid = None
+        self._tiles = dict()
+        self._ilims = 0.0, 1.0
+
+        # Only tiles intersecting the visible region are uploaded
+        self._image_view.sigRangeChanged.connect(self.update_tiles)
+        self._image_view.sigRangeChanged.connect(self.update_star_tags)
+        self.pyramid_updated.connect(self.update_tiles)
 
         # Add empty astroimage
         self._astroimg = AstroImage()
 
-        # Init scale settings
+        # Init scale settings and display stretch
         self._scale_settings = 0.0, 100.0
+        self._stretch = DisplayStretch('linear')
+        self._lut = None
 
         # Finally show the GraphicsView
         self.show()
@@ -74,6 +97,14 @@ class ImageViewer(pg.GraphicsView):
 
         if astroimg.has_image():
 
+            # Rescaling the same image only changes the levels and LUT of the uploaded tiles
+            if astroimg is self._astroimg and self._pyramid is not None:
+                self._scale_settings = scale_settings
+                self.restretch()
+                return
+
+            new_shape = astroimg.image().shape[:2] != self._astroimg.image().shape[:2]
+
             self._astroimg = astroimg
             self._has_image = True
 
@@ -81,108 +112,181 @@ class ImageViewer(pg.GraphicsView):
             self._scale_settings = scale_settings
             self.scale_intensities()
 
-            # Extract image data from astroimage
-            img = self._astroimg.image()
+            # Cached per-image pyramid, coarser levels still building in the background
+            self._pyramid = astroimg.pyramid(self._tile_size, callback=self.pyramid_updated.emit)
 
-            # Rescale image intensities
-            img_adj = rescale_intensity(img, in_range=self._ilims, out_range='uint16')
+            # Clear any LRGB composite and tiles from the previous image
+            self._image_item.clear()
+            self.clear_tiles()
 
-            # Replace image data in the ImageItem
-            self._image_item.setImage(img_adj, autoDownsample=True)
+            if new_shape:
+                ny, nx = self._pyramid.shape()
+                self._image_view.setRange(QtCore.QRectF(0, 0, nx, ny), padding=0.0)
+
+            self.update_tiles()
 
         else:
 
             self._has_image = False
 
-    def show_stars(self, stars_df):
+    def update_tiles(self, *args):
+        """
+        Show the pyramid level matching the current zoom, uploading only visible tiles
+        """
+
+        if self._pyramid is None:
+            return
+
+        (x0, x1), (y0, y1) = self._image_view.viewRange()
+        sx, sy = self._image_view.viewPixelSize()
+
+        lvl = self._pyramid.level_for_scale(min(sx, sy))
+        wanted = set((lvl,) + t for t in self._pyramid.visible_tiles(lvl, x0, x1, y0, y1))
+
+        # Drop tiles from other levels or scrolled out of view
+        for key in set(self._tiles) - wanted:
+            self._image_view.removeItem(self._tiles.pop(key))
+
+        for key in wanted - set(self._tiles):
+
+            data, (tx0, ty0), scale = self._pyramid.tile(*key)
+
+            item = pg.ImageItem()
+            item.setImage(data, levels=self._ilims, lut=self._lut, autoLevels=False)
+            item.setPos(tx0, ty0)
+            item.setScale(scale)
+            item.setZValue(-1)
+
+            self._image_view.addItem(item)
+            self._tiles[key] = item
+
+    def clear_tiles(self):
+
+        for item in self._tiles.values():
+            self._image_view.removeItem(item)
+
+        self._tiles = dict()
+
+    def show_stars(self, stars_df, min_tag_px=2.0, max_tags=20000):
         """
         stars is a list of star region properties [rr, cc, diam, circ]
         - rr, cc : row, col of intensity weighted centroid in image space
         - diam   : equivalent circle diameter
         - circ   : region circularity (1.0 = perfect circle)
 
-        :param stars: Pandas dataframe, star metrics
+        Any previous overlay is replaced. Tags are drawn as one path, rebuilt for
+        the visible region as the view changes.
+
+        :param stars_df: Pandas dataframe, star metrics
+        :param min_tag_px: float, tags with a smaller inner radius on screen are culled
+        :param max_tags: int, maximum number of tags drawn (largest stars kept)
         :return:
         """
 
-        # Green pen for tags
-        pen = QtGui.QPen(QtGui.QColor('#00FF00'), 1)
+        self._min_tag_px = min_tag_px
+        self._max_tags = max_tags
 
-        # Create a group for the tags
-        self._star_tags = QtWidgets.QGraphicsItemGroup()
+        if stars_df is None or len(stars_df) < 1:
+            self.clear_stars()
+            return
 
-        for index, row in stars_df.iterrows():
+        # Radius of internal space for cross-hairs
+        self._star_xyr = (stars_df['xc'].values.astype(float),
+                          stars_df['yc'].values.astype(float),
+                          stars_df['diam'].values.astype(float) * 0.75)
 
-            yc, xc, d, c = row['yc'], row['xc'], row['diam'], row['circ']
+        self.update_star_tags()
 
-            # Radius of internal space for cross-hairs
-            r = d * 0.75
+    def clear_stars(self):
+        self._star_xyr = None
+        self._star_tags.setPath(QtGui.QPainterPath())
 
-            # Tag above
-            tag0 = QtWidgets.QGraphicsLineItem(xc, yc+r, xc, yc+2*r)
-            tag0.setPen(pen)
+    def update_star_tags(self, *args):
+        """
+        Rebuild the tag path for stars in view and large enough to see at the current zoom
+        """
 
-            # Tag below
-            tag1 = QtWidgets.QGraphicsLineItem(xc, yc-r, xc, yc-2*r)
-            tag1.setPen(pen)
+        if self._star_xyr is None:
+            return
 
-            # Tag left
-            tag2 = QtWidgets.QGraphicsLineItem(xc-r, yc, xc-2*r, yc)
-            tag2.setPen(pen)
+        xc, yc, r = self._star_xyr
 
-            # Tag right
-            tag3 = QtWidgets.QGraphicsLineItem(xc+r, yc, xc+2*r, yc)
-            tag3.setPen(pen)
+        (x0, x1), (y0, y1) = self._image_view.viewRange()
+        px = max(self._image_view.viewPixelSize())
 
-            # Add tags to overlay group
-            self._star_tags.addToGroup(tag0)
-            self._star_tags.addToGroup(tag1)
-            self._star_tags.addToGroup(tag2)
-            self._star_tags.addToGroup(tag3)
+        show = ((xc + 2 * r >= x0) & (xc - 2 * r <= x1) &
+                (yc + 2 * r >= y0) & (yc - 2 * r <= y1) &
+                (r >= self._min_tag_px * px))
 
-        self._image_view.addItem(self._star_tags)
+        idx = np.where(show)[0]
+        if len(idx) > self._max_tags:
+            idx = idx[np.argsort(r[idx])[::-1][:self._max_tags]]
 
-    def scale_intensities(self):
+        if len(idx) < 1:
+            self._star_tags.setPath(QtGui.QPainterPath())
+            return
 
-        smin, smax = self._scale_settings
-        imin, imax = self._astroimg.intensity_stats()
-        irng = imax - imin
+        xc, yc, r = xc[idx], yc[idx], r[idx]
+        zero = np.zeros_like(r)
 
-        # Scaled intensity limits
-        ilims = irng * smin/100.0 + imin, irng * smax/100.0 + imin
+        # Four tags per star (above, below, left, right) as disconnected segments
+        dx = np.stack([zero, zero, zero, zero, -r, -2 * r, r, 2 * r], axis=1)
+        dy = np.stack([r, 2 * r, -r, -2 * r, zero, zero, zero, zero], axis=1)
 
-        self._ilims = ilims
+        x = (xc[:, None] + dx).ravel()
+        y = (yc[:, None] + dy).ravel()
+        connect = np.tile(np.array([1, 0], dtype=np.int32), 4 * len(idx))
 
-    def render_lrgb(self, lrgb_astack):
+        self._star_tags.setPath(pg.arrayToQPath(x, y, connect=connect))
 
+    def set_stretch(self, stretch):
         """
-        Render LRGB short AstroStack as a color image in the viewer
+        :param stretch: DisplayStretch, applied as levels and a lookup table
         """
 
-        # LRGB AstroStack should have 4 elements
-        if not len(lrgb_astack) == 4:
-            return
+        self._stretch = stretch
+        self.restretch()
 
-        # Make sure all images in stack are the same dimensions
-        # Resample as necessary and return resampled dimensions
-        ny, nx = lrgb_astack.enforce_size()
+    def restretch(self):
+        """
+        Apply the current scale settings and stretch to the uploaded tiles
+        The pixel data in the tiles is untouched
+        """
 
-        rgb = np.zeros([ny, nx, 3])
+        self.scale_intensities()
 
-        rgb[:,:,0] = lrgb_astack.astroimage(1).image()
-        rgb[:,:,1] = lrgb_astack.astroimage(2).image()
-        rgb[:,:,2] = lrgb_astack.astroimage(3).image()
+        for item in self._tiles.values():
+            item.setLevels(self._ilims)
+            item.setLookupTable(self._lut)
 
-        # Convert to HSV
-        hsv = rgb2hsv(rgb)
+    def scale_intensities(self):
+        """
+        Display levels and LUT from the cached image histogram
+        Scale settings are the black and white point percentiles
+        """
 
-        # Replace V channel with lum
-        hsv[:,:,2] = lrgb_astack.astroimage(0).image()
+        smin, smax = self._scale_settings[:2]
 
-        # Convert back to RGB
-        rgb = hsv2rgb(hsv)
+        hist = self._astroimg.histogram()
+        if hist is None:
+            return
 
-        # Replace image data in the ImageItem
-        self._image_item.setImage(rgb, autoDownsample=True)
+        self._ilims = self._stretch.levels(hist, smin, smax)
+        self._lut = self._stretch.lut(hist, self._ilims)
 
+    def render_lrgb(self, compositor):
+        """
+        Render an LRGB compositor as a color image in the viewer
+        Only channels changed since the last render are reprocessed
 
+        :param compositor: LRGBCompositor
+        """
+
+        rgb = compositor.composite()
+
+        # Composite replaces any tiled mono image
+        self._pyramid = None
+        self.clear_tiles()
+
+        # Replace image data in the ImageItem
+        self._image_item.setImage(rgb, autoDownsample=True)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and memory instrumentation for the processing pipeline
+
+Pipeline code marks its stages with the module-level stage() context manager:
+
+    with stage('tophat'):
+        ...
+
+Nothing is recorded unless an Instrument is active, in which case each stage
+records wall time, process CPU time and optionally peak traced memory, tagged
+with the frame being processed. Frames are inherited from the enclosing stage, so a
+per-frame outer stage labels the work nested inside it.
+
+    with Instrument() as instr:
+        stack.register()
+    instr.report()
+    instr.to_json('timings.json')
+    instr.to_trace('timings.trace.json')
+
+Records can be exported as JSON or as a Chrome trace event file (viewable in
+chrome://tracing or Perfetto) and a cProfile of the instrumented thread can be
+collected alongside.
+
+CPU time (cpu_s) is time.process_time() of the whole process over the stage,
+so for stages running concurrently in threads (eg the thread-pool detection of
+the pipeline command) it includes the CPU time of the other threads and is not
+a per-stage figure. Only single-threaded stages and worker processes give a
+per-stage CPU time.
+
+Peak memory is off by default (Instrument(track_memory=True) to enable) since
+tracemalloc slows allocation-heavy code by up to a factor of two and so
+distorts the timings recorded in the same run. It comes from tracemalloc
+(numpy allocations are traced) and is the peak above the traced level at stage
+entry. tracemalloc is process-wide, so peaks of concurrent stages overlap.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+
+# Instrument collecting stage records (None = instrumentation off)
+_active = None
+
+
+def stage(name, frame=None):
+    """
+    Context manager timing one pipeline stage in the active Instrument
+
+    :param name: str, stage name
+    :param frame: str or int, frame label (default inherited from the enclosing stage)
+    """
+
+    if _active is None:
+        return contextlib.nullcontext()
+
+    return _active.stage(name, frame)
+
+
+def active():
+    return _active
+
+
+class Instrument:
+
+    def __init__(self, track_memory=False, profile=False):
+        """
+        :param track_memory: bool, record per-stage peak memory with tracemalloc (slows the timed code)
+        :param profile: bool, run cProfile in the activating thread while active
+        """
+
+        self.track_memory = track_memory
+
+        self._records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiler = cProfile.Profile() if profile else None
+        self._started_tracing = False
+        self._previous = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Make this the active instrument
+        """
+
+        global _active
+
+        self._previous = _active
+        _active = self
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        if self._profiler:
+            self._profiler.enable()
+
+    def stop(self):
+
+        global _active
+
+        if self._profiler:
+            self._profiler.disable()
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        _active = self._previous
+        self._previous = None
+
+    @contextlib.contextmanager
+    def stage(self, name, frame=None):
+
+        stack = self._stack()
+        if frame is None and stack:
+            frame = stack[-1]['frame']
+
+        entry = dict([('name', name), ('frame', frame), ('mem0', 0), ('peak', 0)])
+
+        if self.track_memory and tracemalloc.is_tracing():
+            cur, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            entry['mem0'] = entry['peak'] = cur
+
+        stack.append(entry)
+
+        t_start = time.time()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+
+        try:
+            yield
+        finally:
+
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+
+            stack.pop()
+
+            peak_mb = None
+            if self.track_memory and tracemalloc.is_tracing():
+                entry['peak'] = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                peak_mb = (entry['peak'] - entry['mem0']) / 1e6
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], entry['peak'])
+
+            self.add_records([dict([
+                ('stage', name),
+                ('frame', frame),
+                ('parent', stack[-1]['name'] if stack else None),
+                ('start', t_start),
+                ('wall_s', wall),
+                ('cpu_s', cpu),
+                ('peak_mb', peak_mb),
+                ('pid', os.getpid()),
+                ('thread', threading.get_ident()),
+            ])])
+
+    def add_records(self, records):
+        """
+        Append stage records, eg those returned from worker processes
+        """
+
+        with self._lock:
+            self._records.extend(records)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def summary(self):
+        """
+        Totals per stage
+
+        :return: dict, stage -> dict of n, wall_s, cpu_s, mean_wall_s, max_peak_mb
+        """
+
+        summ = dict()
+        for r in self.records():
+
+            s = summ.setdefault(r['stage'], dict([('n', 0), ('wall_s', 0.0), ('cpu_s', 0.0),
+                                                  ('mean_wall_s', 0.0), ('max_peak_mb', None)]))
+            s['n'] += 1
+            s['wall_s'] += r['wall_s']
+            s['cpu_s'] += r['cpu_s']
+            s['mean_wall_s'] = s['wall_s'] / s['n']
+            if r['peak_mb'] is not None:
+                s['max_peak_mb'] = max(s['max_peak_mb'] or 0.0, r['peak_mb'])
+
+        return summ
+
+    def report(self):
+
+        summ = self.summary()
+
+        print('')
+        print('Stage timings')
+        print('  %-14s %6s %10s %10s %10s %10s' % ('stage', 'n', 'wall (s)', 'cpu (s)', 'mean (s)', 'peak (MB)'))
+
+        for name, s in sorted(summ.items(), key=lambda kv: -kv[1]['wall_s']):
+            peak = '%10.1f' % s['max_peak_mb'] if s['max_peak_mb'] is not None else '%10s' % '-'
+            print('  %-14s %6d %10.3f %10.3f %10.4f %s' % (name, s['n'], s['wall_s'], s['cpu_s'],
+                                                          s['mean_wall_s'], peak))
+
+    def to_json(self, fname):
+        """
+        Write the stage records and per-stage summary to a JSON file
+        """
+
+        doc = dict([('summary', self.summary()), ('records', self.records())])
+
+        with open(fname, 'w') as fd:
+            json.dump(doc, fd, indent=2, default=str)
+
+    def to_trace(self, fname):
+        """
+        Write the stage records as a Chrome trace event file
+        """
+
+        records = self.records()
+        t0 = min([r['start'] for r in records], default=0.0)
+
+        events = []
+        for r in records:
+            args = dict([('frame', r['frame']), ('cpu_s', r['cpu_s']), ('peak_mb', r['peak_mb'])])
+            events.append(dict([
+                ('name', r['stage']), ('cat', 'stellate'), ('ph', 'X'),
+                ('ts', (r['start'] - t0) * 1e6), ('dur', r['wall_s'] * 1e6),
+                ('pid', r['pid']), ('tid', r['thread']), ('args', args),
+            ]))
+
+        with open(fname, 'w') as fd:
+            json.dump(dict([('traceEvents', events), ('displayTimeUnit', 'ms')]), fd, default=str)
+
+    def dump_profile(self, fname):
+        """
+        Write the cProfile statistics (readable with pstats or snakeviz)
+        """
+
+        if self._profiler is None:
+            raise RuntimeError('Instrument was created without profile=True')
+
+        self._profiler.dump_stats(fname)
+
+    # Internal methods
+
+    def _stack(self):
+        """
+        Open stages in the calling thread
+        """
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Progress, pause and cancellation control for long-running stack operations
+
+AstroStack methods report progress through a plain callable, progress(fraction).
+A JobControl is such a callable: it forwards the fraction to a listener and is
+also the point at which a worker thread blocks while paused or unwinds with
+JobCancelled once cancelled. No GUI bindings are involved, so the same jobs
+run headless or behind the Qt worker in stackworker.py.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobControl:
+
+    def __init__(self, listener=None):
+        """
+        :param listener: callable, listener(fraction) notified on every progress report
+        """
+
+        self._listener = listener
+        self._fraction = 0.0
+        self._cancel = threading.Event()
+
+        # Set while running, cleared while paused
+        self._running = threading.Event()
+        self._running.set()
+
+    def __call__(self, fraction):
+        """
+        Progress report from the job : notify, then honour pause and cancel requests
+
+        :param fraction: float, 0 to 1
+        """
+
+        self._fraction = fraction
+
+        if self._listener:
+            self._listener(fraction)
+
+        self.check()
+
+    def check(self):
+        """
+        Block while paused and raise JobCancelled if cancelled
+        """
+
+        self._running.wait()
+
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+        # Release a paused job so that it can unwind
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def fraction(self):
+        return self._fraction
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Deferred imports for the heavy scientific dependencies
+
+pandas, scipy, scikit-image and astropy together take a couple of seconds to
+import, which dominates short batch jobs and worker process startup. The core
+modules bind these packages to LazyModule stand-ins at import time and the real
+module is only imported on first attribute access, e.g.
+
+    skmeasure = LazyModule('skimage.measure')
+    ...
+    rois = skmeasure.label(mask)
+
+numpy is cheap to import and is used directly everywhere, so it stays eager.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import importlib
+
+
+class LazyModule:
+
+    def __init__(self, name):
+        """
+        :param name: str, fully qualified module name
+        """
+
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+
+        # Only reached for attributes not set in __init__
+        # import_module holds the import lock, so concurrent first uses are safe
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return "<LazyModule '%s' (%s)>" % (self._name, state)
+
+    def is_loaded(self):
+        return self._module is not None
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Cached, incremental LRGB compositing
+
+Each of the L, R, G and B channels is normalized, resampled to the common
+size only when needed and cached in float32. Loading one channel invalidates
+only that channel's cache (or all of them if the common size changes).
+
+Luminance replacement in HSV (V = L) is equivalent to scaling RGB by
+L / max(R, G, B), since hue and saturation depend only on the ratios of the
+channels. The composite is formed with that one vectorized expression instead
+of a full rgb2hsv/hsv2rgb round trip.
+
+When registration is enabled the R, G and B channels are registered to L
+with the AstroStack star matcher (calc_transform) and warped once onto the
+L pixel grid, which also takes care of any size difference. The warped
+channel is cached until either it or L is reloaded.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from stellate.astrostack import AstroStack
+from stellate.resample import Resampler
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+sktransform = LazyModule('skimage.transform')
+
+
+class LRGBCompositor:
+
+    # Channel indices in the LRGB stack
+    L, R, G, B = 0, 1, 2, 3
+
+    # Minimum star pairs matched by the refined transform (within MATCH_RESIDUAL) and matched fraction
+    # for a channel registration to be trusted
+    MIN_MATCHED = 6
+    MIN_MATCH_FRAC = 0.3
+
+    def __init__(self, register=True):
+        """
+        :param register: bool, register the colour channels to L before compositing
+        """
+
+        self._register = register
+
+        # Four-image LRGB stack
+        self._stack = AstroStack(nimgs=4)
+        self._loaded = np.zeros(4, dtype=bool)
+
+        # Per-channel version counters and cached (key, float32 image)
+        self._version = np.zeros(4, dtype=int)
+        self._cache = [None] * 4
+
+        self._rgb = None
+
+    def __len__(self):
+        return len(self._stack)
+
+    def load(self, idx, fname):
+        """
+        Load a PNG into one LRGB channel, invalidating only that channel
+
+        :param idx: int, channel index (0 = L, 1 = R, 2 = G, 3 = B)
+        :param fname: str, PNG filename
+        """
+
+        self._stack.load_png(fname, idx)
+        self._loaded[idx] = self._stack.astroimage(idx).has_image()
+        self._version[idx] += 1
+        self._rgb = None
+
+    def stack(self):
+        return self._stack
+
+    def set_register(self, register=True):
+        if register != self._register:
+            self._register = register
+            self._rgb = None
+
+    def registering(self):
+        """
+        Registration is only possible with L loaded as the reference
+        """
+        return self._register and self._loaded[self.L]
+
+    def shape(self):
+        """
+        Common size of all channels : the L grid when registering,
+        otherwise the largest loaded height and width
+        """
+
+        if self.registering():
+            return self._stack.astroimage(self.L).image().shape[:2]
+
+        ny_max, nx_max = 3, 3
+        for idx in np.where(self._loaded)[0]:
+            ny, nx = self._stack.astroimage(idx).image().shape[:2]
+            ny_max, nx_max = max(ny, ny_max), max(nx, nx_max)
+
+        return ny_max, nx_max
+
+    def channel(self, idx):
+        """
+        Normalized float32 channel at the common size, recomputed only when stale
+
+        :return: 2D float32 array or None if the channel is not loaded
+        """
+
+        if not self._loaded[idx]:
+            return None
+
+        shape = tuple(self.shape())
+        register = self.registering() and idx != self.L
+
+        # Registered colour channels also depend on the current L
+        key = (self._version[idx], self._version[self.L] if register else -1, shape)
+
+        cached = self._cache[idx]
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        print('  Preparing LRGB channel %s' % 'LRGB'[idx])
+
+        if register:
+            img = self._register_channel(idx, shape)
+        else:
+            img = self._resize(self._normalized(idx), shape)
+
+        self._cache[idx] = (key, img)
+
+        return img
+
+    def composite(self):
+        """
+        LRGB composite with luminance replacement
+
+        :return: float32 array (ny, nx, 3) in [0, 1]
+        """
+
+        if self._rgb is not None:
+            return self._rgb
+
+        ny, nx = self.shape()
+
+        rgb = np.zeros([ny, nx, 3], dtype=np.float32)
+        for ic, idx in enumerate((self.R, self.G, self.B)):
+            img = self.channel(idx)
+            if img is not None:
+                rgb[:, :, ic] = img
+
+        lum = self.channel(self.L)
+
+        if lum is not None:
+
+            # HSV value replacement : scale RGB by L / max(R, G, B), grey where RGB is black
+            vmax = np.max(rgb, axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                scale = np.where(vmax > 0.0, lum / vmax, 0.0).astype(np.float32)
+            rgb *= scale[:, :, np.newaxis]
+
+            black = vmax <= 0.0
+            rgb[black] = lum[black, np.newaxis]
+
+        self._rgb = rgb
+
+        return rgb
+
+    # Internal methods
+
+    def _normalized(self, idx):
+        """
+        Channel image as float32 scaled to [0, 1]
+        """
+
+        img = self._stack.astroimage(idx).image()
+
+        # Colour PNGs loaded into a single channel are reduced to their mean
+        if img.ndim == 3:
+            img = img[:, :, :3].mean(axis=2)
+
+        if np.issubdtype(img.dtype, np.integer):
+            return img.astype(np.float32) / np.float32(np.iinfo(img.dtype).max)
+
+        return img.astype(np.float32)
+
+    def _resize(self, img, shape):
+
+        if img.shape == tuple(shape):
+            return img
+
+        return sktransform.resize(img, shape, order=3, mode='reflect', anti_aliasing=True,
+                                  preserve_range=True).astype(np.float32)
+
+    def _register_channel(self, idx, shape):
+        """
+        Register a colour channel to L and warp it once onto the L grid
+        Falls back to a plain resize if too few star pairs match the refined transform
+        """
+
+        aimg_ref = self._stack.astroimage(self.L)
+        aimg = self._stack.astroimage(idx)
+
+        # Star catalogs are cached by each AstroImage, so L is only searched once
+        stars_ref = aimg_ref.stars()
+        stars_ind = aimg.stars()
+
+        T, inliers = None, None
+        if min(len(stars_ref), len(stars_ind)) >= self.MIN_MATCHED:
+            try:
+                T, inliers = self._stack.calc_transform(stars_ref, stars_ind)
+            except ValueError:
+                T = None
+
+        # Judge the fit by the star pairs the refined transform matches, not the number of stars detected
+        # calc_transform counts these deterministically, so the same channels always pass or fail alike
+        n_matched = 0 if T is None or inliers is None else int(np.sum(inliers))
+        match_frac = n_matched / len(inliers) if n_matched > 0 else 0.0
+
+        if n_matched < self.MIN_MATCHED or match_frac < self.MIN_MATCH_FRAC:
+            print('* Could not register channel %s to L (%d matched pairs, fraction %0.2f) - resampling only'
+                  % ('LRGB'[idx], n_matched, match_frac))
+            return self._resize(self._normalized(idx), shape)
+
+        aimg.set_transform(T, match_frac)
+
+        print('  Channel %s displacement : (%0.3f, %0.3f) pixels' % ('LRGB'[idx], T.translation[0], T.translation[1]))
+
+        img = Resampler(self._normalized(idx), T, cache=False).warp(output_shape=shape)
+
+        return np.clip(img, 0.0, 1.0)
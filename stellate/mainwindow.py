@@ -34,6 +34,10 @@ import numpy as np
 from PySide2 import QtWidgets, QtCore, QtGui
 from stellate.stellate_ui import Ui_MainWindow
 from stellate.astrostack import AstroStack
+from stellate.lrgb import LRGBCompositor
+from stellate.prefetch import FramePrefetcher
+from stellate.stackworker import StackWorker
+from stellate.stretch import DisplayStretch, METHODS
 
 
 class StellateMainWindow(QtWidgets.QMainWindow):
@@ -56,9 +60,13 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         self._n_imgs = 0
         self._img_idx = 0
         self._stack = AstroStack()
+        self._prefetch = FramePrefetcher(self._stack)
 
         # Init LRGB short stack
-        self._lrgb = AstroStack(nimgs=4)
+        self._lrgb = LRGBCompositor()
+
+        # Background stack job (register, combine)
+        self._job = None
 
         # Inclusion criteria
         self._max_diam = 100.0
@@ -66,6 +74,8 @@ class StellateMainWindow(QtWidgets.QMainWindow):
 
         # Menu callbacks
         self.ui.actionOpen_FITS.triggered.connect(self.load_fits)
+        self.ui.actionOpen_Project.triggered.connect(self.open_project)
+        self.ui.actionSave_Project.triggered.connect(self.save_project)
 
         # Text field callbacks
         self.ui.actionRefIndex.triggered.connect(self._set_ref_index)
@@ -74,8 +84,10 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         self.ui.actionMinCirc.triggered.connect(self._set_min_circ)
 
         # Stack tab slider callbacks
-        self.ui.maxLevelSlider.sliderReleased.connect(self.update_stack_viewer)
-        self.ui.minLevelSlider.sliderReleased.connect(self.update_stack_viewer)
+        # Stretch changes only update display levels and LUT, so track the slider live
+        self.ui.maxLevelSlider.valueChanged.connect(self.update_stack_viewer)
+        self.ui.minLevelSlider.valueChanged.connect(self.update_stack_viewer)
+        self.ui.stretchCombo.currentIndexChanged.connect(self._set_stretch)
 
         # Stack tab button callbacks
         self.ui.actionFindStars.triggered.connect(self.find_stars)
@@ -94,6 +106,9 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         Select and load one or more FITS images
         """
 
+        if self._job_running():
+            return
+
         # Setup file dialog options
         options = QtWidgets.QFileDialog.Options()
 
@@ -106,7 +121,9 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         if len(fnames) > 0:
 
             # Load selected FITS images into an AstroStack object
+            self._prefetch.shutdown()
             self._stack = AstroStack(fnames=fnames)
+            self._prefetch = FramePrefetcher(self._stack)
 
             # Reset current image index
             self._img_idx = 0
@@ -115,6 +132,64 @@ class StellateMainWindow(QtWidgets.QMainWindow):
             self.update_ui_text()
             self.update_stack_viewer()
 
+    def open_project(self):
+        """
+        Restore a saved session without re-running detection or registration
+        """
+
+        if self._job_running():
+            return
+
+        options = QtWidgets.QFileDialog.Options()
+
+        fname, _ = QtWidgets.QFileDialog.getOpenFileName(self,
+                                                         directory="",
+                                                         filter="Stellate projects (*.stellate)",
+                                                         options=options)
+
+        if len(fname) > 0:
+
+            # Images are attached lazily, so only the displayed frame and its neighbours are read
+            self._prefetch.shutdown()
+            self._stack = AstroStack()
+            settings = self._stack.load_session(fname)
+            self._prefetch = FramePrefetcher(self._stack)
+
+            self._max_diam = settings.get('max_diam', 100.0)
+            self._min_circ = settings.get('min_circ', 0.0)
+            self._img_idx = int(np.clip(settings.get('img_idx', 0), 0, max(len(self._stack) - 1, 0)))
+            self.ui.maxAvgDiamText.setText('%0.1f' % self._max_diam)
+            self.ui.minAvgCircText.setText('%0.1f' % self._min_circ)
+
+            if len(self._stack) > 0:
+                self.update_ui_text()
+                self.update_register()
+                self.update_stack_viewer()
+
+    def save_project(self):
+        """
+        Save the file list, reference, transforms, inclusion thresholds and frame metrics
+        """
+
+        if len(self._stack) < 1:
+            return
+
+        options = QtWidgets.QFileDialog.Options()
+
+        fname, _ = QtWidgets.QFileDialog.getSaveFileName(self,
+                                                         directory="",
+                                                         filter="Stellate projects (*.stellate)",
+                                                         options=options)
+
+        if len(fname) > 0:
+
+            if not fname.endswith('.stellate'):
+                fname += '.stellate'
+
+            settings = dict([('max_diam', self._max_diam), ('min_circ', self._min_circ),
+                             ('img_idx', int(self._img_idx))])
+            self._stack.save_session(fname, settings)
+
     def load_lrgb(self, idx=0):
 
         # Setup file dialog options
@@ -128,8 +203,8 @@ class StellateMainWindow(QtWidgets.QMainWindow):
 
         if len(fname) > 0:
 
-            # Load selected PNG image into the AstroStack at the given index
-            self._lrgb.load_png(fname, idx)
+            # Load selected PNG image into the given LRGB channel
+            self._lrgb.load(idx, fname)
             self.update_lrgb()
 
     def update_stack_viewer(self):
@@ -137,12 +212,20 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         Update image displayed in the stack viewer
         """
 
-        # Get current astroimage from stack
+        # Get current astroimage from stack, finishing any prefetch in progress
+        self._prefetch.wait(self._img_idx)
         aimg = self._stack.astroimage(self._img_idx)
 
+        # Lazy stacks reload frames that have not been prefetched
+        if not aimg.has_image():
+            aimg.load()
+
         # Pass astroimage and scale settings to image viewer
         self.ui.StackViewer.set_image(aimg, self.scale_settings())
 
+        # Prepare the neighbouring frames in the background
+        self._prefetch.prefetch(self._img_idx)
+
     def update_lrgb(self):
         """
         Update LRGB color image
@@ -183,17 +266,34 @@ class StellateMainWindow(QtWidgets.QMainWindow):
 
     def find_stars(self):
 
+        if self._job_running():
+            return
+
         stars_df = self._stack.stars(self._img_idx)
         self.ui.StackViewer.show_stars(stars_df)
 
     def register_stack(self):
         if len(self._stack) > 0:
-            self._stack.register(self.ui.registerProgressBar)
-            self.update_register()
+            # Transforms are set frame by frame, so refresh each row as its frame is registered
+            self._start_job(self._stack.register, on_frame=self.update_register_row)
 
     def combine_stack(self):
         if len(self._stack) > 0:
-            self._stack.combine(self._max_diam, self._min_circ, self.ui.registerProgressBar)
+            self._start_job(self._stack.combine, self._max_diam, self._min_circ)
+
+    def cancel_job(self):
+        if self._job is not None:
+            print('  Cancelling stack job')
+            self._job.cancel()
+
+    def toggle_pause_job(self):
+        if self._job is not None:
+            if self._job.is_paused():
+                print('  Resuming stack job')
+                self._job.resume()
+            else:
+                print('  Pausing stack job')
+                self._job.pause()
 
     def update_register(self):
         """
@@ -213,35 +313,50 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         regtab.setRowCount(n_imgs)
 
         for ic in range(0, n_imgs):
+            self.update_register_row(ic)
+
+    def update_register_row(self, ic):
+        """
+        Refill one row of the registration table (eg as its frame is registered)
+        Frames without stars show NaN star metrics
 
-            aimg = self._stack.astroimage(ic)
+        :param ic: int, frame index
+        """
 
-            # Pull information for registration table
-            fname = os.path.basename(aimg.filename())
-            n_stars = aimg.num_stars()
-            avg_diam = aimg.mean_star_diameter()
-            avg_circ = aimg.mean_star_circularity()
-            T = aimg.transform()
-            dx, dy = T.translation
-            rot = np.rad2deg(T.rotation)
+        regtab = self.ui.registrationTable
 
-            # Set row background color depending on image status (ref, excluded, etc)
-            if avg_diam > self._max_diam or avg_circ < self._min_circ:
-                bgcolor = QtGui.QColor(250, 220, 200)
-            else:
-                bgcolor = QtGui.QColor(255, 255, 255)
+        if regtab.rowCount() != len(self._stack):
+            self.update_register()
+            return
+
+        aimg = self._stack.astroimage(ic)
+
+        # Pull information for registration table
+        fname = os.path.basename(aimg.filename())
+        n_stars = aimg.num_stars()
+        avg_diam = aimg.mean_star_diameter()
+        avg_circ = aimg.mean_star_circularity()
+        T = aimg.transform()
+        dx, dy = T.translation
+        rot = np.rad2deg(T.rotation)
+
+        # Set row background color depending on image status (ref, excluded, etc)
+        if avg_diam > self._max_diam or avg_circ < self._min_circ:
+            bgcolor = QtGui.QColor(250, 220, 200)
+        else:
+            bgcolor = QtGui.QColor(255, 255, 255)
 
-            if ic == self._stack.ref_index:
-                bgcolor = QtGui.QColor(220, 250, 220)
+        if ic == self._stack.ref_index:
+            bgcolor = QtGui.QColor(220, 250, 220)
 
-            # Fill row
-            self._set_table_item(regtab, ic, 0, '%d' % n_stars, bgcolor)
-            self._set_table_item(regtab, ic, 1, '%0.3f' % avg_diam, bgcolor)
-            self._set_table_item(regtab, ic, 2, '%0.3f' % avg_circ, bgcolor)
-            self._set_table_item(regtab, ic, 3, '%0.3f' % dx, bgcolor)
-            self._set_table_item(regtab, ic, 4, '%0.3f' % dy, bgcolor)
-            self._set_table_item(regtab, ic, 5, '%0.3f' % rot, bgcolor)
-            self._set_table_item(regtab, ic, 6, fname, bgcolor)
+        # Fill row
+        self._set_table_item(regtab, ic, 0, '%d' % n_stars, bgcolor)
+        self._set_table_item(regtab, ic, 1, '%0.3f' % avg_diam, bgcolor)
+        self._set_table_item(regtab, ic, 2, '%0.3f' % avg_circ, bgcolor)
+        self._set_table_item(regtab, ic, 3, '%0.3f' % dx, bgcolor)
+        self._set_table_item(regtab, ic, 4, '%0.3f' % dy, bgcolor)
+        self._set_table_item(regtab, ic, 5, '%0.3f' % rot, bgcolor)
+        self._set_table_item(regtab, ic, 6, fname, bgcolor)
 
     def keyPressEvent(self, event):
         """
@@ -253,6 +368,14 @@ class StellateMainWindow(QtWidgets.QMainWindow):
 
         key = event.key()
 
+        # Escape cancels and P pauses or resumes a running stack job
+        if key == QtCore.Qt.Key_Escape:
+            self.cancel_job()
+            return
+        elif key == QtCore.Qt.Key_P:
+            self.toggle_pause_job()
+            return
+
         if len(self._stack) > 0:
 
             ni, ii = len(self._stack), self._img_idx
@@ -267,11 +390,67 @@ class StellateMainWindow(QtWidgets.QMainWindow):
             # Update meta data, etc in GUI
             self.update_ui_text()
 
-            # Update displayed image in viewer
-            self.ui.StackViewer.set_image(self._stack.astroimage(self._img_idx), self.scale_settings())
+            # Update displayed image in viewer and prefetch its neighbours
+            self.update_stack_viewer()
 
     # Internal methods
 
+    def _start_job(self, job, *args, on_progress=None, on_frame=None, **kwargs):
+        """
+        Run a stack operation in a worker thread, keeping the GUI responsive
+        on_frame(index) is called in the GUI thread as the job finishes each frame
+        """
+
+        if self._job is not None:
+            print('* A stack job is already running - returning')
+            return
+
+        self._job = StackWorker(job, *args, report_frames=on_frame is not None, **kwargs)
+
+        progbar = self.ui.registerProgressBar
+        self._job.progress.connect(lambda frac: progbar.setValue(frac * 100.0))
+        if on_progress:
+            self._job.progress.connect(on_progress)
+        if on_frame:
+            self._job.frame.connect(on_frame)
+
+        self._job.done.connect(self._job_done)
+        self._job.cancelled.connect(self._job_done)
+        self._job.failed.connect(self._job_failed)
+
+        self._set_stack_actions(False)
+        self._job.start()
+
+    def _job_done(self, result=None):
+
+        self.ui.registerProgressBar.setValue(0.0)
+        self.update_register()
+
+        # Wait for the thread to exit before releasing it
+        self._job.wait()
+        self._job = None
+
+        self._set_stack_actions(True)
+
+    def _job_failed(self, message):
+        print('* Stack job failed : %s' % message)
+        self._job_done()
+
+    def _job_running(self):
+        """
+        Actions that replace or search the stack must wait for a running job, which still uses it
+        """
+
+        if self._job is not None:
+            print('* A stack job is running - cancel it (Esc) or wait for it to finish')
+            return True
+
+        return False
+
+    def _set_stack_actions(self, enabled):
+        for action in (self.ui.actionOpen_FITS, self.ui.actionOpen_Project, self.ui.actionFindStars):
+            action.setEnabled(enabled)
+
     def _set_table_item(self, regtab, row, col, text, bgcolor=QtGui.QColor(255, 255, 255)):
 
         qitem = QtWidgets.QTableWidgetItem(text)
@@ -279,6 +458,13 @@ class StellateMainWindow(QtWidgets.QMainWindow):
         qitem.setBackground(bgcolor)
         regtab.setItem(row, col, qitem)
 
+    def _set_stretch(self, idx):
+        """
+        Stretch selector items follow the order of stretch.METHODS
+        """
+
+        self.ui.StackViewer.set_stretch(DisplayStretch(METHODS[idx]))
+
     def _set_ref_index(self):
 
         ref_txt = self.ui.refIndexText.text()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Background prefetch of neighbouring frames for stack navigation
+
+While one frame is on screen, the frames either side of it are made display
+ready in worker threads: re-read from disk for lazy stacks, histogram cached
+for the display stretch and tile pyramid built. Stepping to a neighbour then
+only uploads the visible tiles. In lazy stacks, frames that fall outside the
+prefetch window are purged again so memory stays bounded.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FramePrefetcher:
+
+    def __init__(self, astack, radius=1, tile_size=512, n_workers=2):
+        """
+        :param astack: AstroStack, frames to navigate
+        :param radius: int, number of frames prefetched either side of the current frame
+        :param tile_size: int, display tile size (must match the viewer)
+        :param n_workers: int, worker threads
+        """
+
+        self._stack = astack
+        self._radius = radius
+        self._tile_size = tile_size
+        self._pool = ThreadPoolExecutor(max_workers=n_workers)
+
+        # Pending or completed preparation jobs, keyed by frame index
+        self._jobs = dict()
+
+    def prefetch(self, idx):
+        """
+        Prepare the neighbours of frame idx and release lazy frames outside the window
+
+        :param idx: int, frame currently displayed
+        """
+
+        n = len(self._stack)
+        if n < 1:
+            return
+
+        # Nearest neighbours first, wrapping around like the arrow-key navigation
+        window = [idx % n]
+        for k in range(1, self._radius + 1):
+            window += [(idx + k) % n, (idx - k) % n]
+
+        for ic in window:
+            if ic not in self._jobs:
+                self._jobs[ic] = self._pool.submit(self._prepare, ic)
+
+        for ic in list(self._jobs):
+            if ic not in window:
+                self._release(ic)
+
+    def wait(self, idx):
+        """
+        Block until frame idx is display ready if it is being prefetched
+        """
+
+        job = self._jobs.get(idx)
+        if job is not None:
+            job.result()
+
+    def is_ready(self, idx):
+        job = self._jobs.get(idx)
+        return job is not None and job.done()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        self._jobs = dict()
+
+    # Internal methods
+
+    def _prepare(self, idx):
+
+        aimg = self._stack.astroimage(idx)
+
+        if not aimg.has_image() and not aimg.load():
+            return False
+
+        aimg.histogram()
+
+        pyr = aimg.pyramid(self._tile_size)
+        if pyr is not None:
+            pyr.wait()
+
+        return True
+
+    def _release(self, idx):
+        """
+        Forget a frame outside the window, purging its data if the stack is lazy
+        """
+
+        job = self._jobs.pop(idx)
+
+        aimg = self._stack.astroimage(idx)
+        if aimg.in_memory():
+            return
+
+        # Jobs not yet started are dropped, a running job would reload the frame after a purge
+        if not job.cancel():
+            job.result()
+            aimg.purge()
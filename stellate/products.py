@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Lazy, memoized dependency graph of derived image products
+
+Each product declares the products it is computed from and its parameters.
+Products are computed on first request and kept until something upstream
+changes, at which point everything downstream is invalidated:
+
+    graph = ProductGraph()
+    graph.source('image', img)
+    graph.product('fwhm', calc_fwhm, inputs=['image'])
+    graph.product('mask', calc_mask, inputs=['image', 'fwhm'], params=dict([('radius', 5)]), cached=True)
+
+    graph.get('mask')              # computes fwhm, then mask
+    graph.set_params('mask', radius=3)
+    graph.get('mask')              # recomputes mask only
+    graph.set('image', resized)    # fwhm and mask are now stale and recomputed on request
+
+Small results are kept with the graph. Large intermediates (cached=True) go
+in a ProductCache shared between graphs and bounded in memory, from which the
+least recently used entries are evicted and recomputed if needed again.
+
+Sources can also be released (dropped without invalidating anything, eg a
+purged frame) and reattached with the same data. A derived product can be set
+directly (eg a star catalog read from a sidecar) and then stands until its
+inputs change.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import weakref
+import threading
+import itertools
+from collections import OrderedDict
+
+
+class MissingInput(RuntimeError):
+    """
+    A product was requested but one of its sources has no data
+    """
+
+
+class ProductCache:
+
+    def __init__(self, max_mb=512.0):
+        """
+        Least recently used store for large intermediate products
+
+        :param max_mb: float, memory bound for all entries
+        """
+
+        self.max_mb = max_mb
+
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: (bool, value), hit flag and cached value
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key][0]
+
+    def put(self, key, value):
+
+        nbytes = _nbytes(value)
+
+        with self._lock:
+
+            self._discard(key)
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+
+            # Evict least recently used, always keeping the newest entry
+            while self._nbytes > self.max_mb * 1e6 and len(self._entries) > 1:
+                old = next(iter(self._entries))
+                self._discard(old)
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def discard_owner(self, owner):
+        """
+        Drop all entries of one graph (keys are (owner, name) tuples)
+        """
+
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == owner]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._nbytes = 0
+
+    def size_mb(self):
+        return self._nbytes / 1e6
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Internal methods
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[1]
+
+
+class ProductGraph:
+
+    # Unique prefix for this graph's entries in a shared cache
+    _ids = itertools.count()
+
+    def __init__(self, cache=None):
+        """
+        :param cache: ProductCache, bounded store for cached products (default private 512 MB cache)
+        """
+
+        self._cache = ProductCache() if cache is None else cache
+        self._id = next(ProductGraph._ids)
+
+        self._nodes = dict()
+        self._values = dict()
+        self._revisions = dict()
+        self._lock = threading.RLock()
+
+        # Free this graph's share of the cache once it is garbage collected
+        weakref.finalize(self, self._cache.discard_owner, self._id)
+
+    def source(self, name, value=None):
+        """
+        Declare a source product, optionally with its initial value
+        """
+
+        self._add(name, None, [], dict(), False)
+
+        if value is not None:
+            self.set(name, value)
+
+    def product(self, name, fn, inputs=(), params=None, cached=False):
+        """
+        Declare a derived product
+
+        :param name: str, product name
+        :param fn: callable, fn(*input_values, **params) returning the product
+        :param inputs: list of str, products this one is computed from (declared first)
+        :param params: dict, parameters passed to fn by keyword
+        :param cached: bool, keep in the bounded shared cache (large intermediates) rather than with the graph
+        """
+
+        for inp in inputs:
+            if inp not in self._nodes:
+                raise KeyError('Input %s of %s is not declared' % (inp, name))
+
+        self._add(name, fn, list(inputs), dict(params or dict()), cached)
+
+    def get(self, name):
+        """
+        Product value, computing it and any stale inputs as needed
+
+        :raises MissingInput: if a source it depends on has no data
+        """
+
+        with self._lock:
+
+            hit, value = self._lookup(name)
+            if hit:
+                return value
+
+            node = self._nodes[name]
+            if node['fn'] is None:
+                raise MissingInput('Source %s has no data' % name)
+
+            args = [self.get(inp) for inp in node['inputs']]
+            value = node['fn'](*args, **node['params'])
+
+            self._store(name, value)
+
+            return value
+
+    def peek(self, name, default=None):
+        """
+        Product value if already available, without computing anything
+        """
+
+        with self._lock:
+            hit, value = self._lookup(name)
+            return value if hit else default
+
+    def has(self, name):
+        with self._lock:
+            return self._lookup(name)[0]
+
+    def set(self, name, value):
+        """
+        Replace a product's value, invalidating everything computed from it
+        """
+
+        with self._lock:
+            self.invalidate(name)
+            self._store(name, value)
+
+    def attach(self, name, value):
+        """
+        Reattach the same data to a released product, keeping everything computed from it
+        """
+
+        with self._lock:
+            self._drop(name)
+            self._store(name, value)
+
+    def release(self, name):
+        """
+        Drop a product's value to free memory, keeping everything computed from it
+        """
+
+        with self._lock:
+            self._drop(name)
+
+    def invalidate(self, name):
+        """
+        Drop a product and everything downstream of it
+        """
+
+        with self._lock:
+            for n in [name] + self.downstream(name):
+                self._drop(n)
+
+    def set_params(self, name, **params):
+        """
+        Update product parameters, invalidating it and its dependents if any changed
+        """
+
+        with self._lock:
+
+            node = self._nodes[name]
+            changed = any(node['params'].get(k) != v for k, v in params.items())
+            node['params'].update(params)
+
+            if changed:
+                self.invalidate(name)
+
+    def params(self, name):
+        return dict(self._nodes[name]['params'])
+
+    def revision(self, name):
+        """
+        Counter that changes whenever a product's value is stored or dropped
+        """
+
+        return self._revisions.get(name, 0)
+
+    def downstream(self, name):
+        """
+        All products computed directly or indirectly from a product, in declaration order
+        """
+
+        down = set([name])
+        for n, node in self._nodes.items():
+            if any(inp in down for inp in node['inputs']):
+                down.add(n)
+
+        down.discard(name)
+
+        return [n for n in self._nodes if n in down]
+
+    # Internal methods
+
+    def _add(self, name, fn, inputs, params, cached):
+
+        if name in self._nodes:
+            raise KeyError('Product %s is already declared' % name)
+
+        self._nodes[name] = dict([('fn', fn), ('inputs', inputs), ('params', params), ('cached', cached)])
+
+    def _key(self, name):
+        return self._id, name
+
+    def _lookup(self, name):
+
+        if self._nodes[name]['cached']:
+            return self._cache.get(self._key(name))
+
+        if name in self._values:
+            return True, self._values[name]
+
+        return False, None
+
+    def _store(self, name, value):
+
+        self._revisions[name] = self.revision(name) + 1
+
+        if self._nodes[name]['cached']:
+            self._cache.put(self._key(name), value)
+        else:
+            self._values[name] = value
+
+    def _drop(self, name):
+
+        if self._lookup(name)[0]:
+            self._revisions[name] = self.revision(name) + 1
+
+        if self._nodes[name]['cached']:
+            self._cache.discard(self._key(name))
+        else:
+            self._values.pop(name, None)
+
+
+def _nbytes(value):
+    """
+    Approximate memory footprint of a product for the cache bound
+    """
+
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+
+    return 0
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution tile pyramid for interactive display of large frames
+
+Level 0 is the full resolution image and each further level is a 2 x 2 block
+mean of the previous one, down to a single tile. Levels are built in a
+background thread so the viewer can show level 0 immediately and switch to
+coarser levels as they become available. The viewer then only uploads the
+tiles of one level that intersect the visible region.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+import numpy as np
+
+
+class ImagePyramid:
+
+    def __init__(self, image, tile_size=512, callback=None):
+        """
+        :param image: 2D array, full resolution image (level 0, not copied)
+        :param tile_size: int, tile width and height in pixels at every level
+        :param callback: callable, called from the build thread after each new level
+        """
+
+        self._tile_size = tile_size
+        self._callback = callback
+        self._levels = [np.asarray(image)]
+        self._thread = None
+        self._done = threading.Event()
+
+    def start(self):
+        """
+        Build the coarser levels in a background thread
+        """
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.build, daemon=True)
+            self._thread.start()
+
+        return self
+
+    def build(self):
+        """
+        Build all levels in the calling thread (returns once complete)
+        """
+
+        while max(self._levels[-1].shape[:2]) > self._tile_size:
+
+            # Appending whole levels keeps readers in other threads consistent
+            self._levels.append(downsample2(self._levels[-1]))
+
+            if self._callback:
+                self._callback()
+
+        self._done.set()
+
+        return self
+
+    def set_callback(self, callback=None):
+        self._callback = callback
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def is_complete(self):
+        return self._done.is_set()
+
+    def n_levels(self):
+        """
+        Number of levels available so far
+        """
+        return len(self._levels)
+
+    def level(self, lvl=0):
+        return self._levels[lvl]
+
+    def tile_size(self):
+        return self._tile_size
+
+    def shape(self):
+        return self._levels[0].shape[:2]
+
+    def level_for_scale(self, scale):
+        """
+        Coarsest available level that still has at least one pixel per screen pixel
+
+        :param scale: float, image pixels per screen pixel at the current zoom
+        :return: int, level index
+        """
+
+        lvl = int(np.floor(np.log2(max(scale, 1.0))))
+
+        return min(lvl, self.n_levels() - 1)
+
+    def visible_tiles(self, lvl, x0, x1, y0, y1):
+        """
+        Tiles of a level intersecting a region given in full resolution pixel coordinates
+
+        :return: list of (ty, tx) tile indices
+        """
+
+        ny, nx = self._levels[lvl].shape[:2]
+        span = self._tile_size * 2 ** lvl
+
+        tx0, tx1 = max(int(x0 // span), 0), min(int(np.ceil(x1 / span)), int(np.ceil(nx / self._tile_size)))
+        ty0, ty1 = max(int(y0 // span), 0), min(int(np.ceil(y1 / span)), int(np.ceil(ny / self._tile_size)))
+
+        return [(ty, tx) for ty in range(ty0, ty1) for tx in range(tx0, tx1)]
+
+    def tile(self, lvl, ty, tx):
+        """
+        Tile data (a view into the level) and its origin and pixel scale in full resolution coordinates
+
+        :return: 2D array, (x0, y0), scale
+        """
+
+        ts = self._tile_size
+        data = self._levels[lvl][ty * ts:(ty + 1) * ts, tx * ts:(tx + 1) * ts]
+        scale = 2 ** lvl
+
+        return data, (tx * ts * scale, ty * ts * scale), scale
+
+
+def downsample2(img):
+    """
+    2 x 2 block mean, replicating the last row or column of odd-sized images
+
+    :param img: 2D or 3D (ny, nx, channels) array
+    :return: float32 array of half size (rounded up)
+    """
+
+    img = np.asarray(img, dtype=np.float32)
+    ny, nx = img.shape[:2]
+
+    if ny % 2 or nx % 2:
+        pad = [(0, ny % 2), (0, nx % 2)] + [(0, 0)] * (img.ndim - 2)
+        img = np.pad(img, pad, mode='edge')
+
+    return 0.25 * (img[0::2, 0::2] + img[1::2, 0::2] + img[0::2, 1::2] + img[1::2, 1::2])
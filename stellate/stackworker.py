@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Qt worker thread running AstroStack jobs off the GUI thread
+
+The job is any callable taking a progress keyword (register, combine, drizzle,
+clean, ...). A JobControl is passed as the progress callable, so progress is
+streamed back to the GUI thread through a signal and the job can be paused,
+resumed or cancelled between frames or strips.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PySide2 import QtCore
+from stellate.jobs import JobControl, JobCancelled
+
+
+class StackWorker(QtCore.QThread):
+
+    # Signals are delivered in the GUI thread
+    progress = QtCore.Signal(float)
+    frame = QtCore.Signal(int)
+    done = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+    def __init__(self, job, *args, report_frames=False, **kwargs):
+        """
+        :param job: callable, job(*args, progress=JobControl, **kwargs)
+        :param report_frames: bool, also pass on_frame=frame.emit so the job can signal each frame it finishes
+        """
+
+        super().__init__()
+
+        self._job = job
+        self._args = args
+        self._kwargs = kwargs
+
+        if report_frames:
+            self._kwargs['on_frame'] = self.frame.emit
+        self._control = JobControl(self.progress.emit)
+
+    def run(self):
+
+        try:
+            result = self._job(*self._args, progress=self._control, **self._kwargs)
+        except JobCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as err:
+            self.failed.emit('%s: %s' % (type(err).__name__, err))
+            return
+
+        self.done.emit(result)
+
+    def cancel(self):
+        self._control.cancel()
+
+    def pause(self):
+        self._control.pause()
+
+    def resume(self):
+        self._control.resume()
+
+    def is_paused(self):
+        return self._control.is_paused()
@@ -121,6 +121,12 @@ class Ui_MainWindow(object):
         self.minLevelSlider.setOrientation(QtCore.Qt.Horizontal)
         self.minLevelSlider.setObjectName("minLevelSlider")
         self.verticalLayout_5.addWidget(self.minLevelSlider)
+        self.stretchCombo = QtWidgets.QComboBox(self.levelsTools)
+        self.stretchCombo.setObjectName("stretchCombo")
+        self.stretchCombo.addItem("")
+        self.stretchCombo.addItem("")
+        self.stretchCombo.addItem("")
+        self.verticalLayout_5.addWidget(self.stretchCombo)
         spacerItem = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.verticalLayout_5.addItem(spacerItem)
         self.StackTools.addItem(self.levelsTools, "")
@@ -432,6 +438,10 @@ class Ui_MainWindow(object):
         self.actionSave_FITS.setObjectName("actionSave_FITS")
         self.actionOpen_FITS = QtWidgets.QAction(MainWindow)
         self.actionOpen_FITS.setObjectName("actionOpen_FITS")
+        self.actionOpen_Project = QtWidgets.QAction(MainWindow)
+        self.actionOpen_Project.setObjectName("actionOpen_Project")
+        self.actionSave_Project = QtWidgets.QAction(MainWindow)
+        self.actionSave_Project.setObjectName("actionSave_Project")
         self.actionClose = QtWidgets.QAction(MainWindow)
         self.actionClose.setObjectName("actionClose")
         self.actionFindStars = QtWidgets.QAction(MainWindow)
@@ -453,6 +463,9 @@ class Ui_MainWindow(object):
         self.menuFile.addAction(self.actionOpen_FITS)
         self.menuFile.addAction(self.actionSave_FITS)
         self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionOpen_Project)
+        self.menuFile.addAction(self.actionSave_Project)
+        self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionClose)
         self.menubar.addAction(self.menuFile.menuAction())
 
@@ -481,6 +494,9 @@ class Ui_MainWindow(object):
         self.maxIndexText.setText(QtWidgets.QApplication.translate("MainWindow", "0", None, -1))
         self.minLevelText.setText(QtWidgets.QApplication.translate("MainWindow", "0", None, -1))
         self.maxLevelText.setText(QtWidgets.QApplication.translate("MainWindow", "100", None, -1))
+        self.stretchCombo.setItemText(0, QtWidgets.QApplication.translate("MainWindow", "Linear", None, -1))
+        self.stretchCombo.setItemText(1, QtWidgets.QApplication.translate("MainWindow", "Asinh", None, -1))
+        self.stretchCombo.setItemText(2, QtWidgets.QApplication.translate("MainWindow", "Auto (MTF)", None, -1))
         self.StackTools.setItemText(self.StackTools.indexOf(self.levelsTools), QtWidgets.QApplication.translate("MainWindow", "Levels", None, -1))
         self.findStarsButton.setText(QtWidgets.QApplication.translate("MainWindow", "Find Stars", None, -1))
         self.StackTools.setItemText(self.StackTools.indexOf(self.starsTools), QtWidgets.QApplication.translate("MainWindow", "Stars", None, -1))
@@ -528,6 +544,10 @@ class Ui_MainWindow(object):
         self.actionSave_FITS.setShortcut(QtWidgets.QApplication.translate("MainWindow", "Ctrl+S", None, -1))
         self.actionOpen_FITS.setText(QtWidgets.QApplication.translate("MainWindow", "Open FITS ...", None, -1))
         self.actionOpen_FITS.setShortcut(QtWidgets.QApplication.translate("MainWindow", "Ctrl+O", None, -1))
+        self.actionOpen_Project.setText(QtWidgets.QApplication.translate("MainWindow", "Open Project ...", None, -1))
+        self.actionOpen_Project.setShortcut(QtWidgets.QApplication.translate("MainWindow", "Ctrl+Shift+O", None, -1))
+        self.actionSave_Project.setText(QtWidgets.QApplication.translate("MainWindow", "Save Project ...", None, -1))
+        self.actionSave_Project.setShortcut(QtWidgets.QApplication.translate("MainWindow", "Ctrl+Shift+S", None, -1))
         self.actionClose.setText(QtWidgets.QApplication.translate("MainWindow", "Close", None, -1))
         self.actionClose.setShortcut(QtWidgets.QApplication.translate("MainWindow", "Ctrl+W", None, -1))
         self.actionFindStars.setText(QtWidgets.QApplication.translate("MainWindow", "FindStars", None, -1))
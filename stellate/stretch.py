@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Display stretches computed from a cached intensity histogram
+
+The histogram of each image is built once. Black and white points, the
+median and a robust noise estimate are then read from its cumulative
+distribution, so changing the stretch never touches the pixel data. A stretch
+is expressed as display levels plus a lookup table that the viewer applies on
+the GPU side (pyqtgraph ImageItem levels and LUT):
+- linear : straight ramp between the black and white points
+- asinh  : arcsinh ramp, lifting faint nebulosity while keeping star cores [1]
+- mtf    : midtones transfer function with the midtone balance set so that
+           the sky median lands on a target display level [2]
+
+Refs
+----
+[1] R. H. Lupton et al., "Preparing Red-Green-Blue Images from CCD Data,"
+PASP, vol. 116, no. 816, pp. 133-137, Feb. 2004.
+[2] PixInsight Reference Documentation, HistogramTransformation and ScreenTransferFunction.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+METHODS = ('linear', 'asinh', 'mtf')
+
+
+class ImageHistogram:
+
+    def __init__(self, image, n_bins=16384):
+        """
+        Intensity histogram over the full image range, computed once
+
+        :param image: array, any shape (NaNs are ignored)
+        :param n_bins: int, number of histogram bins
+        """
+
+        data = np.asarray(image).ravel()
+        finite = np.isfinite(data) if np.issubdtype(data.dtype, np.floating) else None
+        if finite is not None and not np.all(finite):
+            data = data[finite]
+
+        if data.size < 1:
+            self._edges = np.array([0.0, 1.0])
+            self._cdf = np.array([0.0, 1.0])
+            return
+
+        lo, hi = float(np.min(data)), float(np.max(data))
+        if hi <= lo:
+            hi = lo + 1.0
+
+        counts, self._edges = np.histogram(data, bins=n_bins, range=(lo, hi))
+
+        # Cumulative fraction at each bin edge
+        self._cdf = np.concatenate([[0.0], np.cumsum(counts)]) / float(data.size)
+
+    def range(self):
+        return self._edges[0], self._edges[-1]
+
+    def percentile(self, pct):
+        """
+        Intensity at a percentile, interpolated within bins
+
+        :param pct: float or array, 0 to 100
+        """
+        return np.interp(np.asarray(pct) / 100.0, self._cdf, self._edges)
+
+    def cdf(self, value):
+        """
+        Fraction of pixels at or below an intensity
+        """
+        return np.interp(value, self._edges, self._cdf)
+
+    def median(self):
+        return float(self.percentile(50.0))
+
+    def mad(self):
+        """
+        Median absolute deviation from the median, found on the bin grid
+        """
+
+        med = self.median()
+        d = np.abs(self._edges - med)
+        d = np.unique(d)
+
+        # Fraction within +/- d of the median for every candidate d at once
+        frac = self.cdf(med + d) - self.cdf(med - d)
+
+        return float(np.interp(0.5, frac, d))
+
+
+class DisplayStretch:
+
+    def __init__(self, method='linear', asinh_beta=10.0, target_bkg=0.25, clip_sigma=-2.8):
+        """
+        :param method: str, 'linear', 'asinh' or 'mtf'
+        :param asinh_beta: float, asinh softening; larger values lift faint signal more
+        :param target_bkg: float, display level of the sky median for 'mtf' (0 to 1)
+        :param clip_sigma: float, black point offset from the median in robust sigma for 'mtf'
+                           when the black point percentile is 0
+        """
+
+        if method not in METHODS:
+            raise ValueError('Unknown stretch method %s' % method)
+
+        self.method = method
+        self.asinh_beta = asinh_beta
+        self.target_bkg = target_bkg
+        self.clip_sigma = clip_sigma
+
+    def levels(self, hist, black_pct=0.0, white_pct=100.0):
+        """
+        Black and white points from the cached histogram
+
+        :param hist: ImageHistogram
+        :param black_pct: float, black point percentile (0 to 100)
+        :param white_pct: float, white point percentile (0 to 100)
+        :return: (black, white) intensities
+        """
+
+        lo, hi = hist.percentile([black_pct, white_pct])
+
+        # Automatic black point just below the sky for midtone stretches
+        if self.method == 'mtf' and black_pct <= 0.0:
+            lo = max(lo, hist.median() + self.clip_sigma * 1.4826 * hist.mad())
+
+        if hi <= lo:
+            hi = lo + max(abs(lo) * 1e-6, 1e-6)
+
+        return float(lo), float(hi)
+
+    def lut(self, hist, levels, n=4096):
+        """
+        Lookup table mapping the range between levels to 8-bit display values
+
+        :param hist: ImageHistogram
+        :param levels: (black, white) from levels()
+        :param n: int, table length
+        :return: uint8 array (n, 3)
+        """
+
+        x = np.linspace(0.0, 1.0, n)
+
+        if self.method == 'asinh':
+            y = np.arcsinh(self.asinh_beta * x) / np.arcsinh(self.asinh_beta)
+
+        elif self.method == 'mtf':
+            lo, hi = levels
+            med = np.clip((hist.median() - lo) / (hi - lo), 1e-6, 1.0 - 1e-6)
+            y = mtf(x, midtone_balance(med, self.target_bkg))
+
+        else:
+            y = x
+
+        y = np.round(255.0 * np.clip(y, 0.0, 1.0)).astype(np.uint8)
+
+        return np.repeat(y[:, np.newaxis], 3, axis=1)
+
+
+def mtf(x, m):
+    """
+    Midtones transfer function : MTF(0) = 0, MTF(m) = 0.5, MTF(1) = 1
+    """
+    x = np.asarray(x, dtype=float)
+    return (m - 1.0) * x / ((2.0 * m - 1.0) * x - m)
+
+
+def midtone_balance(x, target):
+    """
+    Midtone balance m for which MTF(x) = target
+    """
+    return x * (target - 1.0) / (2.0 * target * x - target - x)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Synthetic star field generator with known ground truth
+
+A SyntheticField is a fixed patch of sky (star positions and fluxes in the
+reference frame) seen through a fixed sensor (hot pixel positions). Each call
+to frame() renders one exposure of it through a known transform, with its own
+PSF FWHM, sky level, gradient, vignetting and noise, and returns the image
+with a truth dictionary. Transforms follow the AstroStack convention and map
+reference (x, y) to frame (x, y), so they compare directly with calc_transform
+and load into a stack with AstroStack.load_transforms.
+
+    field = SyntheticField(shape=(4000, 6000), density=300.0, n_hot=200, seed=1)
+    img, truth = field.frame(random_transform(rng, max_shift=30.0), fwhm=3.5)
+    fnames = field.write_stack('/tmp/synth', n_frames=10)
+
+Stars are rendered as pixel-integrated Gaussian or Moffat profiles. Background
+and noise are generated in row strips, so frames up to about 100 MP need little
+more memory than the float32 image itself.
+
+AUTHOR
+----
+Mike Tyszka, Ph.D.
+
+DATES
+----
+2026-10-18 JMT From scratch
+
+LICENSE
+----
+
+This file is part of Stellate.
+
+Stellate is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Stellate is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with stellate.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import numpy as np
+from stellate.lazy import LazyModule
+
+# Heavy dependencies are imported on first use
+pd = LazyModule('pandas')
+fits = LazyModule('astropy.io.fits')
+special = LazyModule('scipy.special')
+sktransform = LazyModule('skimage.transform')
+
+# Gaussian sigma to FWHM
+FWHM_SIGMA = 2.0 * np.sqrt(2.0 * np.log(2.0))
+
+# Largest frame generated (pixels)
+MAX_PIXELS = 100e6
+
+
+class SyntheticField:
+
+    def __init__(self, shape=(2000, 3000), density=200.0, flux_range=(200.0, 2e5), flux_index=1.5,
+                 margin=0.1, n_hot=0, hot_range=(2000.0, 30000.0), seed=0):
+        """
+        :param shape: tuple, (ny, nx) frame size in pixels
+        :param density: float, stars per megapixel in the reference frame
+        :param flux_range: tuple, minimum and maximum integrated star flux (ADU)
+        :param flux_index: float, power law index of the cumulative flux distribution N(>F) ~ F^-index
+        :param margin: float, fractional border of extra sky so that shifted frames are still full of stars
+        :param n_hot: int, number of hot pixels on the sensor
+        :param hot_range: tuple, hot pixel levels (ADU)
+        :param seed: int, random seed for the sky and sensor
+        """
+
+        ny, nx = shape
+        if ny * nx > MAX_PIXELS:
+            raise ValueError('Synthetic frames are limited to %d MP' % (MAX_PIXELS / 1e6))
+
+        self.shape = (int(ny), int(nx))
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+
+        # Reference star field over the frame plus margin
+        mx, my = margin * nx, margin * ny
+        n_stars = int(rng.poisson(density * (nx + 2 * mx) * (ny + 2 * my) / 1e6))
+
+        self._x = rng.uniform(-mx, nx + mx, n_stars)
+        self._y = rng.uniform(-my, ny + my, n_stars)
+
+        # Pareto fluxes truncated to the requested range
+        f0, f1 = flux_range
+        u = rng.uniform(0.0, 1.0 - (f0 / f1) ** flux_index, n_stars)
+        self._flux = f0 * (1.0 - u) ** (-1.0 / flux_index)
+
+        # Hot pixels are fixed on the sensor, they do not move with the sky
+        hot_idx = rng.choice(ny * nx, size=min(n_hot, ny * nx), replace=False)
+        self._hot_rows, self._hot_cols = np.unravel_index(np.sort(hot_idx), (ny, nx))
+        self._hot_level = rng.uniform(hot_range[0], hot_range[1], len(hot_idx)).astype(np.float32)
+
+        # Default noise seed for frames rendered without one
+        self._noise_seed = int(rng.integers(2 ** 31))
+
+    def __len__(self):
+        return len(self._flux)
+
+    def stars(self):
+        """
+        Reference star catalog
+
+        :return: Pandas dataframe, xc, yc, flux in reference pixel coordinates
+        """
+
+        return pd.DataFrame(dict([('xc', self._x), ('yc', self._y), ('flux', self._flux)]))
+
+    def hot_pixels(self):
+        """
+        :return: row and column index arrays of the hot pixels
+        """
+        return self._hot_rows, self._hot_cols
+
+    def frame(self, transform=None, distortion=0.0, fwhm=3.0, psf='gaussian', beta=3.0,
+              sky=100.0, gradient=(0.0, 0.0), vignette=0.0, noise_sd=5.0, gain=None,
+              saturation=None, dtype=np.float32, seed=None):
+        """
+        Render one exposure of the field
+
+        :param transform: skimage transform, reference -> frame (None = identity)
+        :param distortion: float, radial distortion k1 applied after the transform, r normalized to the half diagonal
+        :param fwhm: float, PSF FWHM in pixels
+        :param psf: str, 'gaussian' or 'moffat'
+        :param beta: float, Moffat beta
+        :param sky: float, mean sky level (ADU)
+        :param gradient: tuple, (gx, gy) linear sky change across the frame in x and y (ADU)
+        :param vignette: float, fractional sky and star loss at the corners (quadratic falloff)
+        :param noise_sd: float, read noise standard deviation (ADU)
+        :param gain: float, e-/ADU for shot noise (Gaussian approximation), None for read noise only
+        :param saturation: float, clip level (ADU), None for no clipping
+        :param dtype: numpy dtype, float32 or uint16
+        :param seed: int, random seed for the noise (default derived from the field seed)
+        :return: image, 2D array; truth, dict
+        """
+
+        ny, nx = self.shape
+        rng = np.random.default_rng(self._noise_seed if seed is None else seed)
+
+        if transform is None:
+            transform = sktransform.AffineTransform()
+
+        # Star positions in the frame
+        xy = transform(np.column_stack([self._x, self._y]))
+        xy = radial_distortion(xy, distortion, self.shape)
+        x, y = xy[:, 0], xy[:, 1]
+
+        # Stars whose PSF touches the frame
+        pad = 4.0 * fwhm
+        inside = (x > -pad) & (x < nx - 1 + pad) & (y > -pad) & (y < ny - 1 + pad)
+        x, y, flux = x[inside], y[inside], self._flux[inside]
+
+        # Vignetting attenuates stars and sky alike
+        flux = flux * (1.0 - vignette * _corner_distance2(x, y, self.shape))
+
+        img = np.empty([ny, nx], dtype=np.float32)
+        _fill_sky(img, sky, gradient, vignette)
+
+        render_stars(img, x, y, flux, fwhm, psf, beta)
+
+        _add_noise(img, noise_sd, gain, rng)
+
+        img[self._hot_rows, self._hot_cols] = self._hot_level
+
+        if saturation is not None:
+            np.minimum(img, saturation, out=img)
+
+        if np.dtype(dtype) == np.uint16:
+            img = np.clip(np.rint(img), 0, 65535).astype(np.uint16)
+        else:
+            img = img.astype(dtype, copy=False)
+
+        on_frame = (x >= 0.0) & (x <= nx - 1) & (y >= 0.0) & (y <= ny - 1)
+
+        truth = dict([
+            ('transform', transform),
+            ('distortion', distortion),
+            ('fwhm', fwhm),
+            ('psf', psf),
+            ('sky', sky),
+            ('noise_sd', noise_sd),
+            ('stars', pd.DataFrame(dict([('xc', x[on_frame]), ('yc', y[on_frame]), ('flux', flux[on_frame])]))),
+        ])
+
+        return img, truth
+
+    def stack(self, n_frames, max_shift=20.0, max_rot=1.0, max_scale=0.0, seed=None, **kwargs):
+        """
+        Generator over frames with random transforms (the first frame is the reference)
+
+        :param n_frames: int, number of frames
+        :param max_shift: float, maximum shift in pixels
+        :param max_rot: float, maximum rotation in degrees
+        :param max_scale: float, maximum fractional scale change
+        :param seed: int, random seed for transforms and noise
+        :param kwargs: further frame() arguments
+        :return: yields (image, truth)
+        """
+
+        rng = np.random.default_rng(seed)
+
+        for ic in range(n_frames):
+
+            if ic == 0:
+                T = sktransform.AffineTransform()
+            else:
+                T = random_transform(rng, max_shift, max_rot, max_scale)
+
+            yield self.frame(T, seed=rng.integers(2 ** 31), **kwargs)
+
+    def write_stack(self, dname, n_frames, prefix='synth', write_catalogs=True, seed=None, **kwargs):
+        """
+        Write a stack of FITS frames and its ground truth
+
+        The truth JSON (<prefix>_truth.json) has the layout written by AstroStack.save_transforms,
+        plus the per-frame PSF and noise settings, so it can be loaded with load_transforms.
+
+        :param dname: str, output directory
+        :param n_frames: int, number of frames
+        :param prefix: str, frame filename prefix
+        :param write_catalogs: bool, also write the true in-frame star positions beside each frame
+        :param seed: int, random seed
+        :param kwargs: further stack() and frame() arguments
+        :return: list of str, FITS filenames
+        """
+
+        os.makedirs(dname, exist_ok=True)
+
+        fnames, frames = [], []
+        for ic, (img, truth) in enumerate(self.stack(n_frames, seed=seed, **kwargs)):
+
+            fname = os.path.join(dname, '%s_%04d.fits' % (prefix, ic))
+            write_fits(fname, img, truth)
+
+            if write_catalogs:
+                truth['stars'].to_json(fname.replace('.fits', '_truth.json'))
+
+            fnames.append(fname)
+            frames.append(dict([
+                ('file', fname),
+                ('params', np.asarray(truth['transform'].params).tolist()),
+                ('inlier_frac', 1.0),
+                ('distortion', truth['distortion']),
+                ('fwhm', truth['fwhm']),
+                ('noise_sd', truth['noise_sd']),
+                ('n_stars', len(truth['stars'])),
+            ]))
+
+        with open(os.path.join(dname, '%s_truth.json' % prefix), 'w') as fd:
+            json.dump(dict([('ref_index', 0), ('frames', frames)]), fd, indent=2)
+
+        return fnames
+
+
+def random_transform(rng, max_shift=20.0, max_rot=1.0, max_scale=0.0):
+    """
+    Random similarity transform (uniform shift, rotation and scale within the limits)
+
+    :param rng: numpy Generator
+    :return: AffineTransform, reference -> frame
+    """
+
+    return sktransform.AffineTransform(
+        scale=1.0 + rng.uniform(-max_scale, max_scale),
+        rotation=np.deg2rad(rng.uniform(-max_rot, max_rot)),
+        translation=rng.uniform(-max_shift, max_shift, 2))
+
+
+def radial_distortion(xy, k1, shape):
+    """
+    Barrel (k1 < 0) or pincushion (k1 > 0) distortion about the frame center
+
+    :param xy: (n, 2) array, x, y positions
+    :param k1: float, distortion coefficient, radius normalized to the half diagonal
+    :param shape: tuple, (ny, nx) frame size
+    :return: (n, 2) array, distorted positions
+    """
+
+    if k1 == 0.0:
+        return xy
+
+    ny, nx = shape
+    c = np.array([(nx - 1) / 2.0, (ny - 1) / 2.0])
+    r_norm = 0.5 * np.hypot(nx, ny)
+
+    d = (xy - c) / r_norm
+    r2 = np.sum(d ** 2, axis=1, keepdims=True)
+
+    return c + d * (1.0 + k1 * r2) * r_norm
+
+
+def render_stars(img, x, y, flux, fwhm, psf='gaussian', beta=3.0, chunk=20000):
+    """
+    Add pixel-integrated star profiles to an image in place
+
+    :param img: 2D float32 array
+    :param x: array, star x positions (pixel centers at integers)
+    :param y: array, star y positions
+    :param flux: array, integrated fluxes
+    :param fwhm: float, PSF FWHM in pixels
+    :param psf: str, 'gaussian' or 'moffat'
+    :param beta: float, Moffat beta
+    :param chunk: int, stars rendered per batch
+    """
+
+    ny, nx = img.shape
+
+    if psf == 'gaussian':
+        hw = int(np.ceil(2.5 * fwhm))
+    elif psf == 'moffat':
+        hw = int(np.ceil(4.0 * fwhm))
+    else:
+        raise ValueError('Unknown PSF %s' % psf)
+
+    offs = np.arange(-hw, hw + 1)
+    flat = img.reshape(-1)
+
+    for i0 in range(0, len(x), chunk):
+
+        xs, ys, fs = x[i0:i0 + chunk], y[i0:i0 + chunk], flux[i0:i0 + chunk]
+
+        # Stamp pixel coordinates for each star (n, s)
+        xi = np.rint(xs).astype(int)[:, None] + offs
+        yi = np.rint(ys).astype(int)[:, None] + offs
+
+        if psf == 'gaussian':
+            stamps = _gauss_pixel(xi - xs[:, None], fwhm)[:, None, :] * \
+                     _gauss_pixel(yi - ys[:, None], fwhm)[:, :, None]
+        else:
+            stamps = _moffat(xi - xs[:, None], yi - ys[:, None], fwhm, beta)
+
+        stamps *= fs[:, None, None]
+
+        # Drop stamp pixels that fall off the frame
+        yy = np.broadcast_to(yi[:, :, None], stamps.shape)
+        xx = np.broadcast_to(xi[:, None, :], stamps.shape)
+        ok = (xx >= 0) & (xx < nx) & (yy >= 0) & (yy < ny)
+
+        np.add.at(flat, yy[ok] * nx + xx[ok], stamps[ok].astype(np.float32))
+
+
+def write_fits(fname, img, truth=None):
+    """
+    Write a synthetic frame with its truth summary in the header
+
+    :param fname: str, output FITS filename
+    :param img: 2D array
+    :param truth: dict, from SyntheticField.frame()
+    """
+
+    hdr = fits.Header()
+    hdr['SYNTH'] = (True, 'Stellate synthetic frame')
+
+    if truth is not None:
+        hdr['TFWHM'] = (float(truth['fwhm']), 'True PSF FWHM (pixels)')
+        hdr['TPSF'] = (truth['psf'], 'True PSF profile')
+        hdr['TSKY'] = (float(truth['sky']), 'True mean sky level')
+        hdr['TNOISE'] = (float(truth['noise_sd']), 'True read noise SD')
+        hdr['TDISTK1'] = (float(truth['distortion']), 'True radial distortion k1')
+        hdr['TNSTARS'] = (len(truth['stars']), 'Stars centered in frame')
+        for r in range(2):
+            for c in range(3):
+                hdr['TMAT%d%d' % (r, c)] = (float(truth['transform'].params[r, c]), 'True ref -> frame affine')
+
+    fits.PrimaryHDU(img, header=hdr).writeto(fname, overwrite=True)
+
+
+# Internal methods
+
+def _gauss_pixel(d, fwhm):
+    """
+    Fraction of a unit 1D Gaussian falling in pixels at offsets d from the center
+    """
+
+    s = np.sqrt(2.0) * fwhm / FWHM_SIGMA
+    return 0.5 * (special.erf((d + 0.5) / s) - special.erf((d - 0.5) / s))
+
+
+def _moffat(dx, dy, fwhm, beta):
+    """
+    Unit-flux Moffat profile sampled at pixel centers, stamps of shape (n, s, s)
+    """
+
+    alpha = fwhm / (2.0 * np.sqrt(2.0 ** (1.0 / beta) - 1.0))
+    r2 = dx[:, None, :] ** 2 + dy[:, :, None] ** 2
+
+    return (beta - 1.0) / (np.pi * alpha ** 2) * (1.0 + r2 / alpha ** 2) ** -beta
+
+
+def _corner_distance2(x, y, shape):
+    """
+    Squared distance from the frame center, 1 at the corners
+    """
+
+    ny, nx = shape
+    return ((x - (nx - 1) / 2.0) ** 2 + (y - (ny - 1) / 2.0) ** 2) / (0.25 * (nx ** 2 + ny ** 2))
+
+
+def _fill_sky(img, sky, gradient, vignette, rows=1024):
+    """
+    Sky with linear gradient and vignetting, filled in row strips
+    """
+
+    ny, nx = img.shape
+    gx, gy = gradient
+
+    xv = np.arange(nx, dtype=np.float32)
+    sky_x = (sky + gx * (xv / max(nx - 1, 1) - 0.5)).astype(np.float32)
+
+    for r0 in range(0, ny, rows):
+        r1 = min(r0 + rows, ny)
+        yv = np.arange(r0, r1, dtype=np.float32)[:, None]
+        img[r0:r1] = sky_x + np.float32(gy) * (yv / max(ny - 1, 1) - 0.5)
+        if vignette:
+            img[r0:r1] *= 1.0 - np.float32(vignette) * _corner_distance2(xv[None, :], yv, img.shape)
+
+
+def _add_noise(img, noise_sd, gain, rng, rows=1024):
+    """
+    Read noise plus optional Gaussian-approximated shot noise, added in row strips
+    """
+
+    ny, nx = img.shape
+
+    for r0 in range(0, ny, rows):
+        r1 = min(r0 + rows, ny)
+        sd = np.float32(noise_sd)
+        if gain:
+            sd = np.sqrt(noise_sd ** 2 + np.maximum(img[r0:r1], 0.0) / gain).astype(np.float32)
+        img[r0:r1] += sd * rng.standard_normal((r1 - r0, nx), dtype=np.float32)